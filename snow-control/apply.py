@@ -1,34 +1,59 @@
 from control_state import ControlState
+from scheduler import run_apply_schedule
+from grant_cache import invalidate_grant_snapshots
 from styling import GREEN_CHECKMARK, RED_X, print_execution
-from functools import reduce
+from tracing import traced_execute
 from typing import Tuple,Callable
 import snowflake.connector.errors as snow_errors
+import json
 
-def apply(state:ControlState, executables:list[str], plan_id:int, method = 'seq'):
+# Statements packed into a single Snowflake Scripting block by apply(method = 'batch')
+DEFAULT_BATCH_SIZE = 200
+
+def apply(state:ControlState, queries:list[tuple], plan_id:int, method = 'seq', batch_size = DEFAULT_BATCH_SIZE):
+    """
+        Execute the statements generated by gen_queries:
+            seq:    one at a time, in plan order
+            batch:  {batch_size} statements per round trip (see gen_batch_block)
+            conc:   concurrently, in dependency order with retries (see scheduler.run_apply_schedule)
+        The grant snapshots of every role a statement was sent for are dropped afterwards (see grant_cache.py)
+    """
+    assert method != 'batch' or batch_size >= 1, f'The batch size has to be at least 1, not {batch_size}'
+    executables = [' '.join(q) for q in queries]
     cur = state.connection.cursor()
     current_role = list(cur.execute('SELECT CURRENT_ROLE()'))[0][0]
     grant_results = {}
     if current_role != 'ACCOUNTADMIN':
         print('Control plans can only be executed by an ACCOUNTADMIN') # TODO: change? "CONTROL ROLE"
         return 
-    if method == 'seq':
-        for query in executables:
-            qid, result = sequential_query_execute(state = state, executable_query = query)
-            grant_results[qid] = {
-                'text':query,
-                'result':result
-            }
-            if result:
-                print('\n')
-            else:
-                print(GREEN_CHECKMARK)
-    else:
-        single_grant_func = lambda q: execute_and_retrieve_grant_result(state,q)
-        result_iterator = state.executor.map(single_grant_func,executables)
-        grant_results = reduce(lambda x,y: x|y, result_iterator)
-        for qid,info in grant_results.items():
-            result_symbol = RED_X if info['result'] else GREEN_CHECKMARK
-    
+    try:
+        if method == 'seq':
+            for position, query in enumerate(executables):
+                qid, result = sequential_query_execute(state = state, executable_query = query)
+                grant_results[position] = {
+                    'qid':qid,
+                    'text':query,
+                    'result':result
+                }
+                if result:
+                    print('\n')
+                else:
+                    print(GREEN_CHECKMARK)
+        elif method == 'batch':
+            for start in range(0, len(executables), batch_size):
+                batch_results = batch_query_execute(state, executables[start:start + batch_size])
+                for i, info in batch_results.items():
+                    print_execution(info['text'], success = '-' if info['result'] else '+')
+                    grant_results[start + i] = info
+        else:
+            grant_results = run_apply_schedule(state, queries)
+    finally:
+        # sent statements may have gone through even if apply didn't finish
+        invalidate_grant_snapshots(state.account, statement_roles(queries))
+
+def statement_roles(queries:list[tuple]) -> set[str]:
+    return {query[-1] for query in queries if query[-2] in ('TO ROLE','FROM ROLE')}
+
 def snowflake_query_error_handling(query_calling_function:Callable):
     try:
         query_calling_function()
@@ -42,7 +67,7 @@ def sequential_query_execute(state:ControlState, executable_query:str, print_seq
     result = -1
     cursor = state.connection.cursor()
     try:
-        cursor.execute(executable_query)
+        traced_execute(cursor, executable_query, 'apply', cat = 'statement', statement = executable_query)
         if print_seq:
             print_execution(executable_query, success = '+')
         result = 0 
@@ -53,6 +78,54 @@ def sequential_query_execute(state:ControlState, executable_query:str, print_seq
     finally:
         return (cursor.sfqid,result)
 
+def gen_batch_block(executables:list[str]) -> str:
+    """
+        Wrap statements into one anonymous Snowflake Scripting block. Every statement runs in its own
+        BEGIN ... EXCEPTION ... END so a failing statement doesn't stop the rest of the batch, and its 
+        SQLCODE (0 on success) is appended to the array the block returns
+    """
+    statements = '\n'.join(
+        f"""
+    BEGIN
+        {executable};
+        results := ARRAY_APPEND(results, 0);
+    EXCEPTION
+        WHEN OTHER THEN
+            results := ARRAY_APPEND(results, SQLCODE);
+    END;"""
+        for executable in executables
+    )
+    return f"""EXECUTE IMMEDIATE $$
+DECLARE
+    results ARRAY DEFAULT ARRAY_CONSTRUCT();
+BEGIN{statements}
+    RETURN results;
+END;
+$$"""
+
+def batch_query_execute(state:ControlState, executables:list[str]) -> dict:
+    """
+        Run a batch of statements in a single round trip (see gen_batch_block).
+        Returns {position in batch: {qid, text, result}}, where every statement shares the block's query id.
+        If the block itself fails (it doesn't compile, times out, ...), its statements are run one at a time instead
+    """
+    cursor = state.connection.cursor()
+    try:
+        row = traced_execute(cursor, gen_batch_block(executables), 'apply batch', cat = 'statement', statements = len(executables)).fetchone()
+        errnos = json.loads(row[0]) if isinstance(row[0], str) else list(row[0])
+        results = [(cursor.sfqid, errno) for errno in errnos]
+    except snow_errors.Error as error:
+        state.print(f'Batch of {len(executables)} statements failed ({error.errno}), running them one at a time', verbosity_level = 1)
+        results = [sequential_query_execute(state, executable_query, print_seq = False) for executable_query in executables]
+    return {
+        i:{
+            'qid':qid,
+            'text':executable_query,
+            'result':errno
+        }
+        for i, (executable_query, (qid, errno)) in enumerate(zip(executables, results))
+    }
+
 def execute_and_retrieve_grant_result(state:ControlState, executable_query:str) -> Tuple[str,int]:
     cursor = state.connection.cursor()
     qid, errno = sequential_query_execute(state,executable_query,print_seq=False )
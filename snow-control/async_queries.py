@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable
+from tracing import TRACER, span
+
+# Seconds before the first status check of a running query, doubled after every check up to MAX_POLL_INTERVAL:
+# metadata queries mostly finish within tens of milliseconds, long ones aren't polled more than 4 times a second
+FIRST_POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.25
+# Queries in flight at once, per pipeline
+MAX_IN_FLIGHT = 100
+
+
+async def wait_for_query(conn, qid:str) -> None:
+    """
+        Poll the status of an async query until it finishes, raising the query's error if it failed
+    """
+    interval = FIRST_POLL_INTERVAL
+    while conn.is_still_running(await asyncio.to_thread(conn.get_query_status, qid)):
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    await asyncio.to_thread(conn.get_query_status_throw_if_error, qid)
+
+async def run_async_query(conn, query:str, operation:str = 'async query'):
+    """
+        Submit {query} without blocking on it (execute_async), wait for it to finish and
+        return a cursor positioned on its results
+    """
+    cur = conn.cursor()
+    # Coroutines overlap on the event loop's thread, each query gets a trace lane of its own
+    with span(operation, cat = 'query', lane = TRACER.lane()) as current:
+        statement_params = TRACER.statement_params(operation)
+        TRACER.tag_span(current, statement_params)
+        await asyncio.to_thread(cur.execute_async, query, **statement_params)
+        qid = cur.sfqid
+        current.set(qid = qid)
+        await wait_for_query(conn, qid)
+        await asyncio.to_thread(cur.get_results_from_sfqid, qid)
+        current.set(rows = getattr(cur, 'rowcount', None))
+    return cur
+
+async def show_then_scan(conn, show_query:str, follow_up:Callable[[str],str], fetch:Callable, in_flight:asyncio.Semaphore, name:str = 'async'):
+    """
+        SHOW, then the result_scan follow up on its query id as soon as the SHOW finishes
+        (no follow up: the SHOW results are fetched directly)
+    """
+    async with in_flight:
+        cur = await run_async_query(conn, show_query, f'show {name}')
+        if follow_up:
+            cur = await run_async_query(conn, follow_up(cur.sfqid), f'result_scan {name}')
+        return await asyncio.to_thread(fetch, cur)
+
+async def _run_pipeline(conn, jobs:dict) -> dict:
+    # Every job in flight makes one blocking call at a time: the default executor (min(32, cpus + 4) threads)
+    # would queue them behind each other. asyncio.run shuts this one down with the loop
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers = min(MAX_IN_FLIGHT, len(jobs)), thread_name_prefix = 'async-query')
+    )
+    in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+    keys = list(jobs)
+    results = await asyncio.gather(*(show_then_scan(conn, *jobs[key], in_flight, name = job_name(key)) for key in keys))
+    return dict(zip(keys, results))
+
+def run_pipeline(conn, jobs:dict[Hashable,tuple]) -> dict:
+    """
+        Run every {key: (show query, follow up, fetch)} job concurrently on one connection:
+        all SHOW statements are submitted with execute_async up front, each result_scan follow up
+        (follow_up(show query id) -> query text) is submitted the moment its SHOW finishes and
+        fetch(cursor) reads the follow up's results. Returns {key: fetch result}.
+
+        Every query is in flight on the server at once, the client only blocks a thread pool of up to
+        MAX_IN_FLIGHT threads (asyncio.to_thread) for the submissions, status checks and result downloads
+    """
+    if not jobs:
+        return {}
+    return asyncio.run(_run_pipeline(conn, jobs))
+
+def job_name(key:Hashable) -> str:
+    return ' '.join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+def fetch_pandas(cur):
+    return cur.fetch_pandas_all()
+
+def fetch_rows(cur):
+    return cur.fetchall()
@@ -0,0 +1,9 @@
+"""
+    Offline benchmarks of the get/plan/sql/apply pipeline against a synthetic account:
+
+        synthetic.py        generates an account (objects, grants, roles, profiles, users) and its config files
+        fake_connector.py   an in-process stand-in for snowflake.connector answering the queries in queries.py
+        runner.py           runs each stage with each method and reports wall time, queries and peak memory
+
+    Run from snow-control/:  python -m benchmark --help
+"""
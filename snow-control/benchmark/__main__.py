@@ -0,0 +1,3 @@
+from benchmark.runner import main
+
+main()
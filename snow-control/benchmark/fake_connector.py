@@ -0,0 +1,314 @@
+import re
+import json
+import time
+import threading
+import itertools
+import pandas as pd
+from collections import Counter
+from snowflake.connector.errors import ProgrammingError
+from benchmark.synthetic import SyntheticAccount, SHOW_COLUMNS, GRANT_COLUMNS, FUTURE_GRANT_COLUMNS, USER_GRANT_COLUMNS
+
+SHOW_OBJECTS = re.compile(
+    r'^show (?P<type>[a-z ]+?)s(?: in (?P<scope>account|database "(?P<db>[^"]+)"|schema "(?P<sdb>[^"]+)"\."(?P<schema>[^"]+)"))?'
+    r'(?: limit (?P<limit>\d+)(?: from \'(?P<start>(?:[^\']|\'\')*)\')?)?$'
+)
+# Like Snowflake, only these SHOW commands accept LIMIT ... FROM (SHOW FUNCTIONS, STAGES, PIPES, ... are a syntax error)
+LIMIT_TYPES = {'database','schema','table','dynamic table','view','materialized view','external table','task','stream'}
+RESULT_SCAN = re.compile(r"^select (?P<select>.*) from table\(result_scan\('(?P<qid>[^']+)'\)\)(?: where (?P<where>.*))?$", re.IGNORECASE)
+CALL = re.compile(r'^(?P<function>[a-z_]+)\((?P<args>.*)\)$', re.IGNORECASE)
+ALIAS = re.compile(r'^(?P<expression>.*) as (?P<alias>[a-z_]+)$', re.IGNORECASE)
+COMPARISON = re.compile(r'^(?P<left>.*?) (?P<operator>not like|like|not in|in|!=|>=|=) (?P<right>.*)$', re.IGNORECASE)
+TIMESTAMP = re.compile(r"^(?P<literal>'.*')::timestamp_tz$", re.IGNORECASE)
+BATCH_STATEMENT = 'results := ARRAY_APPEND(results, 0)'
+
+
+def rows_of(frame:pd.DataFrame) -> list[tuple]:
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index = False, name = None))
+
+
+class FakeSnowflake:
+    """
+        In-process stand-in for the Snowflake service, answering the queries control issues
+        (queries.py, the SHOW commands, grants and the apply statements) from a SyntheticAccount.
+
+            latency         seconds every query waits before its results are available (network + compilation)
+            statement_time  extra seconds per GRANT/REVOKE statement executed (so batches cost more than a single statement)
+
+        Every query is counted by kind in .counts (show, result_scan, account_usage, grant, revoke, batch, other)
+        along with the rows it returned
+    """
+    def __init__(self, account:SyntheticAccount, latency:float = 0.0, statement_time:float = 0.0):
+        self.account = account
+        self.latency = latency
+        self.statement_time = statement_time
+        self.counts = Counter()
+        self.results = {}
+        self._ready_at = {}
+        self._frames = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def connect(self) -> 'FakeConnection':
+        return FakeConnection(self)
+
+    def reset_counts(self) -> Counter:
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def submit(self, query:str) -> tuple[str,float]:
+        """
+            Run {query}, returning (query id, seconds until its results are ready)
+        """
+        kind, frame, statements = self.run(' '.join(query.split()))
+        qid = f'fake-{next(self._ids):08d}'
+        delay = self.latency + statements * self.statement_time
+        with self._lock:
+            self.counts[kind] += 1
+            self.counts['rows'] += len(frame)
+            self.results[qid] = frame
+            self._ready_at[qid] = time.monotonic() + delay
+        return qid, delay
+
+    def is_ready(self, qid:str) -> bool:
+        return time.monotonic() >= self._ready_at[qid]
+
+    def run(self, query:str) -> tuple[str,pd.DataFrame,int]:
+        """
+            (kind, results, GRANT/REVOKE statements executed) of a whitespace normalized query
+        """
+        lowered = query.lower()
+        if 'result_scan' in lowered:
+            return 'result_scan', self.result_scan(query), 0
+        if 'account_usage.grants_to_roles' in lowered:
+            return 'account_usage', pd.DataFrame(self.account.account_usage_grants(), columns = ['GRANTEE_NAME','PRIVILEGE','GRANTED_ON','TABLE_CATALOG','TABLE_SCHEMA','NAME']), 0
+        if lowered.startswith('show grants to role '):
+            return 'show', self.frame(self.account.grants.get(query.split()[-1].upper(), []), GRANT_COLUMNS), 0
+        if lowered.startswith('show future grants to role '):
+            return 'show', self.frame(self.account.future_grants.get(query.split()[-1].upper(), []), FUTURE_GRANT_COLUMNS), 0
+        if lowered.startswith('show grants to user '):
+            return 'show', self.frame(self.account.user_roles.get(query.split()[-1].strip('"'), []), USER_GRANT_COLUMNS), 0
+        if lowered.startswith('show '):
+            return 'show', self.show_objects(query), 0
+        if lowered.startswith('execute immediate'):
+            statements = query.count(BATCH_STATEMENT)
+            return 'batch', pd.DataFrame({'anonymous block': [json.dumps([0] * statements)]}), statements
+        if lowered.startswith('grant ') or lowered.startswith('revoke '):
+            return lowered.split()[0], pd.DataFrame({'status': ['Statement executed successfully.']}), 1
+        if lowered.startswith('select current_role()'):
+            return 'other', pd.DataFrame({'CURRENT_ROLE()': ['ACCOUNTADMIN']}), 0
+        if lowered.startswith('select 1') or lowered.startswith('alter session'):
+            return 'other', pd.DataFrame({'1': [1]}), 0
+        raise ProgrammingError(msg = f'Unsupported query in fake connector: {query[:200]}', errno = 2000)
+
+    def frame(self, rows:list[dict], columns:list[str]) -> pd.DataFrame:
+        return pd.DataFrame(rows, columns = columns, dtype = object)
+
+    def objects_frame(self, obj_type:str) -> pd.DataFrame:
+        key = (obj_type, self.account.version)
+        if key not in self._frames:
+            self._frames[key] = self.frame(self.account.objects[obj_type], SHOW_COLUMNS[obj_type]).sort_values('name', kind = 'stable', ignore_index = True)
+        return self._frames[key]
+
+    def show_objects(self, query:str) -> pd.DataFrame:
+        match = SHOW_OBJECTS.match(query)
+        if not match or match['type'] not in SHOW_COLUMNS:
+            raise ProgrammingError(msg = f'Unsupported SHOW in fake connector: {query}', errno = 2000)
+        obj_type = match['type']
+        if match['limit'] and obj_type not in LIMIT_TYPES:
+            raise ProgrammingError(msg = f"SQL compilation error: syntax error unexpected 'limit' in {query}", errno = 1003)
+        frame = self.objects_frame(obj_type)
+        container = 'catalog_name' if obj_type in ('function','procedure') else 'database_name'
+        if match['db']:
+            frame = frame[frame[container] == match['db']]
+        elif match['sdb']:
+            frame = frame[(frame[container] == match['sdb']) & (frame['schema_name'] == match['schema'])]
+        if match['start'] is not None:
+            frame = frame[frame['name'] >= match['start'].replace("''","'")]
+        if match['limit']:
+            frame = frame.head(int(match['limit']))
+        return frame.reset_index(drop = True)
+
+    def result_scan(self, query:str) -> pd.DataFrame:
+        match = RESULT_SCAN.match(query)
+        if not match:
+            raise ProgrammingError(msg = f'Unsupported result_scan in fake connector: {query[:200]}', errno = 2000)
+        return ResultScan(match['select'], match['where']).run(self.results[match['qid']])
+
+
+def split_top_level(text:str, separator:str) -> list[str]:
+    """
+        {text} split on {separator} outside of quotes and parentheses
+    """
+    parts, depth, quote, start, i = [], 0, None, 0, 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0 and text.startswith(separator, i):
+            parts.append(text[start:i].strip())
+            start = i = i + len(separator)
+            continue
+        i += 1
+    return parts + [text[start:].strip()]
+
+def like(value:str, pattern:str) -> bool:
+    # SQL LIKE: case sensitive, anchored, % is any string and _ any single character
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern)
+    return re.fullmatch(regex, value, re.DOTALL) is not None
+
+
+class ResultScan:
+    """
+        Evaluates the select list and where clause of a result_scan query row by row with SQL semantics,
+        independently of the client side versions in show_results.py that fetch_mode = 'local' uses:
+        a comparison involving NULL filters the row out, and concat_ws is NULL if any argument is
+    """
+    def __init__(self, select:str, where:str = None):
+        self.columns = [self.output(item) for item in split_top_level(select, ',')]
+        self.conditions = [self.condition(condition) for condition in split_top_level(where, ' and ')] if where else []
+
+    def output(self, item:str) -> tuple:
+        match = ALIAS.match(item)
+        if match:
+            return match['alias'].upper(), self.expression(match['expression'])
+        return (item.strip('"') if item.startswith('"') else item.upper()), self.expression(item)
+
+    def expression(self, text:str):
+        text = text.strip()
+        if text.startswith('"') and text.endswith('"'):
+            column = text[1:-1]
+            return lambda row: row[column]
+        if text.startswith("'") and text.endswith("'"):
+            literal = text[1:-1].replace("''","'")
+            return lambda row: literal
+        match = TIMESTAMP.match(text)
+        if match:
+            timestamp = pd.Timestamp(match['literal'][1:-1])
+            return lambda row: timestamp
+        match = COMPARISON.match(text)
+        if match:
+            return self.condition(text)
+        match = CALL.match(text)
+        if not match:
+            raise ProgrammingError(msg = f'Unsupported expression in fake connector: {text}', errno = 2000)
+        function = match['function'].lower()
+        args = [self.expression(arg) for arg in split_top_level(match['args'], ',')]
+        if function == 'concat_ws':
+            separator, parts = args[0], args[1:]
+            def concat_ws(row):
+                values = [part(row) for part in parts]
+                return None if any(value is None for value in values) else separator(row).join(values)
+            return concat_ws
+        if function == 'replace':
+            value, old, new = args
+            return lambda row: None if value(row) is None else value(row).replace(old(row), new(row))
+        if function == 'regexp_replace':
+            value, pattern, replacement = args
+            return lambda row: None if value(row) is None else re.sub(pattern(row), replacement(row), value(row))
+        raise ProgrammingError(msg = f'Unsupported function in fake connector: {function}', errno = 2000)
+
+    def condition(self, text:str):
+        match = COMPARISON.match(text.strip())
+        if not match:
+            raise ProgrammingError(msg = f'Unsupported condition in fake connector: {text}', errno = 2000)
+        left, operator = self.expression(match['left']), match['operator'].lower()
+        if operator.endswith('in'):
+            values = {value(None) for value in map(self.expression, split_top_level(match['right'].strip()[1:-1], ','))}
+            test = (lambda value: value in values) if operator == 'in' else (lambda value: value not in values)
+        else:
+            right = self.expression(match['right'])(None) if not match['right'].startswith('"') else None
+            test = {
+                'like': lambda value: like(value, right),
+                'not like': lambda value: not like(value, right),
+                '=': lambda value: value == right,
+                '!=': lambda value: value != right,
+                '>=': lambda value: value >= right,
+            }[operator]
+        def evaluate(row):
+            value = left(row)
+            return None if value is None else test(value)
+        return evaluate
+
+    def run(self, source:pd.DataFrame) -> pd.DataFrame:
+        rows = [dict(zip(source.columns, values)) for values in rows_of(source)]
+        kept = [row for row in rows if all(condition(row) is True for condition in self.conditions)]
+        return pd.DataFrame([[expression(row) for _, expression in self.columns] for row in kept], columns = [name for name, _ in self.columns], dtype = object)
+
+
+class FakeConnection:
+    """
+        Duck-typed snowflake.connector connection on top of a FakeSnowflake
+    """
+    def __init__(self, server:FakeSnowflake):
+        self.server = server
+        self.closed = False
+
+    def cursor(self) -> 'FakeCursor':
+        return FakeCursor(self.server)
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+    def get_query_status(self, qid:str) -> str:
+        return 'SUCCESS' if self.server.is_ready(qid) else 'RUNNING'
+
+    def is_still_running(self, status:str) -> bool:
+        return status == 'RUNNING'
+
+    def get_query_status_throw_if_error(self, qid:str) -> str:
+        return self.get_query_status(qid)
+
+
+class FakeCursor:
+    """
+        Duck-typed snowflake.connector cursor: execute() blocks for the server's latency, execute_async() doesn't
+    """
+    def __init__(self, server:FakeSnowflake):
+        self.server = server
+        self.sfqid = None
+        self.frame = None
+        self.description = None
+        self.rowcount = None
+
+    def execute(self, query:str, **kwargs) -> 'FakeCursor':
+        qid, delay = self.server.submit(query)
+        time.sleep(delay)
+        self.get_results_from_sfqid(qid)
+        return self
+
+    def execute_async(self, query:str, **kwargs) -> dict:
+        self.sfqid, _ = self.server.submit(query)
+        return {'queryId': self.sfqid}
+
+    def get_results_from_sfqid(self, qid:str) -> None:
+        self.sfqid = qid
+        self.frame = self.server.results[qid]
+        self.description = [(column,) for column in self.frame.columns]
+        self.rowcount = len(self.frame)
+
+    def fetchall(self) -> list[tuple]:
+        return rows_of(self.frame)
+
+    def fetchone(self) -> tuple:
+        rows = rows_of(self.frame.head(1))
+        return rows[0] if rows else None
+
+    def fetch_pandas_all(self) -> pd.DataFrame:
+        return self.frame.copy()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self) -> None:
+        pass
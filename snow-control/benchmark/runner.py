@@ -0,0 +1,216 @@
+import os
+import io
+import gc
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from benchmark.synthetic import SyntheticAccount
+
+STAGES = ['get','filter','save','incr','plan','sql','apply']
+# Methods each stage is run with by default ('-' for stages that only have one way of running)
+DEFAULT_METHODS = {
+    'get': ['seq','conc','async','shard'],
+    'filter': ['seq','conc'],
+    'save': ['-'],
+    'incr': ['seq','conc'],
+    'plan': ['seq','conc','proc','async','account_usage'],
+    'sql': ['-','coalesce'],
+    'apply': ['seq','batch','conc'],
+}
+QUERY_KINDS = ['show','result_scan','account_usage','grant','revoke','batch','other']
+
+
+def parse_args(argv:list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog = 'python -m benchmark',
+        description = 'Benchmark get/plan/sql/apply against a synthetic account served by an in-process fake Snowflake'
+    )
+    size = parser.add_argument_group('synthetic account')
+    size.add_argument('--databases', type = int, default = 10)
+    size.add_argument('--schemas', type = int, default = 10, help = 'per database')
+    size.add_argument('--tables', type = int, default = 50, help = 'per schema')
+    size.add_argument('--views', type = int, default = 10, help = 'per schema')
+    size.add_argument('--functions', type = int, default = 5, help = 'per schema')
+    size.add_argument('--procedures', type = int, default = 2, help = 'per schema')
+    size.add_argument('--others', type = int, default = 1, help = 'stages, pipes, tasks, ... per schema')
+    size.add_argument('--roles', type = int, default = 50)
+    size.add_argument('--profiles', type = int, default = 8)
+    size.add_argument('--users', type = int, default = 200)
+    size.add_argument('--new-objects', type = int, default = 100, help = 'tables created before the incr stage')
+    size.add_argument('--seed', type = int, default = 0)
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--stages', nargs = '+', choices = STAGES, default = STAGES)
+    run.add_argument('--methods', nargs = '+', default = [], metavar = 'STAGE=M1,M2',
+                     help = 'override the methods a stage runs with, e.g. plan=conc,async')
+    run.add_argument('--fetch-mode', choices = ['result_scan','local'], default = 'result_scan')
+    run.add_argument('--latency', type = float, default = 0.02, help = 'seconds per query round trip')
+    run.add_argument('--statement-time', type = float, default = 0.001, help = 'seconds per GRANT/REVOKE executed')
+    run.add_argument('--workers', type = int, default = 100, help = 'executor threads')
+    run.add_argument('--pool-size', type = int, default = 8, help = 'connections in the pool')
+    run.add_argument('--no-memory', action = 'store_true', help = "skip tracemalloc (it slows every stage down)")
+    run.add_argument('--config-dir', help = 'where to write the synthetic config (default: a temporary directory)')
+    run.add_argument('--json', help = 'also write the results to this file')
+    run.add_argument('--trace', help = 'record every stage and write a Chrome trace (see tracing.py) to this file')
+    run.add_argument('--verbose', action = 'store_true', help = "don't hide the output of each stage")
+    return parser.parse_args(argv)
+
+def stage_methods(args:argparse.Namespace) -> dict[str,list[str]]:
+    methods = dict(DEFAULT_METHODS)
+    for override in args.methods:
+        stage, _, names = override.partition('=')
+        assert stage in STAGES and names, f'Expected STAGE=M1,M2 with STAGE one of {STAGES}, got {override}'
+        methods[stage] = names.split(',')
+    return methods
+
+
+class Benchmark:
+    """
+        Runs stages against a FakeSnowflake, recording for every (stage, method):
+        wall time, queries by kind, rows returned and peak traced (Python) memory
+    """
+    def __init__(self, server, track_memory:bool = True, verbose:bool = False):
+        self.server = server
+        self.track_memory = track_memory
+        self.verbose = verbose
+        self.results = []
+
+    def measure(self, stage:str, method:str, run):
+        gc.collect()
+        self.server.reset_counts()
+        if self.track_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with redirect_stdout(sys.stdout if self.verbose else io.StringIO()):
+            value = run()
+        seconds = time.perf_counter() - start
+        peak = 0
+        if self.track_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        counts = self.server.reset_counts()
+        rows = counts.pop('rows', 0)
+        result = {
+            'stage': stage,
+            'method': method,
+            'seconds': round(seconds, 4),
+            'queries': sum(counts.values()),
+            'by_kind': dict(counts),
+            'rows': rows,
+            'peak_mb': round(peak / 2**20, 2) if self.track_memory else None,
+        }
+        self.results.append(result)
+        print(format_result(result), flush = True)
+        return value
+
+def format_result(result:dict) -> str:
+    kinds = ' '.join(f'{kind}={result["by_kind"][kind]}' for kind in QUERY_KINDS if result['by_kind'].get(kind))
+    peak = f'{result["peak_mb"]:>9.1f}' if result['peak_mb'] is not None else f'{"-":>9}'
+    return f'{result["stage"]:8} {result["method"]:14} {result["seconds"]:>9.3f} {result["queries"]:>8} {result["rows"]:>9} {peak}   {kinds}'
+
+HEADER = f'{"stage":8} {"method":14} {"seconds":>9} {"queries":>8} {"rows":>9} {"peak MB":>9}   by kind'
+
+
+def main(argv:list[str] = None) -> list[dict]:
+    args = parse_args(argv)
+    methods = stage_methods(args)
+    account = SyntheticAccount(
+        databases = args.databases, schemas = args.schemas, tables = args.tables, views = args.views,
+        functions = args.functions, procedures = args.procedures, others = args.others,
+        roles = args.roles, profiles = args.profiles, users = args.users, seed = args.seed
+    )
+    config_dir = args.config_dir or tempfile.mkdtemp(prefix = 'snow-control-benchmark-')
+    account.write_config(config_dir)
+    # load.py reads its config directory when it is first imported
+    os.environ['CONTROL_CONFIG_DIR'] = config_dir
+    os.environ.setdefault('SNOWFLAKE_ORGANIZATION', 'BENCHMARK')
+
+    from benchmark.fake_connector import FakeSnowflake
+    from control_state import ControlState
+    from connection_pool import ConnectionPool
+    from load import get_ignored_object_patterns, get_plan_from_cache, read_snowcache, get_objects_from_cache
+    from get_objects import object_scan, incremental_object_scan, filter_objects, save_cache
+    from plan import plan
+    from sqlpriv import gen_queries
+    from apply import apply
+    from tracing import TRACER
+
+    server = FakeSnowflake(account, latency = args.latency, statement_time = args.statement_time)
+    state = ControlState(verbosity = 0, max_workers = args.workers)
+    state.account = account.name
+    state.connection = server.connect()
+    state.pool = ConnectionPool(server.connect, size = args.pool_size)
+    state.ignore_objects = get_ignored_object_patterns(account.name)
+    state.fetch_mode = args.fetch_mode
+
+    print(f'Synthetic account {account.name} in {config_dir}: ' + ', '.join(f'{v} {k}' for k,v in account.summary().items()))
+    print(f'latency {args.latency}s, statement time {args.statement_time}s, fetch mode {args.fetch_mode}, '
+          f'{args.workers} workers, pool of {args.pool_size}' + ('' if not args.no_memory else ', memory not traced'))
+    print(HEADER)
+    bench = Benchmark(server, track_memory = not args.no_memory, verbose = args.verbose)
+    if args.trace:
+        TRACER.start('benchmark')
+    stages = [stage for stage in STAGES if stage in args.stages]
+
+    # Stages run on the output of the ones before them. When those aren't benchmarked, they run unmeasured first
+    done = {}
+    def prepare(stage:str, run):
+        if stage not in done:
+            with redirect_stdout(io.StringIO()):
+                done[stage] = run()
+        return done[stage]
+    scanned = lambda: prepare('get', lambda: object_scan(state, 'conc'))
+    filtered = lambda: prepare('filter', lambda: filter_objects(state, dict(scanned()), 'conc'))
+    saved = lambda: prepare('save', lambda: save_cache(state, filtered()) or True)
+    planned = lambda: prepare('plan', lambda: saved() and plan(state, account.name, None, method = 'conc', plan_users = True) or True)
+    generated = lambda: prepare('sql', lambda: planned() and gen_queries(account.name, get_plan_from_cache(account.name)))
+
+    for stage in stages:
+        for method in methods[stage]:
+            if stage == 'get':
+                done[stage] = bench.measure(stage, method, lambda: object_scan(state, method))
+            elif stage == 'filter':
+                objects = scanned()
+                done[stage] = bench.measure(stage, method, lambda: filter_objects(state, dict(objects), method))
+            elif stage == 'save':
+                objects = filtered()
+                done[stage] = bench.measure(stage, method, lambda: save_cache(state, objects)) or True
+            elif stage == 'incr':
+                saved()
+                if method == methods[stage][0]:
+                    account.add_tables(args.new_objects)
+                with redirect_stdout(io.StringIO()):
+                    since, cached = read_snowcache(account.name)
+                bench.measure(stage, method, lambda: incremental_object_scan(state, cached, since, method))
+            elif stage == 'plan':
+                saved()
+                done[stage] = bench.measure(stage, method, lambda: plan(
+                    state, account.name, None,
+                    method = 'conc' if method == 'account_usage' else method,
+                    plan_users = True,
+                    grant_source = 'account_usage' if method == 'account_usage' else 'show'
+                )) or True
+            elif stage == 'sql':
+                planned()
+                with redirect_stdout(io.StringIO()):
+                    objects = get_objects_from_cache(account.name) if method == 'coalesce' else None
+                done[stage] = bench.measure(stage, method, lambda: gen_queries(account.name, get_plan_from_cache(account.name), objects))
+            elif stage == 'apply':
+                queries = generated()
+                plan_id = get_plan_from_cache(account.name)['plan_id']
+                bench.measure(stage, method, lambda: apply(state, queries, plan_id, method))
+
+    state.pool.close()
+    if args.trace:
+        print(f'Trace written to {TRACER.export(os.path.abspath(args.trace))}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'account': account.summary(), 'results': bench.results}, f, indent = 2)
+    return bench.results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+import os
+import random
+import yaml
+from datetime import datetime, timedelta, timezone
+
+# Columns of each SHOW command the pipeline reads (a subset of what Snowflake returns)
+CONTAINED_COLUMNS = ['created_on','name','database_name','schema_name','owner']
+SHOW_COLUMNS = {
+    'warehouse': ['created_on','name','state','size'],
+    'database': ['created_on','name','kind','owner'],
+    'storage integration': ['created_on','name','type','category','enabled'],
+    'notification integration': ['created_on','name','type','category','enabled'],
+    'api integration': ['created_on','name','type','category','enabled'],
+    'schema': ['created_on','name','database_name','owner'],
+    'table': CONTAINED_COLUMNS + ['kind','is_external','rows','bytes'],
+    'dynamic table': CONTAINED_COLUMNS + ['target_lag'],
+    'view': CONTAINED_COLUMNS + ['is_materialized','is_secure','text'],
+    'stage': CONTAINED_COLUMNS + ['url','type'],
+    'pipe': CONTAINED_COLUMNS + ['definition'],
+    'task': CONTAINED_COLUMNS + ['state'],
+    'stream': CONTAINED_COLUMNS + ['table_name'],
+    'tag': CONTAINED_COLUMNS + ['allowed_values'],
+    'file format': CONTAINED_COLUMNS + ['type'],
+    'procedure': ['created_on','name','schema_name','is_builtin','is_aggregate','catalog_name','arguments'],
+    'function': ['created_on','name','schema_name','is_builtin','is_aggregate','catalog_name','arguments'],
+}
+GRANT_COLUMNS = ['created_on','privilege','granted_on','name','granted_to','grantee_name','grant_option','granted_by']
+FUTURE_GRANT_COLUMNS = ['created_on','privilege','grant_on','name','grant_to','grantee_name','grant_option']
+USER_GRANT_COLUMNS = ['created_on','role','granted_to','grantee_name','granted_by']
+
+# (arguments as SHOW FUNCTIONS lists them, arguments as SHOW GRANTS names them, return type)
+# Deliberately irregular: empty/optional arguments, table functions, parameterized and nested types
+FUNCTION_SIGNATURES = [
+    ('', '', 'NUMBER'),
+    ('VARCHAR, NUMBER', 'A VARCHAR, B NUMBER', 'VARCHAR'),
+    ('ARRAY, OBJECT, VARIANT', 'A ARRAY, B OBJECT, C VARIANT', 'TABLE (ID NUMBER, NAME VARCHAR)'),
+    ('TIMESTAMP_NTZ, [FLOAT]', 'TS TIMESTAMP_NTZ, F FLOAT', 'BOOLEAN'),
+    ('VECTOR(FLOAT, 256)', 'V VECTOR(FLOAT, 256)', 'FLOAT'),
+    ('GEOGRAPHY', 'G GEOGRAPHY', 'OBJECT'),
+]
+OTHER_CONTAINED_TYPES = ['dynamic table','stage','pipe','task','stream','tag','file format']
+
+ATOMIC_GROUPS = {
+    'account': {'monitor': ['monitor usage'], 'execute': ['execute task']},
+    'warehouse': {'use': ['usage'], 'operate': ['operate','monitor']},
+    'database': {'use': ['usage'], 'monitor': ['monitor']},
+    'schema': {'use': ['usage'], 'monitor': ['monitor']},
+    'table': {'read': ['select','references'], 'write': ['insert','update','delete','truncate']},
+    'external table': {'read': ['select','references']},
+    'view': {'read': ['select','references']},
+    'materialized view': {'read': ['select','references']},
+    'dynamic table': {'read': ['select'], 'operate': ['operate','monitor']},
+    'function': {'use': ['usage']},
+    'procedure': {'use': ['usage']},
+    'internal stage': {'read': ['read'], 'write': ['read','write']},
+    'external stage': {'use': ['usage']},
+    'file format': {'use': ['usage']},
+    'stream': {'read': ['select']},
+    'task': {'operate': ['operate','monitor']},
+    'pipe': {'operate': ['operate','monitor']},
+    'tag': {'apply': ['apply']},
+    'integration': {'use': ['usage']},
+}
+
+# Role profile archetypes, {db} is filled in per role and {schemas} per profile variant
+PROFILE_ARCHETYPES = {
+    'reader': {
+        'database': {'use': ['{db}']},
+        'schema': {'use': ['{db}.{schemas}']},
+        'table': {'read': ['{db}.{schemas}.*']},
+        'view': {'read': ['{db}.{schemas}.*']},
+    },
+    'writer': {
+        'database': {'use': ['{db}']},
+        'schema': {'use': ['{db}.{schemas}']},
+        'table': {'read': ['{db}.{schemas}.*'], 'write': ['{db}.{schemas}.*']},
+        'view': {'read': ['{db}.{schemas}.*']},
+        'internal stage': {'write': ['{db}.{schemas}.*']},
+    },
+    'developer': {
+        'database': {'use': ['{db}']},
+        'schema': {'use': ['{db}.{schemas}']},
+        'table': {'read': ['{db}.{schemas}.*']},
+        'view': {'read': ['{db}.{schemas}.*']},
+        'materialized view': {'read': ['{db}.{schemas}.*']},
+        'function': {'use': ['{db}.{schemas}.*']},
+        'procedure': {'use': ['{db}.{schemas}.*']},
+        'file format': {'use': ['{db}.{schemas}.*']},
+    },
+    'operator': {
+        'warehouse': {'use': ['WH_.*']},
+        'task': {'operate': ['{db}.{schemas}.*']},
+        'pipe': {'operate': ['{db}.{schemas}.*']},
+        'dynamic table': {'operate': ['{db}.{schemas}.*']},
+        'account': {'monitor': '{account}'},
+    },
+}
+IGNORE_PATTERNS = ['.*[.]TMP_.*']
+
+
+class SyntheticAccount:
+    """
+        A made up Snowflake account, sized by the counts passed in (schemas are per database, tables/views/functions/... per schema):
+
+            objects         {object type: [SHOW row dicts]}, including the irregular cases the pipeline has to handle
+                            (shared/application/dev databases, INFORMATION_SCHEMA, builtin and overloaded functions,
+                            external tables, materialized views, objects matching the ignore patterns)
+            roles           roles.yaml: each role gets 1-3 profiles on random databases
+            profiles        role_profiles.yaml, built from PROFILE_ARCHETYPES
+            users           user_profiles.yaml
+            grants          current grants to each role (SHOW GRANTS rows): mostly in line with the role's profiles,
+                            with missing and stale grants mixed in so the plan has something to do
+            future_grants   SHOW FUTURE GRANTS rows per role
+            user_roles      SHOW GRANTS TO USER rows per user
+
+        Same seed, same account
+    """
+    def __init__(self, name:str = 'BENCH', databases:int = 10, schemas:int = 10, tables:int = 50, views:int = 10,
+                 functions:int = 5, procedures:int = 2, others:int = 1, roles:int = 50, profiles:int = 8, users:int = 200, seed:int = 0):
+        self.name = name
+        self.rng = random.Random(seed)
+        self.now = datetime.now(timezone.utc).replace(microsecond = 0)
+        self.objects = {obj_type: [] for obj_type in SHOW_COLUMNS}
+        self.version = 0
+        self.generate_objects(databases, schemas, tables, views, functions, procedures, others)
+        self.generate_profiles(profiles, schemas)
+        self.generate_roles(roles)
+        self.generate_users(users)
+        self.generate_grants()
+
+    # Objects
+
+    def created_on(self) -> datetime:
+        return self.now - timedelta(days = self.rng.randint(1, 365), seconds = self.rng.randint(0, 86400))
+
+    def add(self, obj_type:str, **row) -> dict:
+        row.setdefault('created_on', self.created_on())
+        row.setdefault('owner', 'SYSADMIN')
+        self.objects[obj_type].append(row)
+        return row
+
+    def generate_objects(self, databases, schemas, tables, views, functions, procedures, others) -> None:
+        for i in range(4):
+            self.add('warehouse', name = f'WH_{i}', state = 'SUSPENDED', size = 'X-Small')
+        for kind in ('storage','notification','api'):
+            self.add(f'{kind} integration', name = f'{kind.upper()}_INT', type = 'EXTERNAL_STAGE', category = kind.upper(), enabled = 'true')
+        # Containers the pipeline skips
+        self.add('database', name = 'SNOWFLAKE', kind = 'IMPORTED DATABASE')
+        self.add('database', name = 'PARTNER_SHARE', kind = 'IMPORTED DATABASE')
+        self.add('database', name = 'NATIVE_APP', kind = 'APPLICATION')
+        self.standard_databases = [f'DB_{i:03d}' for i in range(databases)]
+        for db in self.standard_databases + ['SANDBOX_DEV_1']:
+            self.add('database', name = db, kind = 'STANDARD')
+            self.add('schema', name = 'INFORMATION_SCHEMA', database_name = db)
+            self.add('view', name = 'TABLES', database_name = db, schema_name = 'INFORMATION_SCHEMA', is_materialized = 'false', is_secure = 'false', text = '')
+            for s in range(schemas):
+                self.generate_schema(db, f'SCH_{s:03d}', tables, views, functions, procedures, others)
+        for i, (args, _, ret) in enumerate(FUNCTION_SIGNATURES):
+            self.add('function', name = f'BUILTIN_{i}', schema_name = '', catalog_name = '', is_builtin = 'Y', is_aggregate = 'N', arguments = f'BUILTIN_{i}({args}) RETURN {ret}')
+
+    def generate_schema(self, db, schema, tables, views, functions, procedures, others) -> None:
+        self.add('schema', name = schema, database_name = db)
+        contained = {'database_name': db, 'schema_name': schema}
+        for t in range(tables):
+            name = f'TMP_{t:05d}' if t % 25 == 24 else f'TBL_{t:05d}'
+            self.add('table', name = name, kind = 'TABLE', is_external = 'Y' if t % 20 == 19 else 'N', rows = t, bytes = 1024 * t, **contained)
+        for v in range(views):
+            self.add('view', name = f'VW_{v:05d}', is_materialized = 'true' if v % 10 == 9 else 'false', is_secure = 'false', text = 'select 1', **contained)
+        for f in range(functions):
+            self.add_routine('function', db, schema, f)
+        for p in range(procedures):
+            self.add_routine('procedure', db, schema, p)
+        for obj_type in OTHER_CONTAINED_TYPES:
+            for o in range(others):
+                extra = {'type': 'INTERNAL' if o % 2 == 0 else 'EXTERNAL', 'url': ''} if obj_type == 'stage' else {}
+                self.add(obj_type, name = f'{obj_type.replace(" ","_").upper()}_{o:03d}', **contained, **extra)
+
+    def add_routine(self, obj_type:str, db:str, schema:str, i:int) -> None:
+        # Every 5th routine overloads the previous one's name
+        name = f'{obj_type[:2].upper()}_{i - 1 if i % 5 == 4 else i:04d}'
+        args, _, ret = FUNCTION_SIGNATURES[i % len(FUNCTION_SIGNATURES)]
+        self.add(obj_type, name = name, schema_name = schema, catalog_name = db, is_builtin = 'N', is_aggregate = 'N', arguments = f'{name}({args}) RETURN {ret}')
+
+    def add_tables(self, count:int) -> None:
+        """
+            Create {count} tables right now (for incremental refreshes to pick up)
+        """
+        db, schema = self.standard_databases[0], 'SCH_000'
+        start = len(self.objects['table'])
+        for i in range(count):
+            self.add('table', name = f'NEW_{start + i:06d}', database_name = db, schema_name = schema, kind = 'TABLE', is_external = 'N', rows = 0, bytes = 0, created_on = datetime.now(timezone.utc))
+        self.version += 1
+
+    def in_database(self, obj_type:str, db:str) -> list[dict]:
+        container = 'catalog_name' if obj_type in ('function','procedure') else 'database_name'
+        return [row for row in self.objects[obj_type] if row.get(container) == db and row.get('schema_name') != 'INFORMATION_SCHEMA']
+
+    # Config
+
+    def generate_profiles(self, profiles:int, schemas:int) -> None:
+        self.profiles = {}
+        archetypes = list(PROFILE_ARCHETYPES)
+        for k in range(profiles):
+            archetype = archetypes[k % len(archetypes)]
+            variant = k // len(archetypes)
+            # The first variant of each archetype covers every schema, later ones a single schema each
+            schema_pattern = '.*' if variant == 0 else f'SCH_{(variant - 1) % max(schemas,1):03d}'
+            privileges = {
+                obj_type: {
+                    group: patterns.replace('{account}', self.name) if isinstance(patterns, str)
+                    else [p.replace('{schemas}', schema_pattern) for p in patterns]
+                    for group, patterns in groups.items()
+                }
+                for obj_type, groups in PROFILE_ARCHETYPES[archetype].items()
+            }
+            self.profiles[f'{archetype}_{variant}'] = {'privileges': privileges}
+
+    def generate_roles(self, roles:int) -> None:
+        self.roles = {}
+        for r in range(roles):
+            chosen = self.rng.sample(list(self.profiles), k = min(len(self.profiles), self.rng.randint(1, 3)))
+            self.roles[f'ROLE_{r:04d}'] = {
+                'profiles': [{profile: {'db': self.rng.choice(self.standard_databases)}} for profile in chosen]
+            }
+
+    def generate_users(self, users:int) -> None:
+        roles = list(self.roles)
+        self.users = {
+            f'USER_{u:05d}': sorted(self.rng.sample(roles, k = min(len(roles), self.rng.randint(1, 3))))
+            for u in range(users)
+        }
+
+    def write_config(self, config_dir:str) -> None:
+        """
+            Write the account's config files into {config_dir}/config, laid out like CONTROL_CONFIG_DIR
+        """
+        account_dir = os.path.join(config_dir, 'config', self.name)
+        os.makedirs(os.path.join(account_dir, 'ignore'), exist_ok = True)
+        files = {
+            os.path.join(config_dir, 'config', 'atomic_groups.yaml'): ATOMIC_GROUPS,
+            os.path.join(account_dir, 'roles.yaml'): self.roles,
+            os.path.join(account_dir, 'role_profiles.yaml'): self.profiles,
+            os.path.join(account_dir, 'user_profiles.yaml'): self.users,
+            os.path.join(account_dir, 'ignore', 'objects.yaml'): {'full_name_patterns': IGNORE_PATTERNS},
+        }
+        for path, contents in files.items():
+            with open(path, 'w') as f:
+                yaml.safe_dump(contents, f, sort_keys = False)
+
+    # Grants
+
+    def grant_row(self, role:str, privilege:str, granted_on:str, name:str, parts:tuple = None) -> dict:
+        """
+            A SHOW GRANTS row. {parts} are the unquoted (table_catalog, table_schema, name) ACCOUNT_USAGE has for
+            the same grant (default: {name} is a single identifier that SHOW doesn't quote)
+        """
+        return {
+            'created_on': self.created_on(), 'privilege': privilege, 'granted_on': granted_on, 'name': name,
+            'granted_to': 'ROLE', 'grantee_name': role, 'grant_option': 'false', 'granted_by': 'SECURITYADMIN',
+            'account_usage': parts or (None, None, name),
+        }
+
+    def object_grant_name(self, obj_type:str, row:dict) -> tuple[str,str,tuple]:
+        """
+            (granted_on, name, ACCOUNT_USAGE parts) of an object, the name the way SHOW GRANTS lists it
+        """
+        if obj_type in ('function','procedure'):
+            args = next(named for listed, named, _ in FUNCTION_SIGNATURES if row['arguments'].startswith(f"{row['name']}({listed})"))
+            ret = row['arguments'].split(' RETURN ', 1)[1]
+            signature = f'{row["name"]}({args}):{ret}'
+            return obj_type.upper(), f'{row["catalog_name"]}.{row["schema_name"]}."{signature}"', (row['catalog_name'], row['schema_name'], signature)
+        if obj_type == 'table' and row['is_external'] == 'Y':
+            granted_on = 'EXTERNAL_TABLE'
+        elif obj_type == 'view' and row['is_materialized'] == 'true':
+            granted_on = 'MATERIALIZED_VIEW'
+        else:
+            granted_on = obj_type.upper().replace(' ','_')
+        return granted_on, f'{row["database_name"]}.{row["schema_name"]}.{row["name"]}', (row['database_name'], row['schema_name'], row['name'])
+
+    def generate_grants(self) -> None:
+        rng = self.rng
+        self.grants, self.future_grants = {}, {}
+        for role, config in self.roles.items():
+            rows, futures = [], []
+            for profile in config['profiles']:
+                (profile_name, params), = profile.items()
+                db = params['db']
+                archetype = profile_name.rsplit('_', 1)[0]
+                rows.append(self.grant_row(role, 'USAGE', 'DATABASE', db))
+                for schema in self.in_database('schema', db):
+                    if rng.random() < 0.9:
+                        rows.append(self.grant_row(role, 'USAGE', 'SCHEMA', f'{db}.{schema["name"]}', (db, None, schema['name'])))
+                    if rng.random() < 0.3:
+                        futures.append({
+                            'created_on': self.created_on(), 'privilege': 'SELECT', 'grant_on': 'TABLE',
+                            'name': f'{db}.{schema["name"]}.<TABLE>', 'grant_to': 'ROLE', 'grantee_name': role, 'grant_option': 'false'
+                        })
+                granted_types = {'reader': ['table','view'], 'writer': ['table','view'], 'developer': ['table','view','function','procedure']}.get(archetype, ['task'])
+                for obj_type in granted_types:
+                    for row in self.in_database(obj_type, db):
+                        if rng.random() < 0.7:
+                            granted_on, name, parts = self.object_grant_name(obj_type, row)
+                            rows.append(self.grant_row(role, 'USAGE' if obj_type in ('function','procedure') else 'SELECT' if obj_type != 'task' else 'OPERATE', granted_on, name, parts))
+                            if archetype == 'writer' and obj_type == 'table' and rng.random() < 0.5:
+                                rows.append(self.grant_row(role, 'INSERT', granted_on, name, parts))
+                rows.append(self.grant_row(role, 'OWNERSHIP', 'TABLE', f'{db}.SCH_000.TBL_00000', (db, 'SCH_000', 'TBL_00000')))
+            # Stale grants on other databases, for the plan to revoke
+            for _ in range(5):
+                db = rng.choice(self.standard_databases)
+                tables = self.in_database('table', db)
+                if tables:
+                    rows.append(self.grant_row(role, 'SELECT', *self.object_grant_name('table', rng.choice(tables))))
+            self.grants[role] = rows
+            self.future_grants[role] = futures
+
+        self.user_roles = {}
+        roles = list(self.roles)
+        for user, target in self.users.items():
+            current = [role for role in target if rng.random() < 0.8] + ([rng.choice(roles)] if rng.random() < 0.2 else [])
+            self.user_roles[user] = [
+                {'created_on': self.created_on(), 'role': role, 'granted_to': 'USER', 'grantee_name': user, 'granted_by': 'SECURITYADMIN'}
+                for role in dict.fromkeys(current)
+            ]
+
+    def account_usage_grants(self) -> list[tuple]:
+        """
+            (grantee_name, privilege, granted_on, table_catalog, table_schema, name) rows as ACCOUNT_GRANTS_TO_ROLES_QUERY
+            returns them: unlike SHOW GRANTS, ACCOUNT_USAGE has every part of a name unquoted
+        """
+        return [
+            (row['grantee_name'], row['privilege'], row['granted_on'].replace('_',' '), *row['account_usage'])
+            for rows in self.grants.values() for row in rows
+            if row['privilege'] != 'OWNERSHIP' and row['granted_on'] != 'ROLE' and not row['name'].startswith('SNOWFLAKE')
+        ]
+
+    def summary(self) -> dict:
+        return {
+            'objects': sum(len(rows) for rows in self.objects.values()),
+            'roles': len(self.roles),
+            'profiles': len(self.profiles),
+            'users': len(self.users),
+            'grants': sum(len(rows) for rows in self.grants.values()),
+        }
@@ -0,0 +1,135 @@
+import threading
+import numpy as np
+import pandas as pd
+from typing import Iterable
+
+# Profile patterns are almost always anchored on a database (and often a schema): DB_X.SCHEMA_Y.* , DB_.*_RAW.* , ...
+# Instead of running them over every object of a type, each type's objects are indexed into a tree of
+# database -> schema -> row positions, and a pattern only visits the subtrees its literal prefix allows.
+# The regexes then run over the rows of those subtrees only, so matching costs scale with the region matched
+ANY = None  # an unescaped '.' in a prefix: any one character
+MAX_CACHED_INDEXES = 64
+
+
+def literal_prefix(pattern:str) -> tuple:
+    """
+        The characters every match of {pattern} starts with (uppercased, ANY for '.'), as far as they can be read
+        without interpreting the regex. () when nothing can be said (alternation, a leading group, class, ...)
+    """
+    if has_alternation(pattern):
+        return ()
+    prefix = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            # escaped punctuation is a literal, \d \w \A ... aren't
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            token, i = pattern[i + 1].upper(), i + 2
+        elif char == '.':
+            token, i = ANY, i + 1
+        elif char in '[()^$*+?{}|':
+            break
+        else:
+            token, i = char.upper(), i + 1
+        quantifier = pattern[i] if i < len(pattern) else ''
+        if quantifier in ('*','?','{'):
+            # token may not be there at all
+            break
+        prefix.append(token)
+        if quantifier == '+':
+            break
+    while prefix and prefix[-1] is ANY:
+        prefix.pop()
+    return tuple(prefix)
+
+def has_alternation(pattern:str) -> bool:
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '|':
+            return True
+    return False
+
+def compatible(path:str, prefix:tuple) -> bool:
+    """
+        Can a name starting with {path} start with {prefix} (or the other way around)?
+    """
+    return all(expected is ANY or expected == char for expected, char in zip(prefix, path))
+
+
+class CatalogIndex:
+    """
+        Row positions of one object type's frame, keyed by its containers:
+
+            {DATABASE: {SCHEMA: positions}}     tables, views, functions, ... (container columns: database, schema)
+            {DATABASE: positions}               schemas
+            positions                           account level objects (no containers, nothing to prune)
+
+        Keys are uppercased, the FULL_NAME of every row under a key path starts with 'KEY.KEY.'
+    """
+    __slots__ = 'frame','containers','tree','size'
+
+    def __init__(self, frame:pd.DataFrame, containers:list[str]):
+        self.frame = frame
+        self.containers = containers
+        self.size = len(frame)
+        if not containers or frame.empty:
+            self.containers = []
+            self.tree = np.arange(self.size)
+            return
+        self.tree = {}
+        keys = [frame[column].astype(str).str.upper() for column in containers]
+        for key, positions in pd.DataFrame({i: key.to_numpy() for i, key in enumerate(keys)}).groupby(list(range(len(keys))), sort = False).indices.items():
+            key = key if isinstance(key, tuple) else (key,)
+            node = self.tree
+            for part in key[:-1]:
+                node = node.setdefault(part, {})
+            node[key[-1]] = positions
+
+    def rows(self, patterns:Iterable[str]) -> np.ndarray:
+        """
+            Sorted positions of the rows any of {patterns} could match, None for every row
+        """
+        prefixes = [literal_prefix(pattern) for pattern in patterns]
+        if not self.containers or any(not prefix for prefix in prefixes):
+            return None
+        found = []
+        self.collect(self.tree, '', prefixes, found)
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype = np.intp)
+
+    def collect(self, node:dict, path:str, prefixes:list[tuple], found:list) -> None:
+        for part, child in node.items():
+            child_path = f'{path}{part}.'
+            live = [prefix for prefix in prefixes if compatible(child_path, prefix)]
+            if not live:
+                continue
+            if isinstance(child, dict):
+                self.collect(child, child_path, live, found)
+            else:
+                found.append(child)
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+def catalog_index(frame:pd.DataFrame, containers:list[str]) -> CatalogIndex:
+    """
+        Memoized CatalogIndex of {frame} (a frame is only indexed once while it is alive)
+    """
+    key = (id(frame), tuple(containers))
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        # the index holds its frame, so an id can't be reused by another frame while it is cached
+        if index is not None and index.frame is frame and index.size == len(frame):
+            return index
+    index = CatalogIndex(frame, containers)
+    with _INDEXES_LOCK:
+        if len(_INDEXES) >= MAX_CACHED_INDEXES:
+            _INDEXES.clear()
+        _INDEXES[key] = index
+    return index
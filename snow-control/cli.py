@@ -0,0 +1,207 @@
+"""
+    Non-interactive entry point, for CI jobs and scheduled reconciliations:
+
+        python cli.py get   --account ORG-ACCOUNT [--method conc] [--incr] [--grants]
+        python cli.py plan  --account ORG-ACCOUNT [--roles ROLE ...] [--method conc] [--resume] [--incr]
+        python cli.py show  --account ORG-ACCOUNT [ROLE_OR_USER ...]
+        python cli.py sql   --account ORG-ACCOUNT [--coalesce]
+        python cli.py apply --account ORG-ACCOUNT [--method seq] [--batch-size 200] [--coalesce]
+        python cli.py fanout plan --accounts 'ORG-*' [--parallel 8] [--budget 32] [-- --method proc ...]
+
+    Each subcommand only imports what it runs: show and sql read the cached .snowplan without
+    importing pandas or the Snowflake connector, or connecting to the account.
+    Credentials come from --user/--password or SNOWFLAKE_USER/SNOWFLAKE_PASSWORD (no password: SSO in a browser)
+"""
+import os
+import sys
+import json
+import argparse
+
+DEFAULT_VERBOSITY = 3
+
+
+def default_account() -> str:
+    organization, account = os.environ.get('SNOWFLAKE_ORGANIZATION'), os.environ.get('SNOWFLAKE_ACCOUNT')
+    return f'{organization}-{account}' if organization and account else None
+
+def parse_args(argv:list[str] = None) -> argparse.Namespace:
+    common = argparse.ArgumentParser(add_help = False)
+    common.add_argument('--account', default = default_account(), required = default_account() is None,
+                        help = 'ORGANIZATION-ACCOUNT, as named under config/ (default: $SNOWFLAKE_ORGANIZATION-$SNOWFLAKE_ACCOUNT)')
+    common.add_argument('-v', '--verbosity', type = int, default = DEFAULT_VERBOSITY)
+    common.add_argument('--trace', action = 'store_true', default = bool(os.environ.get('CONTROL_TRACE')),
+                        help = 'write a Chrome trace of the run to config/<account>/traces/ (see tracing.py)')
+    connected = argparse.ArgumentParser(add_help = False, parents = [common])
+    connected.add_argument('--user', default = os.environ.get('SNOWFLAKE_USER'))
+    connected.add_argument('--password', default = os.environ.get('SNOWFLAKE_PASSWORD'))
+    connected.add_argument('--local', action = 'store_true', help = 'fetch SHOW results directly instead of a result_scan query')
+
+    parser = argparse.ArgumentParser(prog = 'snow-control', description = __doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    get = commands.add_parser('get', parents = [connected], help = 'refresh the cached registry of objects (or grants)')
+    get.add_argument('--method', choices = ['seq','conc','async','shard'], default = 'conc')
+    get.add_argument('--incr', action = 'store_true', help = 'only refresh objects created/dropped since the cache was saved')
+    get.add_argument('--grants', action = 'store_true', help = 'capture the grant snapshot of every configured role instead')
+    get.add_argument('--grant-source', choices = ['show','account_usage'], default = 'show')
+
+    plan = commands.add_parser('plan', parents = [connected], help = 'plan the changes to the configured roles (and users)')
+    plan.add_argument('--roles', nargs = '+', help = 'only plan these roles (users are only planned with every role)')
+    plan.add_argument('--method', choices = ['seq','conc','async','proc'], default = 'conc')
+    plan.add_argument('--from-grant-cache', action = 'store_true')
+    plan.add_argument('--grant-source', choices = ['show','account_usage'], default = 'show')
+    plan.add_argument('--resume', action = 'store_true', help = 'continue an unfinished plan of the same roles')
+    plan.add_argument('--incr', action = 'store_true', help = 'reuse the deltas of roles whose inputs are unchanged (implies --from-grant-cache)')
+
+    show = commands.add_parser('show', parents = [common], help = 'print the cached plan')
+    show.add_argument('recipients', nargs = '*', help = 'only these roles/users')
+
+    coalesce = argparse.ArgumentParser(add_help = False)
+    coalesce.add_argument('--coalesce', action = 'store_true', help = 'merge grants into schema-wide and multi-privilege statements, as the object cache allows (see coalesce.py)')
+
+    commands.add_parser('sql', parents = [common, coalesce], help = 'print (and save) the statements of the cached plan')
+
+    apply = commands.add_parser('apply', parents = [connected, coalesce], help = 'run the statements of the cached plan')
+    apply.add_argument('--method', choices = ['seq','conc','batch'], default = 'seq')
+    apply.add_argument('--batch-size', type = int)
+
+    fanout = commands.add_parser('fanout', help = 'run get, plan or apply on many accounts at once (see fanout.py)')
+    fanout.add_argument('fanout_command', choices = ['get','plan','apply'])
+    fanout.add_argument('--accounts', nargs = '+', required = True, help = 'account names or globs (ORG-*) under config/')
+    fanout.add_argument('--parallel', type = int, help = 'accounts running at once')
+    fanout.add_argument('--budget', type = int, help = 'Snowflake connections shared by the accounts running at once')
+    fanout.add_argument('--json', help = 'also write the summary to this file')
+    fanout.set_defaults(trace = False)
+    # fanout ... -- ARGUMENTS: everything after -- is passed on to every account's command
+    argv = sys.argv[1:] if argv is None else argv
+    passed_on = []
+    if argv[:1] == ['fanout'] and '--' in argv:
+        argv, passed_on = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    args = parser.parse_args(argv)
+    args.arguments = passed_on
+    return args
+
+
+def offline_state(args:argparse.Namespace):
+    from control_state import ControlState
+    state = ControlState(verbosity = args.verbosity, max_workers = 1)
+    state.account = args.account
+    return state
+
+def connected_state(args:argparse.Namespace):
+    from control import initialize_connection
+    from control_state import ControlState
+    from connection_pool import ConnectionPool, DEFAULT_POOL_SIZE
+    from load import get_ignored_object_patterns
+    connect = lambda: initialize_connection(account_name = args.account, username = args.user, password = args.password)
+    state = ControlState(verbosity = args.verbosity)
+    state.account, state.connection = args.account, connect()
+    state.pool = ConnectionPool(connect, size = DEFAULT_POOL_SIZE)
+    state.ignore_objects = get_ignored_object_patterns(args.account)
+    state.fetch_mode = 'local' if args.local else 'result_scan'
+    return state
+
+
+# Each command returns its connected ControlState (if it opened one), closed once the command is done
+def run_get(args:argparse.Namespace):
+    state = connected_state(args)
+    if args.grants:
+        from plan import refresh_grant_cache
+        refresh_grant_cache(state, args.account, method = 'seq' if args.method == 'seq' else 'conc', grant_source = args.grant_source)
+        return state
+    from load import read_snowcache
+    from get_objects import object_scan, incremental_object_scan, filter_objects, save_cache
+    cached_time, cached = read_snowcache(args.account) if args.incr else (None, {})
+    if cached_time:
+        objects = incremental_object_scan(state, cached, since = cached_time, method = 'seq' if args.method == 'seq' else 'conc')
+    else:
+        objects = object_scan(state, method = args.method)
+    save_cache(state, filter_objects(state, objects, method = 'seq' if args.method == 'seq' else 'conc'))
+    return state
+
+def run_plan(args:argparse.Namespace):
+    from plan import plan
+    from load import print_account_plan
+    state = connected_state(args)
+    roles = [role.lower().strip() for role in args.roles] if args.roles else None
+    plan(
+        state = state,
+        account = args.account,
+        roles_to_plan = roles,
+        method = args.method,
+        plan_users = not roles,
+        from_grant_cache = args.from_grant_cache,
+        grant_source = args.grant_source,
+        resume = args.resume,
+        incremental = args.incr
+    )
+    print_account_plan(state)
+    return state
+
+def run_show(args:argparse.Namespace) -> None:
+    from load import print_account_plan
+    print_account_plan(offline_state(args), recipients = args.recipients or None)
+
+def cached_objects(args:argparse.Namespace):
+    # Only --coalesce reads the object cache (and imports pandas)
+    if not args.coalesce:
+        return None
+    from load import get_objects_from_cache
+    return get_objects_from_cache(args.account)
+
+def run_sql(args:argparse.Namespace) -> None:
+    from load import get_plan_from_cache
+    from sqlpriv import gen_queries
+    from styling import show
+    show(gen_queries(args.account, get_plan_from_cache(args.account), cached_objects(args)))
+
+def run_apply(args:argparse.Namespace):
+    from load import get_plan_from_cache
+    from sqlpriv import gen_queries
+    from apply import apply
+    state = connected_state(args)
+    cached_plan = get_plan_from_cache(args.account)
+    apply(
+        state,
+        plan_id = cached_plan['plan_id'],
+        queries = gen_queries(args.account, cached_plan, cached_objects(args)),
+        method = args.method,
+        **({'batch_size': args.batch_size} if args.batch_size is not None else {})
+    )
+    return state
+
+def run_fanout(args:argparse.Namespace) -> None:
+    from fanout import fanout, DEFAULT_CONNECTION_BUDGET
+    summaries = fanout(args.fanout_command, args.accounts, args.arguments, parallel = args.parallel, budget = args.budget if args.budget is not None else DEFAULT_CONNECTION_BUDGET)
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(summaries, f, indent = 2)
+    if any(summary['status'] != 'ok' for summary in summaries):
+        sys.exit(1)
+
+COMMANDS = {
+    'get': run_get,
+    'plan': run_plan,
+    'show': run_show,
+    'sql': run_sql,
+    'apply': run_apply,
+    'fanout': run_fanout,
+}
+
+
+def main(argv:list[str] = None) -> int:
+    args = parse_args(argv)
+    from tracing import TRACER
+    if args.trace:
+        TRACER.start(args.command)
+    state = COMMANDS[args.command](args)
+    if state is not None:
+        state.pool.close()
+        state.connection.close()
+    if args.trace:
+        from load import CONFIG_DIR
+        print(f'Trace written to {TRACER.export(os.path.join(CONFIG_DIR,"config",args.account,"traces",f"{TRACER.run_id}.json"))}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import threading
+import pandas as pd
+from collections import defaultdict
+from typing import Iterable, Tuple
+from sf_object_structures import DETAILED_OBJECT_TYPE_MAPPER, pluralize, get_futures
+from plan import CompiledProfile
+
+# Rewrites the grants of a role's plan into fewer statements before gen_queries turns them into SQL:
+#
+#   1. GRANT P ON ALL <TYPE>S IN SCHEMA DB.SCHEMA     P on every object of a type in a schema
+#   2. GRANT P1, P2, ... ON <TYPE> <NAME>            every privilege granted on the same object (or schema, account, ...)
+#
+# 2 always touches the same grants, and is used for revokes too. 1 is only used for grants, when the role's profiles
+# grant the privilege on the whole schema and the object cache proves the statement touches the same grants:
+#   - a profile pattern of the type covers every name in the schema (DB.SCHEMA.*, see schema_wide_grants), so an
+#     object created after the cache was saved is one the role is meant to have the privilege on anyway
+#   - every cached object of the type in the schema is in the planned set
+#   - the scan dropped no object of the type in the schema (see ObjectCache.ignored_containers)
+#   - the schema has no cached object of a type the ALL form could also cover (external and dynamic tables are
+#     TABLES, materialized views are VIEWS)
+#   - the type is one of SCHEMA_WIDE_TYPES. Stages (internal and external stages take different privileges),
+#     routines (overloads) and pipes (the scan skips the Kafka connector's) are always granted one by one
+# Revokes are always per object: nothing proves a role isn't meant to have the privilege on an object created since
+SCHEMA_WIDE_TYPES = {
+    # plan object type: (cached type, cached types the ALL form may also cover)
+    'TABLE': ('table', ['external table','dynamic table']),
+    'VIEW': ('view', ['materialized view']),
+    'DYNAMIC TABLE': ('dynamic table', []),
+    'FILE FORMAT': ('file format', []),
+    'TASK': ('task', []),
+    'STREAM': ('stream', []),
+}
+# A schema with fewer planned objects than this is granted one by one anyway
+MIN_SCHEMA_WIDE_OBJECTS = 2
+# Object types granted one privilege per statement
+SINGLE_PRIVILEGE_TYPES = ('ROLE',)
+
+
+class SchemaCoverage:
+    """
+        The cached objects of each schema, per object type, and which schemas an ALL statement can be proven on
+    """
+    def __init__(self, objects):
+        self.objects = objects
+        self.ignored = getattr(objects, 'ignored_containers', None)
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def schemas(self, cached_type:str) -> dict[str,frozenset]:
+        """
+            {DB.SCHEMA: FULL_NAMEs of the cached objects of {cached_type} in it}
+        """
+        return self.grouped(cached_type)[0]
+
+    def schema_of(self, cached_type:str) -> dict[str,str]:
+        """
+            {FULL_NAME: DB.SCHEMA} of the cached objects of {cached_type}
+        """
+        return self.grouped(cached_type)[1]
+
+    def grouped(self, cached_type:str) -> Tuple[dict,dict]:
+        with self._lock:
+            if cached_type not in self._schemas:
+                self._schemas[cached_type] = self.group(cached_type)
+            return self._schemas[cached_type]
+
+    def group(self, cached_type:str) -> Tuple[dict,dict]:
+        frame = self.objects[cached_type] if cached_type in self.objects else None
+        if frame is None or frame.empty or not {'database_name','schema_name','FULL_NAME'} <= set(frame.columns):
+            return {}, {}
+        containers = (frame['database_name'].astype(str) + '.' + frame['schema_name'].astype(str)).to_numpy()
+        names = frame['FULL_NAME'].to_numpy()
+        schemas = {schema: frozenset(schema_names) for schema, schema_names in pd.Series(names, index = containers).groupby(level = 0)}
+        return schemas, dict(zip(names.tolist(), containers.tolist()))
+
+    def provable(self, object_type:str, schema:str) -> bool:
+        """
+            Does ALL <object_type>S IN SCHEMA {schema} only reach objects the cache has as {object_type}?
+        """
+        cached_type, also_covered = SCHEMA_WIDE_TYPES[object_type]
+        if self.ignored is None:
+            return False
+        scanned_types = {DETAILED_OBJECT_TYPE_MAPPER.get(t, t) for t in [cached_type] + also_covered}
+        if any(schema in self.ignored.get(scanned_type, ()) for scanned_type in scanned_types):
+            return False
+        return not any(schema in self.schemas(other) for other in also_covered)
+
+    def complete_schemas(self, object_type:str, names:Iterable[str], schema_wide:Iterable[str] = ()) -> dict[str,set]:
+        """
+            {DB.SCHEMA: names} for the {schema_wide} schemas where {names} are every cached object of {object_type} and
+            an ALL statement is provable
+        """
+        schema_wide = {schema.upper() for schema in schema_wide}
+        cached_type = SCHEMA_WIDE_TYPES[object_type][0]
+        cached, schema_of = self.schemas(cached_type), self.schema_of(cached_type)
+        if not cached:
+            return {}
+        planned = defaultdict(set)
+        for name in names:
+            if name in schema_of:
+                planned[schema_of[name]].add(name)
+        return {
+            schema: schema_names for schema, schema_names in planned.items()
+            if schema.upper() in schema_wide and len(schema_names) >= MIN_SCHEMA_WIDE_OBJECTS
+            and len(schema_names) == len(cached[schema]) and self.provable(object_type, schema)
+        }
+
+
+def schema_wide_grants(objects, role_config:dict, profiles:dict) -> set[Tuple[str,str,str]]:
+    """
+        (privilege, object type, DB.SCHEMA) of the SCHEMA_WIDE_TYPES privileges {role_config}'s profiles grant on
+        every object of the type in a schema: the schemas CompiledProfile would also grant them on future objects in
+    """
+    grants = set()
+    for assoc_prof in (role_config or {}).get('profiles', []):
+        for profile_name, profile_parameters in assoc_prof.items():
+            if profile_name not in profiles:
+                continue
+            profile = CompiledProfile(profile_name, profiles[profile_name])
+            for object_type, generic_object_type, _, future_patterns, atomic_privs, _, _ in profile.entries:
+                if generic_object_type not in SCHEMA_WIDE_TYPES or SCHEMA_WIDE_TYPES[generic_object_type][0] != object_type:
+                    continue
+                if not (atomic_privs and future_patterns):
+                    continue
+                schemas = get_futures(objects, object_type, [p.format(**(profile_parameters or {})).upper() for p in future_patterns])
+                grants |= {(privilege, generic_object_type, schema.upper()) for privilege in atomic_privs for schema in schemas}
+    return grants
+
+def coalesce_grants(grants:Iterable[Tuple[str,str,str]], coverage:SchemaCoverage, schema_wide:set = frozenset()) -> list[Tuple[str,str,str]]:
+    """
+        (privilege, object type, name) grants as the fewest equivalent (privileges, object type, name) statements.
+        ALL statements are only used on the {schema_wide} (privilege, object type, DB.SCHEMA)s
+    """
+    per_type = defaultdict(list)
+    statements = []
+    for privilege, object_type, name in grants:
+        if object_type in SCHEMA_WIDE_TYPES:
+            per_type[(privilege, object_type)].append(name)
+        else:
+            statements.append((privilege, object_type, name))
+    for (privilege, object_type), names in per_type.items():
+        covered = set()
+        schemas = [schema for priv, typ, schema in schema_wide if (priv, typ) == (privilege, object_type)]
+        for schema, schema_names in coverage.complete_schemas(object_type, names, schemas).items():
+            statements.append((privilege, f'ALL {pluralize(object_type)} IN SCHEMA', schema))
+            covered |= schema_names
+        statements += [(privilege, object_type, name) for name in names if name not in covered]
+
+    privileges = {}
+    for privilege, object_type, name in statements:
+        target = (object_type, name, privilege) if object_type in SINGLE_PRIVILEGE_TYPES else (object_type, name)
+        privileges.setdefault(target, set()).add(privilege)
+    return [(', '.join(sorted(privs)), target[0], target[1]) for target, privs in privileges.items()]
+
+def coalesce_plan(plan:dict, coverage:SchemaCoverage, schema_wide:set = frozenset()) -> dict:
+    """
+        A role's plan with its to_revoke and to_grant coalesced (see coalesce_grants), ALL statements only granting
+        the {schema_wide} privileges of its profiles (see schema_wide_grants)
+    """
+    return plan | {
+        'to_revoke': coalesce_grants(plan['to_revoke'], coverage),
+        'to_grant': coalesce_grants(plan['to_grant'], coverage, schema_wide),
+    }
@@ -0,0 +1,68 @@
+import os
+import yaml
+import marshal
+import hashlib
+from typing import Callable
+
+# Parsing YAML is the slowest part of reading an account's configuration: a generated roles.yaml or role_profiles.yaml
+# of tens of thousands of lines takes seconds with PyYAML's pure Python loader. Config files are parsed once (with
+# libyaml's CSafeLoader when PyYAML was built with it), validated and normalized, and the result is marshalled to
+#
+#     <directory of the file>/.configcache.d/<file name>.marshal
+#
+# (marshal, unlike pickle, only rebuilds plain values: a snapshot someone else wrote to a shared checkout can't run code)
+# along with the file's mtime, size and sha256. A later load returns the snapshot as is while the file's mtime and size
+# are unchanged, and after hashing it when they aren't (a touched or re-checked-out file with the same contents)
+SNAPSHOT_DIR = '.configcache.d'
+# Bump when a normalization changes, so snapshots taken with the old one are parsed again
+SNAPSHOT_VERSION = 1
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def snapshot_path(path:str) -> str:
+    return os.path.join(os.path.dirname(path), SNAPSHOT_DIR, os.path.basename(path) + '.marshal')
+
+def read_snapshot(path:str) -> dict:
+    try:
+        with open(path,'rb') as f:
+            snapshot = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return snapshot if isinstance(snapshot, dict) else None
+
+def write_snapshot(path:str, snapshot:dict) -> None:
+    # A snapshot is only an optimization: a read-only config directory (or a value marshal can't hold, like
+    # the dates YAML parses timestamps into) just means parsing every time
+    try:
+        contents = marshal.dumps(snapshot)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(f'{path}.{os.getpid()}.tmp','wb') as f:
+            f.write(contents)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+    except (OSError, ValueError):
+        pass
+
+def load_config(path:str, normalize:Callable = None):
+    """
+        The contents of the YAML file at {path}, passed through {normalize}(contents, path) (which validates them and
+        returns what callers use), from the file's snapshot if it hasn't changed since the snapshot was taken
+    """
+    kind = (SNAPSHOT_VERSION, normalize.__qualname__ if normalize else None)
+    stat = os.stat(path)
+    cached = snapshot_path(path)
+    snapshot = read_snapshot(cached)
+    if snapshot is not None and snapshot.get('kind') != kind:
+        snapshot = None
+    if snapshot is not None and (snapshot['mtime_ns'], snapshot['size']) == (stat.st_mtime_ns, stat.st_size):
+        return snapshot['value']
+    with open(path,'rb') as f:
+        contents = f.read()
+    digest = hashlib.sha256(contents).hexdigest()
+    if snapshot is not None and snapshot['sha256'] == digest:
+        write_snapshot(cached, snapshot | {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+        return snapshot['value']
+    value = yaml.load(contents, Loader = YAML_LOADER)
+    if normalize:
+        value = normalize(value, path)
+    write_snapshot(cached, {'kind': kind, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest, 'value': value})
+    return value
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from typing import Callable
+import threading
+import time
+import os
+
+DEFAULT_POOL_SIZE = int(os.environ.get('CONTROL_POOL_SIZE', 8))
+# Connections idle for longer than this are pinged before being handed out again
+HEALTH_CHECK_INTERVAL = 300 # seconds
+
+
+class ConnectionPool:
+    """
+        Up to {size} Snowflake connections, opened lazily with {factory} (which is expected to run the
+        same session setup as initialize_connection) and shared between the executor's workers:
+
+            with pool.connection() as conn:
+                cur = conn.cursor()
+                ...
+
+        Checking out blocks while every connection is in use. A connection that was closed, or that has been
+        idle for a while and fails a ping, is discarded and replaced with a fresh one. Once the pool is closed,
+        connections still checked out are closed when they are checked back in
+    """
+    def __init__(self, factory:Callable, size:int = DEFAULT_POOL_SIZE):
+        assert size > 0, 'A connection pool needs at least one connection'
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._last_used = {}
+        self._created = 0
+        self._closed = False
+        # Waited on by checkouts while every connection is in use, notified whenever one is checked in or a slot frees up
+        self._available = threading.Condition()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def checkout(self):
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                self._available.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._created += 1
+        if conn is None:
+            return self._open()
+        if self.healthy(conn):
+            return conn
+        self.discard(conn)
+        return self._open()
+
+    def checkin(self, conn) -> None:
+        with self._available:
+            if not self._closed:
+                self._last_used[id(conn)] = time.time()
+                self._idle.append(conn)
+                self._available.notify()
+                return
+            self._created -= 1
+        self.discard(conn)
+
+    def healthy(self, conn) -> bool:
+        if conn.is_closed():
+            return False
+        if time.time() - self._last_used.get(id(conn), 0) < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            conn.cursor().execute('select 1').fetchall()
+            return True
+        except Exception:
+            return False
+
+    def discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _open(self):
+        try:
+            conn = self.factory()
+        except Exception:
+            # the slot is free again: wake a checkout waiting for one, it opens its own connection
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+        self._last_used[id(conn)] = time.time()
+        return conn
+
+    def close(self) -> None:
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            self.discard(conn)
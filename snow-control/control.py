@@ -4,11 +4,13 @@ import os
 from load import *
 import snowflake.connector as snowcon
 from queries import SET_SEARCH_PATH
-from get_objects import object_scan,filter_objects, save_cache
-from plan import plan,print_account_plan
+from get_objects import object_scan,incremental_object_scan,filter_objects, save_cache
+from plan import plan,print_account_plan,refresh_grant_cache
 from sqlpriv import gen_queries
 from control_state import ControlState
+from connection_pool import ConnectionPool, DEFAULT_POOL_SIZE
 from apply import apply
+from tracing import TRACER
 
 from styling import *
 
@@ -31,7 +33,7 @@ def interactive():
     with open(os.path.join(SCRIPT_DIR, 'interactive/intro.txt'),'r') as f: 
         txt = f.read()
     chunks = txt.split('[break_for_input]')
-    account,user,password = [cli_input(chunk.format(**STYLING).strip() + Fore.YELLOW) for chunk in chunks[:-1]]
+    account,user,password = [cli_input(chunk.format_map(STYLING).strip() + Fore.YELLOW) for chunk in chunks[:-1]]
     account = account if account else os.environ.get('SNOWFLAKE_ACCOUNT')
     organization = os.environ.get('SNOWFLAKE_ORGANIZATION') # TODO: fix
     password = password if password else os.environ.get('SNOWFLAKE_PASSWORD')
@@ -47,12 +49,18 @@ def interactive():
     conn = initialize_connection(account_name = account, username = user, password = password)
     state = ControlState(verbosity = 3)
     state.account, state.connection = account, conn
+    # Workers in get/plan/apply conc each check out their own session (opened on first use)
+    state.pool = ConnectionPool(
+        lambda: initialize_connection(account_name = account, username = user, password = password),
+        size = DEFAULT_POOL_SIZE
+    )
     state.ignore_objects = get_ignored_object_patterns(state.account)
     
     # MAIN MENU
     os.system('clear')
     while menu_screen(state):
         os.system('clear')
+    state.pool.close()
     conn.close()
     exit()
 
@@ -76,6 +84,8 @@ def initialize_connection(account_name:str, username:str, password:str, role:str
     else:
         print('No password provided, using externalbrowser for SSO auth')
         parameters['authenticator'] = 'externalbrowser'
+        # Cache the SSO token so pooled connections don't each open a browser window
+        parameters['client_store_temporary_credential'] = True
     
     parameters |= kwargs
 
@@ -95,7 +105,7 @@ def menu_screen(st:ControlState) -> bool:
     print(f'{Style.BRIGHT + Fore.CYAN}ACCOUNT: {Style.RESET_ALL + Fore.YELLOW}{st.account}', end = '\n\n')
     with open(os.path.join(SCRIPT_DIR, 'interactive/menu.txt'),'r') as file:
         txt = file.read()
-    inp = cli_input(txt.format(**STYLING) + '\n').lower().strip().split()
+    inp = cli_input(txt.format_map(STYLING) + '\n').lower().strip().split()
     
     # NOTE: this handles bug when people hit enter repeatedly
     if not inp:
@@ -105,7 +115,16 @@ def menu_screen(st:ControlState) -> bool:
     
     method_sequential = ('seq' in params)
     method_concurrent = ('conc' in params)
+    method_async = ('async' in params)
+    method_shard = ('shard' in params)
+    method_process = ('proc' in params)
+    incremental = ('incr' in params)
+    grant_source = 'account_usage' if 'account_usage' in params else 'show'
     print(Style.RESET_ALL,end = '')
+    st.fetch_mode = 'local' if 'local' in params else 'result_scan'
+    trace = ('trace' in params) or bool(os.environ.get('CONTROL_TRACE'))
+    if trace:
+        TRACER.start(response)
 
     if response == 'clear':
         clear_cache(st.account)
@@ -116,13 +135,26 @@ def menu_screen(st:ControlState) -> bool:
             st.verbosity = debug_level
         else:
             print(f'Improper verbosity level : {debug_level}')
+    elif response == 'get' and params and params[0] == 'grants':
+        print('\n')
+        st.print(f'Capturing current grants to every configured role in account {Style.BRIGHT + Fore.YELLOW}{st.account}')
+        refresh_grant_cache(st, st.account, method = 'seq' if method_sequential else 'conc', grant_source = grant_source)
     elif response == 'get':
         print('\n')
         st.print(f'Getting latest list of objects in account {Style.BRIGHT + Fore.YELLOW}{st.account}')
-        objects = object_scan(
-            st,
-            method = 'seq' if method_sequential else 'conc'
-        )
+        cached_time, cached = read_snowcache(st.account) if incremental else (None, {})
+        if incremental and not cached_time:
+            st.print(f'{Fore.RED}No incremental cutoff found in the current cache, running a full scan')
+        if cached_time:
+            objects = incremental_object_scan(
+                st, cached, since = cached_time,
+                method = 'seq' if method_sequential else 'conc'
+            )
+        else:
+            objects = object_scan(
+                st,
+                method = 'seq' if method_sequential else 'async' if method_async else 'shard' if method_shard else 'conc'
+            )
         filtered = filter_objects(
             st, objects,method ='seq' if method_sequential else 'conc'
         )
@@ -136,27 +168,36 @@ def menu_screen(st:ControlState) -> bool:
             state = st,
             account = st.account,
             roles_to_plan = target_roles,
-            method = 'seq' if method_sequential else 'conc', # default conc,
-            plan_users = False if target_roles else True
+            method = 'seq' if method_sequential else 'async' if method_async else 'proc' if method_process else 'conc', # default conc,
+            plan_users = False if target_roles else True,
+            from_grant_cache = ('--from-grant-cache' in params or 'from-grant-cache' in params),
+            grant_source = grant_source,
+            resume = ('resume' in params),
+            incremental = incremental
         )
         print_account_plan(st)
     elif response == 'show':
-        print_account_plan(st)
+        print_account_plan(st, recipients = params or None)
     elif response == 'sql':
         cache_plan = get_plan_from_cache(st.account)
-        queries = gen_queries(st.account, cache_plan)
+        queries = gen_queries(st.account, cache_plan, get_objects_from_cache(st.account) if 'coalesce' in params else None)
         show(queries)
     elif response == 'apply':
         cache_plan = get_plan_from_cache(st.account)
-        executables = [' '.join(q) for q in gen_queries(st.account,cache_plan)]
+        batch_sizes = [int(param) for param in params if param.isnumeric()]
         apply(
             st,
             plan_id = cache_plan['plan_id'],
-            executables = executables,
-            method = 'conc' if method_concurrent else 'seq' # default seq
+            queries = gen_queries(st.account,cache_plan, get_objects_from_cache(st.account) if 'coalesce' in params else None),
+            method = 'batch' if 'batch' in params else 'conc' if method_concurrent else 'seq', # default seq
+            **({'batch_size':batch_sizes[0]} if batch_sizes else {})
         )
     else:
+        TRACER.stop()
         return False
+    if trace:
+        trace_file = TRACER.export(os.path.join(CONFIG_DIR,'config',st.account,'traces',f'{TRACER.run_id}.json'))
+        st.print(f'Trace written to {Style.BRIGHT + Fore.YELLOW}{trace_file}')
     cli_input('\n'*4 + 'To continue press any key')
     return True
     
@@ -1,15 +1,33 @@
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from colorama import Style,Fore
 from styling import * 
 
 class ControlState:
-    __slots__ = 'connection', 'account', 'executor','snowcache','snowplan','queries','ignore_objects','verbosity'
-    def __init__(self, verbosity = 3, max_workers = 100):
+    __slots__ = 'connection', 'account', 'executor','snowcache','snowplan','queries','ignore_objects','verbosity','grant_cache_ttl','pool','fetch_mode','ignored_containers','scan_started_utc'
+    def __init__(self, verbosity = 3, max_workers = 100, grant_cache_ttl = None):
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
         self.verbosity = verbosity
+        self.grant_cache_ttl = grant_cache_ttl
+        self.pool = None
+        # 'result_scan': filter SHOW results in Snowflake (queries.py), 'local': fetch SHOW results and filter them here (show_results.py)
+        self.fetch_mode = 'result_scan'
+        # {object type: schemas (DB.SCHEMA) the last scan dropped objects of that type from}, see get_objects.process_scanned_objects
+        self.ignored_containers = {}
+        # When the last object scan sent its first SHOW (UTC, object_cache format), saved as the cache's time
+        self.scan_started_utc = None
 
     def __del__(self): 
         self.executor.shutdown()
+        if self.pool:
+            self.pool.close()
+
+    def checkout(self):
+        """
+            Context manager handing out a connection for a unit of work: one from the connection pool
+            when there is one (see connection_pool.py), the single state connection otherwise
+        """
+        return self.pool.connection() if self.pool else nullcontext(self.connection)
     
     def print(self,message,  verbosity_level = 0, **kwargs):
         if verbosity_level <= self.verbosity:
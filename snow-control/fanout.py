@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from load import CONFIG_DIR, snowplan_path
+from snowplan import Snowplan
+
+# Runs one cli.py command (get, plan or apply) for many accounts at once. Every account runs in its own
+# cli.py process (its own connections, ControlState, caches and trace), with its output in
+# config/<account>/logs/. A global budget of Snowflake connections is split between the accounts running
+# at the same time, so however many accounts there are, none of them gets more than its share: its main
+# connection plus a pool of the rest. The machine's CPUs are split the same way between their plan processes
+FANOUT_COMMANDS = ('get','plan','apply')
+DEFAULT_CONNECTION_BUDGET = int(os.environ.get('CONTROL_FANOUT_BUDGET', 32))
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+
+def configured_accounts() -> list[str]:
+    config = os.path.join(CONFIG_DIR,'config')
+    return sorted(
+        entry for entry in os.listdir(config)
+        if os.path.isdir(os.path.join(config, entry)) and os.path.exists(os.path.join(config, entry, 'roles.yaml'))
+    )
+
+def resolve_accounts(patterns:list[str]) -> list[str]:
+    """
+        Accounts (directories under config/ with a roles.yaml) matching any of {patterns}, names or globs
+    """
+    configured = configured_accounts()
+    accounts = [account for account in configured if any(fnmatch.fnmatchcase(account, pattern) for pattern in patterns)]
+    unknown = [pattern for pattern in patterns if not any(char in pattern for char in '*?[') and pattern not in configured]
+    assert not unknown, f'No configuration in {os.path.join(CONFIG_DIR,"config")} for {", ".join(unknown)}'
+    return accounts
+
+
+def plan_deltas(account:str) -> dict:
+    """
+        Roles/users and grants to revoke/keep/grant in the account's cached plan
+    """
+    path = snowplan_path(account)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return {}
+    deltas = {'roles': 0, 'users': 0, 'to_revoke': 0, 'ok': 0, 'to_grant': 0}
+    for section, _, plan in Snowplan(path).records():
+        deltas[section.lower()] += 1
+        for delta_type in ('to_revoke','ok','to_grant'):
+            deltas[delta_type] += len(plan[delta_type])
+    return deltas
+
+def cached_object_counts(account:str) -> dict:
+    manifest = os.path.join(CONFIG_DIR,'config',account,'.snowcache.d','manifest.json')
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest,'r') as f:
+        counts = json.load(f)['objects']
+    return {'object_types': len(counts), 'objects': sum(counts.values())}
+
+
+def run_account(command:str, account:str, arguments:list[str], pool_size:int, plan_processes:int, run_id:str) -> dict:
+    """
+        cli.py {command} --account {account} {arguments} with a pool of {pool_size} connections (besides its main one)
+        and up to {plan_processes} plan processes, logged to config/{account}/logs/
+    """
+    log_path = os.path.join(CONFIG_DIR,'config',account,'logs',f'{run_id}-{command}.log')
+    os.makedirs(os.path.dirname(log_path), exist_ok = True)
+    environment = os.environ | {
+        'CONTROL_POOL_SIZE': str(pool_size),
+        'CONTROL_PLAN_PROCESSES': os.environ.get('CONTROL_PLAN_PROCESSES', str(plan_processes)),
+    }
+    start = time.perf_counter()
+    with open(log_path,'w') as log:
+        returncode = subprocess.run(
+            [sys.executable, CLI, command, '--account', account, *arguments],
+            stdout = log, stderr = subprocess.STDOUT, stdin = subprocess.DEVNULL, env = environment
+        ).returncode
+    summary = {
+        'account': account,
+        'status': 'ok' if returncode == 0 else f'failed ({returncode})',
+        'seconds': round(time.perf_counter() - start, 2),
+        'log': log_path,
+    }
+    if returncode != 0:
+        # whatever cache/plan the account has is from an earlier run
+        return summary
+    return summary | (cached_object_counts(account) if command == 'get' else plan_deltas(account))
+
+def fanout(command:str, patterns:list[str], arguments:list[str] = [], parallel:int = None, budget:int = DEFAULT_CONNECTION_BUDGET) -> list[dict]:
+    """
+        Run {command} for every account matching {patterns}, {parallel} accounts at a time (default and at most: as many
+        as the budget allows with 2 connections each). Returns a summary per account, in the order they finished
+    """
+    assert command in FANOUT_COMMANDS, f'fanout runs one of {FANOUT_COMMANDS}, not {command}'
+    # an account needs its main connection and a pool of at least one
+    assert budget >= 2, f'The connection budget has to be at least 2, not {budget}'
+    assert parallel is None or parallel >= 1, f'The number of parallel accounts has to be at least 1, not {parallel}'
+    accounts = resolve_accounts(patterns)
+    if not accounts:
+        print(f'No account matches {" ".join(patterns)}')
+        return []
+    parallel = min(len(accounts), parallel or budget, budget // 2)
+    # every account also holds its main connection (ControlState.connection) besides the pool
+    pool_size = budget // parallel - 1
+    plan_processes = max(1, (os.cpu_count() or 1) // parallel)
+    run_id = str(int(time.time()))
+    print(f'Running {command} on {len(accounts)} accounts, {parallel} at a time with {pool_size + 1} connections each')
+    summaries = []
+    with ThreadPoolExecutor(max_workers = parallel) as executor:
+        futures = [executor.submit(run_account, command, account, arguments, pool_size, plan_processes, run_id) for account in accounts]
+        for future in as_completed(futures):
+            summary = future.result()
+            print(format_summary(summary), flush = True)
+            summaries.append(summary)
+    print_totals(summaries)
+    return summaries
+
+
+SUMMARY_COLUMNS = ['objects','roles','users','to_revoke','ok','to_grant']
+
+def format_summary(summary:dict) -> str:
+    counts = ' '.join(f'{column}={summary[column]}' for column in SUMMARY_COLUMNS if column in summary)
+    return f'{summary["account"]:30} {summary["status"]:12} {summary["seconds"]:>9.2f}s   {counts}'
+
+def print_totals(summaries:list[dict]) -> None:
+    totals = {column: sum(summary.get(column, 0) for summary in summaries) for column in SUMMARY_COLUMNS}
+    failed = [summary for summary in summaries if summary['status'] != 'ok']
+    slowest = max(summaries, key = lambda summary: summary['seconds'])
+    print(f'\n{len(summaries) - len(failed)}/{len(summaries)} accounts succeeded, slowest {slowest["account"]} ({slowest["seconds"]:.2f}s), '
+          f'{sum(summary["seconds"] for summary in summaries):.2f}s of account time in total')
+    print('Totals: ' + ' '.join(f'{column}={total}' for column, total in totals.items() if total))
+    for summary in failed:
+        print(f'{summary["account"]} {summary["status"]}, see {summary["log"]}')
@@ -1,44 +1,43 @@
 from queries import * 
+import numpy as np
 from styling import time_func
+from tracing import span, traced_execute
 from sf_object_structures import * 
 from load import * 
 import snowflake.connector as snowcon
-from typing import Tuple
+from typing import Tuple, Callable
 from concurrent.futures import ThreadPoolExecutor
-import json 
-from time import localtime,strftime
 from control_state import ControlState
-from itertools import repeat
+from object_cache import write_object_cache, utc_now, ObjectRegistry
+from async_queries import run_pipeline, fetch_pandas
+from show_results import show_frame, name_frame, common_name_filter
 
 
 @time_func
 def object_scan(state:ControlState, method = 'conc') -> dict:
     objects = {}
-    conn = state.connection
+    state.ignored_containers = {}
+    state.scan_started_utc = utc_now()
     tp_executor = state.executor
     def individual_object_scan(item: Tuple[str,list[str]]):
         obj_type, key = item
-        cur = conn.cursor()
-        formatted_query = (INTEGRATION_SHOW_QUERY if obj_type.upper().endswith('INTEGRATION') else SHOW_QUERY).format(obj_type)
-        state.print(f'Executing show query on object type {obj_type}', verbosity_level=4)
-        cur.execute(formatted_query)
-        qid = cur.sfqid
-        state.print(f'Retrieving objects of type {obj_type} in account', verbosity_level=3)
-        panda = cur.execute(
-            NAME_QUERY.format(
-                qid = qid, 
-                key = ','.join([f'"{s}"' for s in key])
-            )
-        ).fetch_pandas_all()
-
-        if obj_type.upper() in ('PROCEDURE','FUNCTION'):
-            panda = panda[panda['is_builtin'] == 'N']
-        panda['FULL_NAME'] = panda['FULL_NAME'].apply(
-            lambda x: process_name(x.replace(' RETURN ',':'), obj_type.upper())
-        )
-        panda = panda[panda['FULL_NAME'].apply(lambda name: not object_matches_any(name,state.ignore_objects))]
-        
-        return (obj_type,panda)
+        with state.checkout() as conn, span(f'scan {obj_type}', cat = 'object type'):
+            cur = conn.cursor()
+            qid = execute_show_query(state, cur, obj_type)
+            state.print(f'Retrieving objects of type {obj_type} in account', verbosity_level=3)
+            if state.fetch_mode == 'local':
+                panda = name_frame(show_frame(cur), key)
+            else:
+                panda = traced_execute(
+                    cur,
+                    NAME_QUERY.format(
+                        qid = qid, 
+                        key = format_key(key),
+                        columns = format_key(projected_columns(obj_type))
+                    ),
+                    f'result_scan {obj_type}'
+                ).fetch_pandas_all()
+            return (obj_type,process_scanned_objects(state, obj_type, panda))
 
     if method == 'seq':
         for obj_type,full_name_columns in GET_FULL_NAME.items():
@@ -46,6 +45,21 @@ def object_scan(state:ControlState, method = 'conc') -> dict:
             print(full_name_columns)
             _, result_df = individual_object_scan((obj_type,full_name_columns))
             objects[obj_type] = result_df
+    elif method == 'async':
+        state.print(f'Submitting show queries on {len(GET_FULL_NAME)} object types', verbosity_level=3)
+        with state.checkout() as conn:
+            results = run_pipeline(conn, {
+                obj_type: (
+                    show_query(obj_type),
+                    None if state.fetch_mode == 'local' else lambda qid, obj_type = obj_type, key = key: NAME_QUERY.format(qid = qid, key = format_key(key), columns = format_key(projected_columns(obj_type))),
+                    (lambda cur, key = key: name_frame(show_frame(cur), key)) if state.fetch_mode == 'local' else fetch_pandas
+                )
+                for obj_type, key in GET_FULL_NAME.items()
+            })
+        for obj_type, panda in results.items():
+            objects[obj_type] = process_scanned_objects(state, obj_type, panda)
+    elif method == 'shard':
+        objects |= sharded_object_scan(state, individual_object_scan)
     else: 
         results = tp_executor.map(individual_object_scan,GET_FULL_NAME.items())
         for obj_type,result_df in results:
@@ -53,79 +67,301 @@ def object_scan(state:ControlState, method = 'conc') -> dict:
 
     return objects
 
-def filter_objects(state:ControlState, objects:dict[str,pd.DataFrame], method:str) -> dict[str,pd.DataFrame]:
-    dbs = objects['database']
+# SHOW commands return at most this many rows
+SHOW_ROW_LIMIT = 10000
+# Object types that live inside a database, and can be listed per database/schema
+CONTAINED_TYPES = ['schema'] + NLOs + FNCs
+# SHOW commands that accept LIMIT ... FROM. The others (functions, procedures, stages, pipes, file formats, tags)
+# are listed whole, per database and then per schema when a database has too many of them
+PAGINATED_TYPES = {'database','schema','table','dynamic table','view','materialized view','external table','task','stream'}
+
+def sharded_object_scan(state:ControlState, individual_object_scan:Callable) -> dict:
+    """
+        object_scan(method='shard'): instead of one show ... in account per object type
+            1. Account level objects (and the list of databases) are scanned as usual
+            2. Every (object type, database) pair is its own shard, scanned in parallel with show ... in database
+            3. A database with more objects of a type than a single SHOW returns is split into its schemas,
+               each one paged through with show ... in schema ... limit ... from (listed whole for types that
+               aren't PAGINATED_TYPES)
+        Shards are concatenated back into one frame per type, so the result is the same as object_scan's
+    """
+    objects = dict(state.executor.map(individual_object_scan, [(t,k) for t,k in GET_FULL_NAME.items() if t not in CONTAINED_TYPES]))
+    # Every database, including ones the ignore patterns drop: their schemas and objects may not be ignored
+    with state.checkout() as conn:
+        databases = list(paginated_show(state, conn.cursor(), 'database', 'account', ['name']).pipe(lambda df: df[common_name_filter(df)])['name'])
+    state.print(f'Scanning {len(CONTAINED_TYPES)} object types in {len(databases)} databases', verbosity_level=3)
+
+    def scan_shard(item:Tuple[str,str]) -> Tuple[str,pd.DataFrame]:
+        obj_type, database = item
+        with state.checkout() as conn, span(f'shard {obj_type}', cat = 'object type', database = database):
+            cur = conn.cursor()
+            database_scope = f'database {quote_identifier(database)}'
+            shard = show_page(state, cur, obj_type, database_scope)
+            if len(shard) < SHOW_ROW_LIMIT:
+                return obj_type, shard
+            state.print(f'{obj_type}s in {database} exceed {SHOW_ROW_LIMIT} rows, scanning by schema', verbosity_level=3)
+            schemas = paginated_show(state, cur, 'schema', database_scope, ['name'])['name']
+            return obj_type, pd.concat(
+                [shard.iloc[0:0]] + [
+                    paginated_show(state, cur, obj_type, f'schema {quote_identifier(database)}.{quote_identifier(schema)}', GET_FULL_NAME[obj_type])
+                    for schema in schemas
+                ], 
+                ignore_index = True
+            )
+
+    shards = {obj_type: [] for obj_type in CONTAINED_TYPES}
+    for obj_type, shard in state.executor.map(scan_shard, [(t,db) for t in CONTAINED_TYPES for db in databases]):
+        shards[obj_type].append(shard)
+    for obj_type in CONTAINED_TYPES:
+        raw = pd.concat(shards[obj_type], ignore_index = True) if shards[obj_type] else pd.DataFrame({column:[] for column in ['name'] + GET_FULL_NAME[obj_type]})
+        objects[obj_type] = process_scanned_objects(state, obj_type, name_frame(raw, GET_FULL_NAME[obj_type]))
+    return objects
+
+def quote_identifier(name:str) -> str:
+    return '"' + name.replace('"','""') + '"'
+
+def show_page(state:ControlState, cur, obj_type:str, scope:str, start_from:str = None) -> pd.DataFrame:
+    """
+        Raw SHOW output (one page of at most SHOW_ROW_LIMIT rows) of objects of type {obj_type} in {scope}.
+        Types that aren't PAGINATED_TYPES are listed without a limit
+    """
+    if obj_type not in PAGINATED_TYPES:
+        assert start_from is None, f'show {obj_type}s does not support limit ... from'
+        query = f'show {obj_type}s in {scope}'
+    else:
+        from_clause = " from '" + start_from.replace("'","''") + "'" if start_from is not None else ''
+        query = f'show {obj_type}s in {scope} limit {SHOW_ROW_LIMIT}{from_clause}'
+    state.print(f'Executing {query}', verbosity_level=4)
+    traced_execute(cur, query, f'show {obj_type}', scope = scope)
+    return show_frame(cur)
+
+def paginated_show(state:ControlState, cur, obj_type:str, scope:str, key:list[str]) -> pd.DataFrame:
+    """
+        Every object of type {obj_type} in {scope}, paging with limit ... from '<last name>' while pages are full
+        (a single SHOW without a limit for types that aren't PAGINATED_TYPES).
+        Pages overlap on the name they start from (and overloaded functions share names), so rows are deduplicated on {key}
+    """
+    pages = [show_page(state, cur, obj_type, scope)]
+    if obj_type not in PAGINATED_TYPES:
+        return pages[0]
+    seen = set(pages[0][key].itertuples(index = False, name = None)) if not pages[0].empty else set()
+    # a full page means there may be more, however many of its rows were already seen
+    last_page = pages[0]
+    while len(last_page) >= SHOW_ROW_LIMIT:
+        last_page = show_page(state, cur, obj_type, scope, start_from = last_page['name'].iloc[-1])
+        new_rows = [row not in seen for row in last_page[key].itertuples(index = False, name = None)]
+        if not any(new_rows):
+            break
+        page = last_page[new_rows]
+        seen |= set(page[key].itertuples(index = False, name = None))
+        pages.append(page)
+    return pd.concat(pages, ignore_index = True)
+
+def show_query(obj_type:str) -> str:
+    return (INTEGRATION_SHOW_QUERY if obj_type.upper().endswith('INTEGRATION') else SHOW_QUERY).format(obj_type)
+
+def execute_show_query(state:ControlState, cur, obj_type:str) -> str:
+    state.print(f'Executing show query on object type {obj_type}', verbosity_level=4)
+    traced_execute(cur, show_query(obj_type), f'show {obj_type}')
+    return cur.sfqid
+
+def format_key(key:list[str]) -> str:
+    return ','.join([f'"{s}"' for s in key])
+
+def process_scanned_objects(state:ControlState, obj_type:str, panda:pd.DataFrame) -> pd.DataFrame:
+    """
+        Drop builtin functions/procedures, standardize FULL_NAME (see process_name) 
+        and remove any object matching the account's ignore patterns.
+        Only the projected_columns of the type are kept (plus the upper case columns added by the scan queries).
+        The schemas ignored objects were in are recorded in state.ignored_containers
+    """
+    panda = panda[[column for column in panda.columns if column in projected_columns(obj_type) or column.isupper()]]
+    if obj_type.upper() in ('PROCEDURE','FUNCTION'):
+        panda = panda[panda['is_builtin'] == 'N']
+    if not panda.empty:
+        panda = panda.assign(FULL_NAME = process_names(panda['FULL_NAME'].str.replace(' RETURN ',':', regex = False), obj_type.upper()))
+    ignored = get_pattern_matcher(state.ignore_objects, ignore_case = True).mask(panda['FULL_NAME'])
+    record_ignored_containers(state, obj_type, panda[ignored])
+    return as_categoricals(panda[~ignored])
+
+def record_ignored_containers(state:ControlState, obj_type:str, ignored:pd.DataFrame) -> None:
+    # An ON ALL <TYPE>S IN SCHEMA statement would also reach the objects the cache doesn't have (see coalesce.py)
+    database = 'catalog_name' if 'catalog_name' in ignored.columns else 'database_name'
+    if ignored.empty or database not in ignored.columns or 'schema_name' not in ignored.columns:
+        return
+    containers = (ignored[database].astype(str) + '.' + ignored['schema_name'].astype(str)).unique()
+    state.ignored_containers.setdefault(obj_type, set()).update(containers)
+
+# filter_objects splits a few raw SHOW types into several cached types.
+# An incremental scan has to stitch them back together to get the raw registry
+RAW_TYPE_PARTS = {
+    'database': ['database','shared database','application database'],
+    'view': ['view','materialized view'],
+    'table': ['table','external table'],
+}
+# Past this many new/changed objects for a type, re-fetching the full type is cheaper than an IN list
+INCREMENTAL_DELTA_LIMIT = 5000
+
+@time_func
+def incremental_object_scan(state:ControlState, cached:dict[str,pd.DataFrame], since:str, method = 'conc') -> dict:
+    """
+        Refresh a cached registry of objects instead of re-reading every object in the account. 
+        For each object type: 
+            1. Run the same show query as object_scan
+            2. Retrieve only the name columns of the result, flagging objects created since {since} (UTC)
+            3. Objects that are cached but no longer present have been dropped
+            4. Objects that are new/renamed or (re)created since the last cache are the only rows retrieved in full
+        Returns the merged raw registry (in the same shape object_scan returns), to be run through filter_objects
+    """
+    objects = {}
+    state.ignored_containers = {}
+    state.scan_started_utc = utc_now()
+    ignore_dbs = set(column_or_empty(cached.get('shared database'),'name')) | set(column_or_empty(cached.get('application database'),'name'))
+
+    def individual_incremental_scan(item: Tuple[str,list[str]]):
+        obj_type, key = item
+        parts = [cached[part] for part in RAW_TYPE_PARTS.get(obj_type,[obj_type]) if part in cached and not cached[part].empty]
+        base = pd.concat(parts, ignore_index = True) if parts else pd.DataFrame({'FULL_NAME':[]})
+        with state.checkout() as conn, span(f'refresh {obj_type}', cat = 'object type'):
+            return individual_incremental_merge(obj_type, key, base, conn.cursor())
+
+    def individual_incremental_merge(obj_type:str, key:list[str], base:pd.DataFrame, cur):
+        qid = execute_show_query(state, cur, obj_type)
+        state.print(f'Retrieving names of objects of type {obj_type} in account', verbosity_level=3)
+        keys = traced_execute(
+            cur,
+            KEY_QUERY.format(
+                qid = qid, 
+                key = format_key(key),
+                columns = format_key(set(key) | ({'is_builtin'} if obj_type in FNCs else set())),
+                since = since
+            ),
+            f'keys {obj_type}'
+        ).fetch_pandas_all()
+        keys['RAW_NAME'] = keys['FULL_NAME']
+        keys = process_scanned_objects(state, obj_type, keys)
+
+        current_names = set(keys['FULL_NAME'])
+        # Objects in ignored containers (shared/application/dev dbs) are never cached, so they aren't "new" either
+        _, wanted = filter_function(obj_type, keys, ignore_dbs)
+        stale = wanted[~wanted['FULL_NAME'].isin(set(base['FULL_NAME'])) | wanted['IS_CHANGED'].fillna(False).astype(bool)]
+        kept = base[base['FULL_NAME'].isin(current_names) & ~base['FULL_NAME'].isin(set(stale['FULL_NAME']))]
+        state.print(
+            f'{obj_type}: {len(kept)} unchanged, {len(stale)} new/changed, {len(base) - len(base[base["FULL_NAME"].isin(current_names)])} dropped',
+            verbosity_level=3
+        )
+
+        if stale.empty:
+            return (obj_type,kept)
+        if len(stale) > INCREMENTAL_DELTA_LIMIT:
+            delta_query = NAME_QUERY.format(qid = qid, key = format_key(key), columns = format_key(projected_columns(obj_type)))
+            kept = kept.iloc[0:0]
+        else:
+            delta_query = DELTA_NAME_QUERY.format(
+                qid = qid, 
+                key = format_key(key),
+                columns = format_key(projected_columns(obj_type)),
+                names = ','.join("'" + name.replace("'","''") + "'" for name in stale['RAW_NAME'])
+            )
+        delta = process_scanned_objects(state, obj_type, traced_execute(cur, delta_query, f'delta {obj_type}', objects = len(stale)).fetch_pandas_all())
+        return (obj_type,pd.concat([kept,delta], ignore_index = True))
+
+    if method == 'seq':
+        for item in GET_FULL_NAME.items():
+            obj_type, result_df = individual_incremental_scan(item)
+            objects[obj_type] = result_df
+    else: 
+        for obj_type,result_df in state.executor.map(individual_incremental_scan,GET_FULL_NAME.items()):
+            objects[obj_type] = result_df
+    return objects
+
+def column_or_empty(df:pd.DataFrame, column:str) -> pd.Series:
+    if df is None or column not in df:
+        return pd.Series([], dtype = object)
+    return df[column]
+
+def filter_objects(state:ControlState, objects:dict[str,pd.DataFrame], method:str) -> ObjectRegistry:
+    """
+        Split the raw SHOW types into the cached types (views/materialized views, ...) and drop objects in
+        shared, application and dev databases. No rows are copied: every cached type is a mask over the frame
+        its raw type was scanned into (see ObjectRegistry)
+    """
+    registry = ObjectRegistry(objects)
+    equals = lambda obj_type, column, value: (registry.base_frame(obj_type)[column] == value).to_numpy(dtype = bool)
     # Shared Databases
-    objects['shared database'] = dbs[dbs['kind']== 'IMPORTED DATABASE'].copy()
+    registry.derive('shared database', 'database', equals('database','kind','IMPORTED DATABASE'))
     # Application DBs
-    objects['application database'] = dbs[dbs['kind'] == 'APPLICATION'].copy()
-    shared_dbs = set(objects['shared database']['name'])
-    application_dbs = set(objects['application database']['name'])
-    ignore_dbs = shared_dbs | application_dbs
+    registry.derive('application database', 'database', equals('database','kind','APPLICATION'))
+    ignore_dbs = set(registry['shared database']['name']) | set(registry['application database']['name'])
 
     # Special Consideration Stage
-    objects['internal stage'] = objects['stage'][objects['stage']['type']=='INTERNAL'].copy()
-    objects['external stage'] = objects['stage'][objects['stage']['type']=='EXTERNAL'].copy()
+    registry.derive('internal stage', 'stage', equals('stage','type','INTERNAL'))
+    registry.derive('external stage', 'stage', equals('stage','type','EXTERNAL'))
 
     # Special Consideration: Information Schema Views
-    objects['view'] = objects['view'][objects['view']['schema_name']!='INFORMATION_SCHEMA'].copy()
+    registry.restrict('view', ~equals('view','schema_name','INFORMATION_SCHEMA'))
     # Special Consideration: View
-    objects['materialized view'] = objects['view'][objects['view']['is_materialized']=='true'].copy()
-    objects['view'] = objects['view'][objects['view']['is_materialized']=='false'].copy()
-
+    registry.derive('materialized view', 'view', equals('view','is_materialized','true'))
+    registry.restrict('view', equals('view','is_materialized','false'))
 
     # Special Consideration: xtab
-    objects['external table'] = objects['table'][objects['table']['is_external']=='Y'].copy()
-    objects['table'] = objects['table'][objects['table']['is_external']=='N'].copy()
+    registry.derive('external table', 'table', equals('table','is_external','Y'))
+    registry.restrict('table', equals('table','is_external','N'))
 
     # Special Consideration: Objects where db/container is a shared/app db
-    if method == 'seq':
-        return dict(
-            filter_function(obj_typ,object_df,ignore_dbs)
-            for obj_typ, object_df in objects.items() 
-        )
-    else:
-        return { 
-            sf_type:df 
-            for sf_type,df in  
-            state.executor.map(
-                filter_function,
-                *zip(*objects.items()),repeat(ignore_dbs)
-            )
-        }
+    # Types derived from the same frame share their container column, so it is only matched once per frame
+    containers = {
+        (registry.views[obj_type][0], container_identifier(obj_type)) 
+        for obj_type in registry if container_identifier(obj_type)
+    }
+    keep_rows = lambda item: (item, ~ignored_containers(registry.frames[item[0]][item[1]], ignore_dbs))
+    kept = dict(map(keep_rows, containers) if method == 'seq' else state.executor.map(keep_rows, containers))
+    for obj_type in list(registry):
+        identifier = container_identifier(obj_type)
+        if identifier:
+            registry.restrict(obj_type, kept[(registry.views[obj_type][0], identifier)])
+    return registry
 
+# Databases created per environment/branch, never cached
+DEV_DATABASE_PATTERN = r'.*_(DEV|QA|PROD)_[0-9]{1,5}'
 
-def filter_function(obj_type:str, obj_df:pd.DataFrame, ignore_dbs:set, ignore_pattern =  r'.*_(DEV|QA|PROD)_[0-9]{1,5}') -> Tuple[str,pd.DataFrame]:
-    identifier = 'database_name'
-    if obj_type.lower() in FNCs:
-        identifier = 'catalog_name'
-    elif obj_type.lower() == 'database':
-        identifier = 'name'
-    elif obj_type.lower() in ALOs or obj_type.lower() in ('shared database','application database'):
-        identifier = None
-    
+def container_identifier(obj_type:str) -> str:
+    """
+        The column holding the database an object of {obj_type} is in (None for objects that aren't in one)
+    """
+    obj_type = obj_type.lower()
+    if obj_type in FNCs:
+        return 'catalog_name'
+    elif obj_type == 'database':
+        return 'name'
+    elif obj_type in ALOs or obj_type in ('shared database','application database'):
+        return None
+    return 'database_name'
+
+def ignored_containers(containers:pd.Series, ignore_dbs:set, ignore_pattern = DEV_DATABASE_PATTERN) -> np.ndarray:
+    """
+        Boolean mask of the rows of {containers} in one of {ignore_dbs} or matching {ignore_pattern}.
+        A categorical column is matched on its categories, not on every row
+    """
+    if isinstance(containers.dtype, pd.CategoricalDtype):
+        categories = pd.Series(containers.cat.categories, dtype = object)
+        # code -1 (NULL) picks the trailing False
+        ignored = np.append(ignored_containers(categories, ignore_dbs, ignore_pattern), False)
+        return ignored[containers.cat.codes.to_numpy()]
+    return (containers.isin(ignore_dbs) | get_pattern_matcher((ignore_pattern,)).mask(containers)).to_numpy(dtype = bool)
+
+def filter_function(obj_type:str, obj_df:pd.DataFrame, ignore_dbs:set, ignore_pattern = DEV_DATABASE_PATTERN) -> Tuple[str,pd.DataFrame]:
+    identifier = container_identifier(obj_type)
     if identifier:
-        filter = lambda db: db not in ignore_dbs and not re.match(ignore_pattern,db)
-        return obj_type,obj_df[obj_df[identifier].apply(filter)]
+        return obj_type,obj_df[~ignored_containers(obj_df[identifier], ignore_dbs, ignore_pattern)]
     return obj_type,obj_df
     
 
 def save_cache(st:ControlState, objects:dict[str,pd.DataFrame]):
-    with open(os.path.join(CONFIG_DIR,'config',st.account,'.snowcache'),'w') as f:
-
-        f.write(json.dumps(
-            {
-               'local_cached_time': strftime("%Y-%m-%d %H:%M:%S",localtime()),
-               'objects':{
-                   # wHy DoNt u UsE to_DiCt, because the stupid to_dict function 
-                   # isn't fucking json safe
-                   k:(
-                       json.loads(df.set_index('FULL_NAME',drop = True).to_json(orient='index'))
-                        if not df.empty 
-                        else {}
-                   )
-                   for k,df in objects.items()
-               }
-            }, indent = 4
-        )
-        )
\ No newline at end of file
+    account_dir = os.path.join(CONFIG_DIR,'config',st.account)
+    # Stamped with when the scan started: an object created while it ran may be missing, the next refresh picks it up
+    write_object_cache(account_dir, objects, ignored_containers = st.ignored_containers, cached_time_utc = st.scan_started_utc)
+    # The JSON .snowcache is only read when no columnar cache exists, drop it so it can't go stale
+    legacy_cache = os.path.join(account_dir,'.snowcache')
+    if os.path.exists(legacy_cache):
+        os.remove(legacy_cache)
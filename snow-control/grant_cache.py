@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Iterable, Tuple
+from load import CONFIG_DIR
+
+GRANT_CACHE_FILE = '.snowgrants'
+# Seconds a role's grant snapshot is trusted for before plan goes back to Snowflake
+DEFAULT_GRANT_CACHE_TTL = int(os.environ.get('CONTROL_GRANT_CACHE_TTL', 3600))
+
+
+class GrantSnapshotCache:
+    """
+        Snapshot of the current and future grants to each role, stored next to .snowcache in
+        config/{account}/.snowgrants:
+
+        {
+            "roles": {
+                "<ROLE>": {"captured_at": <epoch seconds>, "current": [[priv,type,name],...], "future": [...]}
+            }
+        }
+
+        A snapshot older than {ttl} seconds is treated as missing. apply drops the snapshots of the roles
+        it sends statements for (see invalidate_grant_snapshots), so a plan after it reads their grants again
+    """
+    def __init__(self, account:str, ttl:int = None):
+        self.path = os.path.join(CONFIG_DIR,'config',account,GRANT_CACHE_FILE)
+        self.ttl = DEFAULT_GRANT_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self.roles = {}
+        if os.path.exists(self.path):
+            with open(self.path,'r') as f:
+                contents = f.read()
+            self.roles = json.loads(contents)['roles'] if contents.strip() else {}
+
+    def get(self, role:str) -> Tuple[set,set]:
+        """
+            Returns (current, future) grants to the role, or None if there is no fresh snapshot
+        """
+        snapshot = self.roles.get(role.upper())
+        if not snapshot or time.time() - snapshot['captured_at'] > self.ttl:
+            return None
+        return (
+            {tuple(grant) for grant in snapshot['current']},
+            {tuple(grant) for grant in snapshot['future']}
+        )
+
+    def digest(self, role:str) -> str:
+        """
+            Hash of the grants in the role's snapshot, None if there is no fresh snapshot
+        """
+        snapshot = self.roles.get(role.upper())
+        if not snapshot or time.time() - snapshot['captured_at'] > self.ttl:
+            return None
+        return hashlib.sha256(json.dumps([snapshot['current'], snapshot['future']]).encode()).hexdigest()
+
+    def put(self, role:str, current:set, future:set) -> None:
+        with self._lock:
+            self.roles[role.upper()] = {
+                'captured_at': time.time(),
+                'current': sorted(current),
+                'future': sorted(future)
+            }
+
+    def drop(self, roles:Iterable[str]) -> int:
+        """
+            Forget the snapshots of {roles}, returns how many there were
+        """
+        with self._lock:
+            return sum(self.roles.pop(role.upper(), None) is not None for role in roles)
+
+    def save(self) -> None:
+        with self._lock:
+            with open(self.path + '.tmp','w') as f:
+                f.write(json.dumps({'roles':self.roles}))
+            os.replace(self.path + '.tmp', self.path)
+
+
+def invalidate_grant_snapshots(account:str, roles:Iterable[str]) -> int:
+    """
+        Drop the grant snapshots of {roles} from the account's .snowgrants (their grants were just changed)
+    """
+    cache = GrantSnapshotCache(account)
+    dropped = cache.drop(roles)
+    if dropped:
+        cache.save()
+    return dropped
@@ -0,0 +1,196 @@
+from load import ATOMIC_GROUPS
+from sf_object_structures import DETAILED_OBJECT_TYPE_MAPPER, process_name, pluralize
+from queries import CURRENT_GRANTS_TO_ROLE, FUTURE_GRANTS_TO_ROLE, ACCOUNT_GRANTS_TO_ROLES_QUERY
+from async_queries import run_pipeline, fetch_rows
+from show_results import current_grant_rows, future_grant_rows
+from control_state import ControlState
+from tracing import traced_execute
+from collections import defaultdict
+from typing import Iterable, Tuple
+import threading
+import re
+
+ALL_OBJECT_TYPES = set(ATOMIC_GROUPS.keys()).union(set(DETAILED_OBJECT_TYPE_MAPPER.values()))
+# Identifiers SHOW GRANTS lists as they are, any other is double quoted
+UNQUOTED_IDENTIFIER = re.compile(r'^[A-Z_][A-Z0-9_$]*$')
+
+
+def normalize_current_grants(rows:Iterable[tuple]) -> set:
+    """
+        (privilege, granted_on, name) rows of current grants -> (PRIV, TYPE, FULL_NAME) grants as compared by venn()
+    """
+    return {
+        (
+            priv,
+            DETAILED_OBJECT_TYPE_MAPPER.get(typ.lower(),typ).upper(),
+            process_name(name,typ.upper())
+        )
+        for priv,typ,name in set(rows)
+        # Necessary to avoid running into errors with new SF preview objects
+        if typ.lower() in ALL_OBJECT_TYPES
+    }
+
+def quote_identifier(identifier:str) -> str:
+    return identifier if UNQUOTED_IDENTIFIER.match(identifier) else '"' + identifier.replace('"','""') + '"'
+
+def account_usage_name(granted_on:str, catalog:str, schema:str, name:str) -> str:
+    """
+        The name SHOW GRANTS lists for a grant, from the unquoted parts of its ACCOUNT_USAGE.GRANTS_TO_ROLES row
+        (db.schema for a schema, db.schema."function(arg_name arg_type, ...):return_type" for a routine)
+    """
+    if granted_on == 'ACCOUNT':
+        return name
+    parts = [catalog, name] if granted_on == 'SCHEMA' else [catalog, schema, name] if schema is not None else [name]
+    return '.'.join(map(quote_identifier, parts))
+
+def normalize_future_grants(rows:Iterable[tuple]) -> set:
+    """
+        (privilege, grant_on, container) rows of future grants -> (PRIV, FUTURE <TYPE>S IN <CONTAINER>, CONTAINER) grants
+    """
+    return {
+        (
+            priv,
+            f"FUTURE {pluralize(DETAILED_OBJECT_TYPE_MAPPER.get(typ.lower(),typ).upper())} IN {'DATABASE' if typ.lower() == 'schema' else 'SCHEMA'}",
+            process_name(name,'schema')
+        )
+        for priv,typ,name in set(rows)
+        # Necessary to avoid running into errors with new SF preview objects
+        if typ.lower() in ALL_OBJECT_TYPES
+    }
+
+def get_current_grants_to_role(state,role):
+    with state.checkout() as conn:
+        cur = conn.cursor()
+        state.print(f'Executing show query on role {role}', verbosity_level = 4)
+        traced_execute(cur, f'show grants to role {role}', f'show grants {role}')
+        qid = cur.sfqid
+
+        state.print(f'Retrieving current grants to role {role}', verbosity_level = 3)
+        if state.fetch_mode == 'local':
+            return normalize_current_grants(current_grant_rows(cur))
+        return normalize_current_grants(traced_execute(
+            cur,
+            CURRENT_GRANTS_TO_ROLE.format(qid = qid),
+            f'result_scan grants {role}'
+        ))
+
+def get_future_grants_to_role(state,role):
+    with state.checkout() as conn:
+        cur = conn.cursor()
+        state.print(f'Executing show future query on role {role}', verbosity_level = 4)
+        traced_execute(cur, f'show future grants to role {role}', f'show future grants {role}')
+        qid = cur.sfqid
+
+        state.print(f'Retrieving future grants to role {role}', verbosity_level = 3)
+        if state.fetch_mode == 'local':
+            return normalize_future_grants(future_grant_rows(cur))
+        return normalize_future_grants(traced_execute(
+            cur,
+            FUTURE_GRANTS_TO_ROLE.format(qid = qid),
+            f'result_scan future grants {role}'
+        ))
+
+
+class ShowGrantSource:
+    """
+        Grants to each role straight from SHOW GRANTS / SHOW FUTURE GRANTS (2 round trips each).
+        Always current, but costs 4 queries per role
+    """
+    def __init__(self, state:ControlState):
+        self.state = state
+
+    def prefetch(self, roles:Iterable[str]) -> None:
+        pass
+
+    def grants_to_role(self, role:str) -> Tuple[set,set]:
+        """
+            Returns (current, future) grants to {role}
+        """
+        return get_current_grants_to_role(self.state,role), get_future_grants_to_role(self.state,role)
+
+
+class AccountUsageGrantSource(ShowGrantSource):
+    """
+        Current grants to every role from a single streamed query over SNOWFLAKE.ACCOUNT_USAGE.GRANTS_TO_ROLES,
+        partitioned by role locally, with names quoted the way SHOW GRANTS lists them (see account_usage_name).
+        ACCOUNT_USAGE has no view of future grants, so those are still read with SHOW FUTURE GRANTS, but for all
+        prefetched roles at once on the executor.
+
+        NOTE: ACCOUNT_USAGE lags behind the account (up to ~2 hours), grants made since won't show up yet
+    """
+    def __init__(self, state:ControlState):
+        super().__init__(state)
+        self.current = {}
+        self.future = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, roles:Iterable[str]) -> None:
+        roles = [role.upper() for role in roles]
+        if not roles:
+            return
+        state = self.state
+        state.print(f'Retrieving current grants to {len(roles)} roles from ACCOUNT_USAGE', verbosity_level = 3)
+        partitioned = defaultdict(list)
+        with state.checkout() as conn:
+            for grantee, privilege, granted_on, *parts in traced_execute(conn.cursor(), ACCOUNT_GRANTS_TO_ROLES_QUERY, 'account_usage grants'):
+                partitioned[grantee].append((privilege, granted_on, account_usage_name(granted_on, *parts)))
+        futures = state.executor.map(lambda role: (role, get_future_grants_to_role(state,role)), roles)
+        with self._lock:
+            self.current |= {role: normalize_current_grants(partitioned.get(role,[])) for role in roles}
+            self.future |= dict(futures)
+
+    def grants_to_role(self, role:str) -> Tuple[set,set]:
+        if role.upper() not in self.current:
+            # Not worth another scan of the whole account for a single role
+            return super().grants_to_role(role)
+        return self.current[role.upper()], self.future[role.upper()]
+
+
+class AsyncShowGrantSource(ShowGrantSource):
+    """
+        Same queries as ShowGrantSource, but prefetch() submits the SHOW GRANTS / SHOW FUTURE GRANTS of every role
+        at once through the async query pipeline (see async_queries.py) instead of tying up a thread per role
+    """
+    def __init__(self, state:ControlState):
+        super().__init__(state)
+        self.current = {}
+        self.future = {}
+
+    def prefetch(self, roles:Iterable[str]) -> None:
+        roles = list(roles)
+        if not roles:
+            return
+        self.state.print(f'Submitting grant queries for {len(roles)} roles', verbosity_level = 3)
+        local = self.state.fetch_mode == 'local'
+        jobs = {}
+        for role in roles:
+            jobs[(role,'current')] = (
+                f'show grants to role {role}',
+                None if local else lambda qid: CURRENT_GRANTS_TO_ROLE.format(qid = qid), 
+                current_grant_rows if local else fetch_rows
+            )
+            jobs[(role,'future')] = (
+                f'show future grants to role {role}', 
+                None if local else lambda qid: FUTURE_GRANTS_TO_ROLE.format(qid = qid), 
+                future_grant_rows if local else fetch_rows
+            )
+        with self.state.checkout() as conn:
+            results = run_pipeline(conn, jobs)
+        for role in roles:
+            self.current[role.upper()] = normalize_current_grants(results[(role,'current')])
+            self.future[role.upper()] = normalize_future_grants(results[(role,'future')])
+
+    def grants_to_role(self, role:str) -> Tuple[set,set]:
+        if role.upper() not in self.current:
+            return super().grants_to_role(role)
+        return self.current[role.upper()], self.future[role.upper()]
+
+
+GRANT_SOURCES = {
+    'show': ShowGrantSource,
+    'async': AsyncShowGrantSource,
+    'account_usage': AccountUsageGrantSource
+}
+
+def get_grant_source(state:ControlState, source:str = 'show') -> ShowGrantSource:
+    return GRANT_SOURCES[source](state)
@@ -0,0 +1,134 @@
+import threading
+import numpy as np
+from typing import Iterable, Tuple
+
+# A grant (PRIVILEGE, OBJECT TYPE, FULL_NAME) is packed into one non negative int64:
+#
+#     bits 54-62  privilege id    (512 privileges)
+#     bits 44-53  object type id  (1024 types, including FUTURE <TYPE>S IN <CONTAINER>)
+#     bits 0-43   name id         (~17.6 trillion names)
+#
+# The ids come from the process wide GRANTS interner, so every role, profile expansion and grant source shares one
+# copy of each string. A set of grants is a sorted array of unique keys, which makes venn() a pair of binary searches
+PRIV_SHIFT, TYPE_SHIFT = 54, 44
+PRIV_LIMIT, TYPE_LIMIT, NAME_LIMIT = 1 << 9, 1 << 10, 1 << 44
+NAME_MASK = NAME_LIMIT - 1
+EMPTY = np.empty(0, dtype = np.int64)
+
+
+class GrantInterner:
+    """
+        Maps privileges, object types and names to integer ids (and back), and grants to int64 keys (and back)
+    """
+    def __init__(self):
+        self.privs, self.types, self.names = {}, {}, {}
+        self.priv_values, self.type_values, self.name_values = [], [], []
+        self._lock = threading.Lock()
+
+    def intern(self, table:dict, values:list, value:str, limit:int) -> int:
+        value_id = table.get(value)
+        if value_id is None:
+            value_id = table[value] = len(values)
+            assert value_id < limit, f'Too many distinct values to pack into a grant key ({limit})'
+            values.append(value)
+        return value_id
+
+    def ids(self, table:dict, values:list, items:Iterable[str], limit:int) -> np.ndarray:
+        with self._lock:
+            return np.fromiter((self.intern(table, values, item, limit) for item in items), dtype = np.int64)
+
+    def priv_ids(self, privs:Iterable[str]) -> np.ndarray:
+        return self.ids(self.privs, self.priv_values, privs, PRIV_LIMIT)
+
+    def type_ids(self, types:Iterable[str]) -> np.ndarray:
+        return self.ids(self.types, self.type_values, types, TYPE_LIMIT)
+
+    def name_ids(self, names:Iterable[str]) -> np.ndarray:
+        return self.ids(self.names, self.name_values, names, NAME_LIMIT)
+
+    def encode(self, grants:Iterable[Tuple[str,str,str]]) -> np.ndarray:
+        """
+            Sorted, unique keys of (privilege, object type, name) grants
+        """
+        grants = list(grants)
+        if not grants:
+            return EMPTY
+        privs, types, names = zip(*grants)
+        return np.unique(pack(self.priv_ids(privs), self.type_ids(types), self.name_ids(names)))
+
+    def product(self, privs:Iterable[str], object_type:str, names:Iterable[str]) -> np.ndarray:
+        """
+            Keys of every privilege in {privs} on every object in {names} (of type {object_type}), unsorted
+        """
+        priv_ids, name_ids = self.priv_ids(privs), self.name_ids(names)
+        if not len(priv_ids) or not len(name_ids):
+            return EMPTY
+        type_id = self.type_ids([object_type])[0]
+        return pack(priv_ids[:,None], type_id, name_ids[None,:]).ravel()
+
+    def decode(self, keys:np.ndarray) -> list[Tuple[str,str,str]]:
+        privs, types, names = unpack(keys)
+        priv_values, type_values, name_values = self.priv_values, self.type_values, self.name_values
+        return [
+            (priv_values[p], type_values[t], name_values[n])
+            for p, t, n in zip(privs.tolist(), types.tolist(), names.tolist())
+        ]
+
+    def size(self) -> Tuple[int,int,int]:
+        """
+            Distinct (privileges, object types, names) interned so far
+        """
+        return len(self.priv_values), len(self.type_values), len(self.name_values)
+
+    def name_strings(self, name_ids:np.ndarray) -> list[str]:
+        name_values = self.name_values
+        return [name_values[n] for n in name_ids.tolist()]
+
+    def pair_codes(self, pairs:Iterable[Tuple[str,str]]) -> np.ndarray:
+        """
+            (privilege, object type) pairs as the codes pairs_of() extracts from keys
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return EMPTY
+        privs, types = zip(*pairs)
+        return pairs_of(pack(self.priv_ids(privs), self.type_ids(types), 0))
+
+
+def pack(priv_ids, type_ids, name_ids) -> np.ndarray:
+    return (priv_ids << PRIV_SHIFT) | (type_ids << TYPE_SHIFT) | name_ids
+
+def unpack(keys:np.ndarray) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    return keys >> PRIV_SHIFT, (keys >> TYPE_SHIFT) & (TYPE_LIMIT - 1), keys & NAME_MASK
+
+def pairs_of(keys:np.ndarray) -> np.ndarray:
+    return keys >> TYPE_SHIFT
+
+def names_of(keys:np.ndarray) -> np.ndarray:
+    return keys & NAME_MASK
+
+def union(arrays:Iterable[np.ndarray]) -> np.ndarray:
+    arrays = [array for array in arrays if len(array)]
+    return np.unique(np.concatenate(arrays)) if arrays else EMPTY
+
+def in_sorted(keys:np.ndarray, sorted_keys:np.ndarray) -> np.ndarray:
+    """
+        Boolean mask of {keys} found in the sorted array {sorted_keys}
+    """
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype = bool)
+    positions = np.searchsorted(sorted_keys, keys).clip(max = len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys
+
+def sorted_venn(keys1:np.ndarray, keys2:np.ndarray) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+        venn() of two sorted unique key arrays: (only in keys1, in both, only in keys2)
+    """
+    in_2 = in_sorted(keys1, keys2)
+    return keys1[~in_2], keys1[in_2], keys2[~in_sorted(keys2, keys1)]
+
+
+GRANTS = GrantInterner()
+
+def decode_grants(keys:np.ndarray) -> list[Tuple[str,str,str]]:
+    return GRANTS.decode(keys)
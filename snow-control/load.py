@@ -1,9 +1,11 @@
 import os
-import yaml
 import json 
-import pandas as pd 
+import shutil
 from colorama import Style, Fore 
+from functools import lru_cache
 from typing import Tuple
+from snowplan import Snowplan, SnowplanWriter
+from config_cache import load_config
 
 
 
@@ -11,90 +13,168 @@ from typing import Tuple
 SCRIPT_DIR = os.path.dirname(__file__)
 CONFIG_DIR = os.environ.get('CONTROL_CONFIG_DIR',SCRIPT_DIR)
 
-with open(os.path.join(CONFIG_DIR, 'config/atomic_groups.yaml'), 'r') as file:
-    ATOMIC_GROUPS  = yaml.safe_load(file)
-with open(os.path.join(SCRIPT_DIR,'interactive/intro.txt'),'r') as file: 
-    CLI_INTRO_TEXT = file.read()
-with open(os.path.join(SCRIPT_DIR,'interactive/menu.txt'),'r') as file: 
-    CLI_MENU_TEXT = file.read()
-
-def clear_cache(account_name:str, files_to_clear = ['.snowcache','.snowplan','.snowplansql']):
+# ATOMIC_GROUPS, CLI_INTRO_TEXT and CLI_MENU_TEXT are read on first access (see __getattr__) instead of on import,
+# so commands that never use them (cli.py show/sql) don't pay for parsing them.
+# pandas and the object cache (pyarrow) are likewise only imported by the functions reading objects
+LAZY_TEXT_FILES = {
+    'CLI_INTRO_TEXT': 'interactive/intro.txt',
+    'CLI_MENU_TEXT': 'interactive/menu.txt',
+}
+
+@lru_cache(maxsize = None)
+def load_atomic_groups() -> dict:
+    return load_config(os.path.join(CONFIG_DIR, 'config/atomic_groups.yaml'), mapping_of_mappings)
+
+@lru_cache(maxsize = None)
+def read_script_file(path:str) -> str:
+    with open(os.path.join(SCRIPT_DIR, path),'r') as file: 
+        return file.read()
+
+def __getattr__(name:str):
+    if name == 'ATOMIC_GROUPS':
+        return load_atomic_groups()
+    if name in LAZY_TEXT_FILES:
+        return read_script_file(LAZY_TEXT_FILES[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def clear_cache(account_name:str, files_to_clear = ['.snowcache','.snowplan','.snowplansql','.snowgrants']):
+    from object_cache import clear_object_cache
     for file in files_to_clear: 
         open(os.path.join(CONFIG_DIR,f'config/{account_name}/{file}'),'w').close()
+    clear_object_cache(os.path.join(CONFIG_DIR,'config',account_name))
 
 
 def get_objects_from_cache(account:str):
+    _, objects = read_snowcache(account)
+    return objects
+
+def read_snowcache(account:str) -> Tuple[str,dict]:
+    """
+        Returns (cached_time_utc, objects) from the account's columnar cache (see object_cache.py),
+        falling back to a legacy JSON .snowcache. 
+        cached_time_utc is None if the cache is empty (see clear_cache) or predates incremental refreshes
+    """
+    import pandas as pd
+    from object_cache import ObjectCache, object_cache_dir, MANIFEST
+    cache_dir = object_cache_dir(os.path.join(CONFIG_DIR,'config',account))
+    if os.path.exists(os.path.join(cache_dir, MANIFEST)):
+        objects = ObjectCache(cache_dir)
+        print(f"Retrieving cached record of objects from {Style.BRIGHT + Fore.YELLOW} {objects.local_cached_time} {Style.RESET_ALL} local_time")
+        return objects.cached_time_utc, objects
+    if not os.path.exists(os.path.join(CONFIG_DIR,f'config/{account}/.snowcache')):
+        return None, {}
     with open(os.path.join(CONFIG_DIR,f'config/{account}/.snowcache'),'r') as f: 
-        retrieved = json.loads(f.read())
-        print(f"Retrieving cached record of objects from {Style.BRIGHT + Fore.YELLOW} {retrieved['local_cached_time']} {Style.RESET_ALL} local_time")
-        return {
-            obj_type: pd.DataFrame(value).T.reset_index().rename({'index':'FULL_NAME'}, axis = 'columns')
-            for obj_type, value in retrieved['objects'].items()
-        }
+        contents = f.read()
+    if not contents.strip():
+        return None, {}
+    retrieved = json.loads(contents)
+    print(f"Retrieving cached record of objects from {Style.BRIGHT + Fore.YELLOW} {retrieved['local_cached_time']} {Style.RESET_ALL} local_time")
+    return retrieved.get('cached_time_utc'), {
+        obj_type: pd.DataFrame(value).T.reset_index().rename({'index':'FULL_NAME'}, axis = 'columns')
+        for obj_type, value in retrieved['objects'].items()
+    }
     
 
-def get_plan_from_cache(account:str): 
-    return json.loads(open(os.path.join(CONFIG_DIR,f'config/{account}/.snowplan'),'r').read())
+def get_plan_from_cache(account:str) -> Snowplan: 
+    """
+        Lazy reader of the account's .snowplan (see snowplan.py)
+    """
+    return Snowplan(snowplan_path(account))
+
+def snowplan_path(account:str) -> str:
+    return os.path.join(CONFIG_DIR,f'config/{account}/.snowplan')
+
+def copy_previous_snowplan(account:str) -> Snowplan:
+    """
+        Copy of the account's current .snowplan (to .snowplan.prev) that survives the next plan overwriting it, None if there is none
+    """
+    path = snowplan_path(account)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+    shutil.copyfile(path, path + '.prev')
+    try:
+        return Snowplan(path + '.prev')
+    except (json.JSONDecodeError, KeyError):
+        return None
+
+def print_account_plan(state, recipients:list[str] = None) -> None:
+    """
+        Print the account's plan, or only the roles/users in {recipients}
+    """
+    plan = get_plan_from_cache(account = state.account)
+    role_plan = plan['ROLES'] if recipients is None else plan['ROLES'].only(recipients)
+    user_plan = plan['USERS'] if recipients is None else plan['USERS'].only(recipients)
+    state.print_formatted_plan(role_plan,grants_to = 'ROLE')
+    state.print_formatted_plan(user_plan,grants_to = 'USER')
+
+# Config files are read through config_cache.load_config: each one is parsed and run through its normalizer below
+# once, then read back from a snapshot for as long as the file is unchanged
+def mapping_of_mappings(contents, path:str) -> dict:
+    assert isinstance(contents, dict) and all(isinstance(value, dict) for value in contents.values()), \
+        f'{path} should map names to mappings'
+    return contents
+
+def role_configurations(contents, path:str) -> dict:
+    contents = mapping_of_mappings(contents or {}, path)
+    invalid = [role for role, config in contents.items() if not isinstance(config.get('profiles'), list)]
+    assert not invalid, f'{path}: roles without a list of profiles: {", ".join(map(str, invalid[:10]))}'
+    return contents
+
+def role_profile_configurations(contents, path:str) -> dict:
+    contents = mapping_of_mappings(contents or {}, path)
+    invalid = [profile for profile, config in contents.items() if not isinstance(config.get('privileges'), dict)]
+    assert not invalid, f'{path}: profiles without privileges: {", ".join(map(str, invalid[:10]))}'
+    return contents
+
+def user_role_sets(contents, path:str) -> dict[str,set]:
+    contents = contents or {}
+    invalid = [user for user, roles in contents.items() if not isinstance(roles, list)] if isinstance(contents, dict) else [path]
+    assert not invalid, f'{path} should map users to lists of roles: {", ".join(map(str, invalid[:10]))}'
+    return {user: set(roles) for user, roles in contents.items()}
+
+def unsupported_priv_pairs(contents, path:str) -> list[Tuple[str,str]]:
+    return [
+        (priv.upper(), target_type.upper())
+        for priv,target_type in contents.items()
+        for target_type in target_type
+    ]
+
+def full_name_patterns(contents, path:str) -> list[str]:
+    assert isinstance(contents, dict) and isinstance(contents.get('full_name_patterns'), list), f'{path} should have a list of full_name_patterns'
+    return [f"^{pattern.upper()}$" for pattern in contents['full_name_patterns']]
+
 
 def get_user_roles_from_config(account:str): 
-    return {
-        user: set(roles)
-        for user, roles in 
-        yaml.safe_load(open(os.path.join(CONFIG_DIR,f'config/{account}/user_profiles.yaml'),'r')).items()
-    }
+    return load_config(os.path.join(CONFIG_DIR,f'config/{account}/user_profiles.yaml'), user_role_sets)
 
 def load_role_configuarations(account_name:str, target_roles:list = None) -> Tuple[dict,dict]:
     """
         Retrieves account specific role configuration from config files. 
         Optional filter for the configs to only contain the roles in target_roles
     """
-    with open(os.path.join(CONFIG_DIR,f'config/{account_name}/roles.yaml'),'r') as f:
-        role_configs = yaml.safe_load(f)
-    with open(os.path.join(CONFIG_DIR,f'config/{account_name}/role_profiles.yaml'),'r') as f:
-        role_profiles = yaml.safe_load(f)
+    role_configs = load_config(os.path.join(CONFIG_DIR,f'config/{account_name}/roles.yaml'), role_configurations)
+    role_profiles = load_config(os.path.join(CONFIG_DIR,f'config/{account_name}/role_profiles.yaml'), role_profile_configurations)
     filtered_role_configs = {role:role_configs[role] for role in target_roles} if target_roles else role_configs
 
     return filtered_role_configs,role_profiles
 
 
 def write_out_snowplan(account:str, role_snowplan:dict, user_snowplan:dict = {}, plan_id:int = -1):
-    with open(os.path.join(CONFIG_DIR,f'config/{account}/.snowplan'),'w') as f:
-        f.write(
-            json.dumps(
-                {
-                    'plan_id':plan_id,
-                    'ROLES':{
-                        role:{
-                            delta_type: list(delta)
-                            for delta_type,delta in plan_for_role.items()
-                        }
-                        for role, plan_for_role in role_snowplan.items()
-                    },
-                    'USERS':{
-                        user:{
-                            delta_type:list(delta)
-                            for delta_type,delta in plan_for_user.items()
-                        }
-                        for user, plan_for_user in user_snowplan.items()
-                    }
-                }
-                ,indent = 2
-            )
-        )
+    with open_snowplan_writer(account, plan_id, role_snowplan, plan_users = bool(user_snowplan)) as writer:
+        writer.write('ROLES', role_snowplan)
+        writer.write('USERS', user_snowplan)
+
+def open_snowplan_writer(account:str, plan_id:int, roles:list, plan_users:bool, resume:bool = False) -> SnowplanWriter:
+    """
+        Writer streaming role/user plans into the account's .snowplan as they are planned (see snowplan.py)
+    """
+    return SnowplanWriter(snowplan_path(account), plan_id, roles, plan_users, resume = resume)
 
 def get_unsupported_privs():
-    with open(os.path.join(SCRIPT_DIR,'ignore','privs.yaml')) as f: 
-        unsupported_privs = [
-            (priv.upper(), target_type.upper())
-            for priv,target_type in yaml.safe_load(f).items()
-            for target_type in target_type
-        ]
-    return unsupported_privs
+    return load_config(os.path.join(SCRIPT_DIR,'ignore','privs.yaml'), unsupported_priv_pairs)
 
 def get_ignored_object_patterns(account:str):
-    with open(os.path.join(CONFIG_DIR,'config',account,'ignore','objects.yaml')) as f: 
-        PATTERNS = [f"^{pattern.upper()}$" for pattern in yaml.safe_load(f)['full_name_patterns']]
-    return PATTERNS
+    return load_config(os.path.join(CONFIG_DIR,'config',account,'ignore','objects.yaml'), full_name_patterns)
 
 
 def write_out_sql_snowplan(account:str, executables:list):
@@ -0,0 +1,174 @@
+import os
+import json
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from collections.abc import Mapping
+from time import localtime,gmtime,strftime
+import numpy as np
+from sf_object_structures import GET_FULL_NAME, TYPE_FLAG_COLUMNS, as_categoricals
+
+# Columnar registry of objects, written to config/{account}/.snowcache.d/ as:
+#
+#     manifest.json               cache times, the object types that were cached and the schemas
+#                                 objects were ignored in (see ObjectCache.ignored_containers)
+#     {object_type}.arrow         one Arrow IPC file per object type
+#
+# Only the columns that are read downstream are kept (the FULL_NAME, the columns it is built from
+# and the flags filter_objects splits types on). Object types are only decoded when first accessed,
+# so a plan that only touches tables and schemas never reads functions, stages, ...
+
+CACHE_DIR = '.snowcache.d'
+MANIFEST = 'manifest.json'
+# cached_time_utc, compared with created_on by the next incremental refresh (see incremental_object_scan)
+UTC_TIME_FORMAT = "%Y-%m-%d %H:%M:%S +0000"
+FLAG_COLUMNS = list(dict.fromkeys(column for flags in TYPE_FLAG_COLUMNS.values() for column in flags))
+CACHE_COLUMNS = ['FULL_NAME'] + sorted({column for key in GET_FULL_NAME.values() for column in key}) + FLAG_COLUMNS
+
+
+def object_cache_dir(account_dir:str) -> str:
+    return os.path.join(account_dir, CACHE_DIR)
+
+def type_file_name(object_type:str) -> str:
+    return object_type.replace(' ','_') + '.arrow'
+
+
+class ObjectCache(Mapping):
+    """
+        Read-only {object_type: DataFrame} mapping over a columnar cache directory.
+        Each object type is memory-mapped and decoded on first access, then kept for the lifetime of the cache
+    """
+    def __init__(self, directory:str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST),'r') as f:
+            self.manifest = json.load(f)
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    @property
+    def local_cached_time(self) -> str:
+        return self.manifest['local_cached_time']
+
+    @property
+    def cached_time_utc(self) -> str:
+        return self.manifest.get('cached_time_utc')
+
+    @property
+    def ignored_containers(self) -> dict[str,set]:
+        """
+            {scanned object type: schemas (DB.SCHEMA) with objects of the type the cache doesn't have, as they matched
+            the ignore patterns}. None for a cache written before these were recorded
+        """
+        ignored = self.manifest.get('ignored_containers')
+        return {object_type: set(containers) for object_type, containers in ignored.items()} if ignored is not None else None
+
+    @property
+    def version(self) -> tuple:
+        return (self.directory, self.manifest['local_cached_time'], self.manifest.get('cached_time_utc'))
+
+    def __getitem__(self, object_type:str) -> pd.DataFrame:
+        if object_type not in self.manifest['objects']:
+            raise KeyError(object_type)
+        with self._lock:
+            if object_type not in self._frames:
+                self._frames[object_type] = read_type_file(os.path.join(self.directory, type_file_name(object_type)))
+            return self._frames[object_type]
+
+    def __contains__(self, object_type) -> bool:
+        return object_type in self.manifest['objects']
+
+    def __iter__(self):
+        return iter(self.manifest['objects'])
+
+    def __len__(self) -> int:
+        return len(self.manifest['objects'])
+
+
+class ObjectRegistry(Mapping):
+    """
+        {object_type: DataFrame} over the frames of a scan, where the types filter_objects derives
+        (views and materialized views, internal and external stages, ...) are boolean masks over the frame they come from
+        instead of copies of its rows. A masked type is only materialized when it is read, and isn't kept
+    """
+    def __init__(self, frames:dict[str,pd.DataFrame]):
+        self.frames = dict(frames)
+        self.views = {object_type: (object_type, None) for object_type in self.frames}
+
+    def derive(self, object_type:str, base:str, mask:np.ndarray) -> None:
+        """
+            {object_type} is the rows of {base}'s frame selected by {mask} (and by any mask {base} already has)
+        """
+        base, base_mask = self.views[base]
+        self.views[object_type] = (base, mask if base_mask is None else base_mask & mask)
+
+    def restrict(self, object_type:str, keep:np.ndarray) -> None:
+        self.derive(object_type, object_type, keep)
+
+    def base_frame(self, object_type:str) -> pd.DataFrame:
+        """
+            The frame {object_type} is a view of (masks over it have its length)
+        """
+        return self.frames[self.views[object_type][0]]
+
+    def __getitem__(self, object_type:str) -> pd.DataFrame:
+        base, mask = self.views[object_type]
+        frame = self.frames[base]
+        return frame if mask is None or mask.all() else frame[mask]
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+
+def read_type_file(path:str) -> pd.DataFrame:
+    with pa.memory_map(path,'r') as source:
+        return as_categoricals(ipc.open_file(source).read_all().to_pandas())
+
+def write_type_file(path:str, df:pd.DataFrame) -> int:
+    if 'FULL_NAME' not in df.columns:
+        df = df.assign(FULL_NAME = pd.Series([], dtype = object))
+    columns = [column for column in CACHE_COLUMNS if column in df.columns]
+    # SHOW output is all text, but frames merged from older caches can carry mixed python objects
+    projected = df[columns].astype(object).where(df[columns].notna(), None)
+    table = pa.Table.from_pandas(projected, schema = pa.schema([(column, pa.string()) for column in columns]), preserve_index = False)
+    with pa.OSFile(path,'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return table.num_rows
+
+def utc_now() -> str:
+    return strftime(UTC_TIME_FORMAT,gmtime())
+
+def write_object_cache(account_dir:str, objects:dict[str,pd.DataFrame], ignored_containers:dict[str,set] = None, cached_time_utc:str = None) -> None:
+    """
+        Write out every object type to its own file, then the manifest.
+        Type files from a previous cache that are no longer present are removed.
+        {cached_time_utc} is when the objects were read (default: now)
+    """
+    directory = object_cache_dir(account_dir)
+    os.makedirs(directory, exist_ok = True)
+    counts = {}
+    for object_type, df in objects.items():
+        path = os.path.join(directory, type_file_name(object_type))
+        counts[object_type] = write_type_file(path + '.tmp', df)
+        os.replace(path + '.tmp', path)
+    manifest = {
+        'local_cached_time': strftime("%Y-%m-%d %H:%M:%S",localtime()),
+        # used as the cutoff for the next incremental refresh (see incremental_object_scan)
+        'cached_time_utc': cached_time_utc or utc_now(),
+        'objects': counts
+    } | ({'ignored_containers': {object_type: sorted(containers) for object_type, containers in ignored_containers.items()}} if ignored_containers is not None else {})
+    with open(os.path.join(directory, MANIFEST + '.tmp'),'w') as f:
+        f.write(json.dumps(manifest, indent = 4))
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    expected = {type_file_name(object_type) for object_type in objects} | {MANIFEST}
+    for file in os.listdir(directory):
+        if file not in expected:
+            os.remove(os.path.join(directory, file))
+
+def clear_object_cache(account_dir:str) -> None:
+    shutil.rmtree(object_cache_dir(account_dir), ignore_errors = True)
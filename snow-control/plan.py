@@ -1,30 +1,45 @@
 from load import (
     get_objects_from_cache,
     load_role_configuarations,
-    write_out_snowplan,
+    open_snowplan_writer,
     get_user_roles_from_config,
     get_plan_from_cache, 
     get_unsupported_privs,
+    print_account_plan,
+    copy_previous_snowplan,
     ATOMIC_GROUPS  
 )
 
 from sf_object_structures import (
-    DETAILED_OBJECT_TYPE_MAPPER,process_name,get_matching,get_futures, pluralize, object_matches_any
+    DETAILED_OBJECT_TYPE_MAPPER,process_name,get_matching,get_futures, pluralize, get_pattern_matcher
 )
 from get_objects import object_scan
-from queries import CURRENT_GRANTS_TO_ROLE, FUTURE_GRANTS_TO_ROLE,GRANTS_TO_USER_QUERY, RETRIEVE_GRANTS_TO_USER_QUERY
+from queries import GRANTS_TO_USER_QUERY, RETRIEVE_GRANTS_TO_USER_QUERY
 from styling import time_func
+from tracing import span, traced_execute
+from grant_store import GRANTS, union, sorted_venn, pairs_of, names_of, decode_grants
+import numpy as np
 from control_state import ControlState
+from grant_cache import GrantSnapshotCache
+from async_queries import run_pipeline, fetch_rows
+from show_results import user_role_rows
+from grant_sources import ShowGrantSource, get_grant_source, get_current_grants_to_role, get_future_grants_to_role
+import os
+import json
 import time
+import hashlib
+import threading
+import multiprocessing
 from itertools import repeat
-from functools import reduce
-from typing import Tuple
-ALL_OBJECT_TYPES = set(ATOMIC_GROUPS.keys()).union(set(DETAILED_OBJECT_TYPE_MAPPER.values()))
-UNSUPPORTED_PRIVS = get_unsupported_privs()
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from typing import Tuple, Iterable, Iterator
+UNSUPPORTED_PRIVS = frozenset(get_unsupported_privs())
+# Worker processes of plan(method = 'proc'), one per core by default
+PLAN_PROCESSES = int(os.environ.get('CONTROL_PLAN_PROCESSES', 0)) or os.cpu_count()
 
 
 @time_func
-def plan(state:ControlState, account, roles_to_plan, from_cache = True, method = 'conc', plan_users = False):
+def plan(state:ControlState, account, roles_to_plan, from_cache = True, method = 'conc', plan_users = False, from_grant_cache = False, grant_source = 'show', resume = False, incremental = False):
     """
         plan() is the central function that writes out to /{account}/.snowplan
         a detailed plan of how to transform the current access into the target access described in the config file. 
@@ -38,59 +53,113 @@ def plan(state:ControlState, account, roles_to_plan, from_cache = True, method =
                     ii. Use venn() to compare the current state with the target state and 
                         get a list of privileges to revoek, those that match up , and those to grant
                     iii. Store in a dictionary
-            4. Write out to .snowplan
+            4. Write out to .snowplan (each role as soon as it is planned, see snowplan.py)
             5. Close Connection
+
+        With {from_grant_cache}, current grants to each role are read from the grant snapshot cache (see grant_cache.py)
+        when the role has a snapshot younger than the TTL. Roles without one are fetched and added to the cache
+        {grant_source} picks the backend current grants are read from (see grant_sources.GRANT_SOURCES)
+        {method} proc plans roles on a pool of forked processes (see plan_roles_in_processes), users on threads after them
+        With {resume}, an unfinished .snowplan for the same roles is continued: roles and users already in it are skipped
+        With a grant cache, every role is written with its fingerprint (see role_fingerprint). {incremental} (which reads
+        grants from the cache) copies the deltas of roles whose fingerprint is the same as in the previous .snowplan
+        instead of planning them again
     """
+    from_grant_cache = from_grant_cache or incremental
     PLAN_ID = int(time.time())
     user_configs = get_user_roles_from_config(account=account)
     role_configs, role_profiles = load_role_configuarations(account,roles_to_plan)
+    compiled_profiles = {name: CompiledProfile(name, profile) for name, profile in role_profiles.items()}
+    clear_expanded_profiles()
     objects = get_objects_from_cache(account) if from_cache else object_scan(state, method)
+    grant_cache = GrantSnapshotCache(account, ttl = state.grant_cache_ttl) if from_grant_cache else None
+    previous = copy_previous_snowplan(account) if incremental else None
+    if method == 'proc' and 'fork' not in multiprocessing.get_all_start_methods():
+        state.print('Process planning needs fork(), which this platform does not have. Planning with threads instead')
+        method = 'conc'
+    # async: every SHOW GRANTS is submitted up front, the planning itself is CPU bound so it runs sequentially
+    source = get_grant_source(state, 'async' if method == 'async' and grant_source == 'show' else grant_source)
 
-    role_plan, user_plan = {},{}
+    with open_snowplan_writer(account, PLAN_ID, role_configs, plan_users, resume = resume) as writer:
+        if any(writer.done.values()):
+            state.print(f'Resuming plan {writer.plan_id}: {len(writer.done["ROLES"])} roles and {len(writer.done["USERS"])} users already planned')
+        role_configs = {role: config for role, config in role_configs.items() if role not in writer.done['ROLES']}
+        user_configs = {user: config for user, config in user_configs.items() if user not in writer.done['USERS']}
 
-    if method == 'seq':
-        for role, config in role_configs.items():
-            role_plan |= plan_single_role(state,objects,role_profiles,role,config)
-        if plan_users:
-            for user, config in user_configs.items():
-                user_plan |= plan_single_user(state,user,config)
-    else:
-        role_plans, user_plans = {},{}
-        role_plans = state.executor.map(
-            plan_single_role,
-            repeat(state),repeat(objects),repeat(role_profiles),*zip(*role_configs.items())
-        )
-        if plan_users:
-            user_plans = state.executor.map(
-                plan_single_user,
-                repeat(state),
-                *zip(*user_configs.items())
-            )
-        role_plan  = reduce(lambda x,y: x|y, role_plans)
-        user_plan = reduce(lambda x,y: x|y, user_plans, {})
-    write_out_snowplan(account,role_plan,user_plan,plan_id = PLAN_ID)
+        fingerprints = {
+            role: role_fingerprint(state,objects,compiled_profiles,role,config,grant_cache)
+            for role, config in role_configs.items()
+        } if grant_cache else {}
+        def write_roles(role_plans:dict) -> None:
+            # Roles without a snapshot before planning have one now (fetching their grants put it in the cache)
+            writer.write('ROLES', role_plans, {
+                role: fingerprints.get(role) or role_fingerprint(state,objects,compiled_profiles,role,role_configs[role],grant_cache)
+                for role in role_plans
+            } if grant_cache else None)
+
+        if previous:
+            role_configs = reuse_unchanged_roles(state, previous, writer, role_configs, fingerprints)
+        source.prefetch([role for role in role_configs if not (grant_cache and grant_cache.get(role))])
+        if method in ('seq','async'):
+            for role, config in role_configs.items():
+                write_roles(plan_single_role(state,objects,compiled_profiles,role,config,grant_cache,source))
+            if plan_users:
+                users_roles = get_users_roles_async(state, user_configs) if method == 'async' else {}
+                for user, config in user_configs.items():
+                    writer.write('USERS', plan_single_user(state,user,config,users_roles.get(user)))
+        elif method == 'proc':
+            for role_plan in plan_roles_in_processes(state,objects,compiled_profiles,role_configs,grant_cache,source):
+                write_roles(role_plan)
+            # Only submitted once the pool is done: a thread holding a lock while the workers fork would leave it held in them
+            user_futures = [
+                state.executor.submit(plan_single_user,state,user,config)
+                for user, config in user_configs.items()
+            ] if plan_users else []
+            for future in as_completed(user_futures):
+                writer.write('USERS', future.result())
+        else:
+            role_futures = [
+                state.executor.submit(plan_single_role,state,objects,compiled_profiles,role,config,grant_cache,source)
+                for role, config in role_configs.items()
+            ]
+            user_futures = [
+                state.executor.submit(plan_single_user,state,user,config)
+                for user, config in user_configs.items()
+            ] if plan_users else []
+            for future in as_completed(role_futures):
+                write_roles(future.result())
+            for future in as_completed(user_futures):
+                writer.write('USERS', future.result())
+    if grant_cache:
+        grant_cache.save()
+    if previous:
+        os.remove(previous.path)
     # log_snowplan(state,account)
 
-def plan_single_role(state:ControlState, objects,profiles,role,role_config):
-    target_state_grants = set()
+def plan_single_role(state:ControlState, objects,profiles,role,role_config, grant_cache:GrantSnapshotCache = None, grant_source:ShowGrantSource = None, current_state_grants:np.ndarray = None):
+    """
+        Grants are compared as sorted int64 key arrays (see grant_store.py), the plan holds keys until it is written out.
+        {current_state_grants} (keys) are the role's grants when they were already fetched, nothing is read from Snowflake then
+    """
+    target_state_grants = []
     shared_databases = set(objects['shared database']['name'])
     associated_profiles = role_config['profiles']
 
 
-    for assoc_prof in associated_profiles:
-        for profile_name, profile_parameters in assoc_prof.items():
-            profile_config = profiles[profile_name]
-            target_state_grants |= profile_to_grants(state,objects,profile_name,profile_config,**profile_parameters)
-    current_state_grants = get_current_grants_to_role(state,role) | get_future_grants_to_role(state,role)
-
-    filter = lambda db: db not in shared_databases
-    current_state_grants = {
-        (priv,typ,full_name)
-        for priv,typ,full_name in current_state_grants
-        if filter(full_name.split('.')[0])
-        and not object_matches_any(full_name,state.ignore_objects)
-        and (priv,typ) not in UNSUPPORTED_PRIVS
-    }
+    with span(f'plan {role}', cat = 'role') as role_span:
+        for assoc_prof in associated_profiles:
+            for profile_name, profile_parameters in assoc_prof.items():
+                with span(f'expand {profile_name}', cat = 'profile', role = role):
+                    target_state_grants.append(expand_profile(state,objects,profiles[profile_name],profile_parameters or {}))
+        target_state_grants = union(target_state_grants)
+        if current_state_grants is None:
+            with span(f'grants {role}', cat = 'role'):
+                current_state_grants = GRANTS.encode(get_grants_to_role(state,role,grant_cache,grant_source))
+        role_span.set(target = len(target_state_grants), current = len(current_state_grants))
+
+    current_state_grants = current_state_grants[
+        plannable_current_grants(state, current_state_grants, shared_databases)
+    ]
     revoke,ok,grant = venn(current_state_grants,target_state_grants)
     return {
         role: {
@@ -100,57 +169,235 @@ def plan_single_role(state:ControlState, objects,profiles,role,role_config):
         }
     }
 
-def plan_single_user(state:ControlState, user:str, target_state:set):
-    current_state = get_current_users_roles(state,user)
+# plan(method = 'proc'): (state, objects, profiles, role configs, current grant keys per role).
+# Set right before the pool forks, so every worker inherits it instead of unpickling the object registry per role
+_PROCESS_PLAN = None
+
+def plan_roles_in_processes(state:ControlState, objects, profiles, role_configs:dict, grant_cache:GrantSnapshotCache = None, grant_source:ShowGrantSource = None) -> Iterator[dict]:
+    """
+        plan_single_role for every role on a forked process pool, yielding role plans as they complete.
+        Current grants are fetched first on the thread executor (network bound), the expansion and comparison
+        (CPU bound) then run in the workers, which receive a role name and send back its grant keys.
+        Every name, privilege and object type a worker could produce is interned before the fork, so keys
+        mean the same thing in every process
+    """
+    global _PROCESS_PLAN
+    if not role_configs:
+        return
+    with span('grants', cat = 'role', roles = len(role_configs)):
+        current = dict(zip(role_configs, state.executor.map(
+            lambda role: GRANTS.encode(get_grants_to_role(state,role,grant_cache,grant_source)), role_configs
+        )))
+    intern_plannable_grants(objects, profiles)
+    _PROCESS_PLAN = (state, objects, profiles, role_configs, current)
+    try:
+        with ProcessPoolExecutor(max_workers = min(PLAN_PROCESSES, len(role_configs)), mp_context = multiprocessing.get_context('fork')) as pool:
+            for future in as_completed([pool.submit(plan_role_in_process, role) for role in role_configs]):
+                yield future.result()
+    finally:
+        _PROCESS_PLAN = None
+
+def plan_role_in_process(role:str) -> dict:
+    state, objects, profiles, role_configs, current = _PROCESS_PLAN
+    interned = GRANTS.size()
+    role_plan = plan_single_role(state, objects, profiles, role, role_configs[role], current_state_grants = current[role])
+    if GRANTS.size() != interned:
+        # Something the parent never interned: the worker's new ids mean nothing to the parent, send strings
+        return {role: {delta_type: decode_grants(delta) for delta_type, delta in role_plan[role].items()}}
+    return role_plan
+
+def intern_plannable_grants(objects, profiles:dict) -> None:
+    """
+        Intern everything expand_profile and plannable_current_grants can produce for {profiles}:
+        their privileges and object types, and the names of every object of a type they reference
+    """
+    object_types = {'schema','database'}
+    GRANTS.pair_codes(UNSUPPORTED_PRIVS)
+    for profile in profiles.values():
+        GRANTS.encode(profile.account_grants)
+        for object_type, generic_object_type, _, _, atomic_privs, target_future, future_privs in profile.entries:
+            object_types.add(object_type)
+            GRANTS.priv_ids(atomic_privs + future_privs)
+            GRANTS.type_ids([generic_object_type, target_future])
+    for object_type in object_types:
+        if object_type in objects:
+            GRANTS.name_ids(objects[object_type]['FULL_NAME'].dropna().str.upper())
+
+def plannable_current_grants(state:ControlState, keys:np.ndarray, shared_databases:set) -> np.ndarray:
+    """
+        Mask of the current grants plan manages: not on a shared database, not on an ignored object and not an unsupported privilege.
+        Names are only checked once each, however many privileges are granted on them
+    """
+    name_ids, inverse = np.unique(names_of(keys), return_inverse = True)
+    ignored = get_pattern_matcher(state.ignore_objects, ignore_case = True)
+    plannable_names = np.fromiter(
+        (
+            full_name.split('.')[0] not in shared_databases and not ignored.match(full_name)
+            for full_name in GRANTS.name_strings(name_ids)
+        ),
+        dtype = bool, count = len(name_ids)
+    )
+    return plannable_names[inverse] & ~np.isin(pairs_of(keys), GRANTS.pair_codes(UNSUPPORTED_PRIVS))
+
+def plan_single_user(state:ControlState, user:str, target_state:set, current_state:set = None):
+    current_state = get_current_users_roles(state,user) if current_state is None else current_state
     to_revoke, ok, to_grant = venn(current_state,target_state)
     return {
         user:{
-            'to_revoke': [ ['USAGE ','ROLE', role] for role in to_revoke],
+            'to_revoke': [ ['USAGE','ROLE', role] for role in to_revoke],
             'ok': [ ['USAGE','ROLE',role] for role in ok ],
             'to_grant':[ ['USAGE','ROLE',role] for role in to_grant]
         }
     }
+class CompiledProfile:
+    """
+        A role profile with everything that doesn't depend on the role's parameters worked out up front: 
+        atomic groups resolved into atomic privileges, unsupported (privilege, type) pairs dropped
+        and account level grants generated. Only the object patterns are left to format per role
+    """
+    __slots__ = 'name','account_grants','entries'
+
+    def __init__(self, profile_name:str, profile:dict):
+        self.name = profile_name
+        self.account_grants = frozenset()
+        self.entries = []
+        for object_type, object_privs in profile['privileges'].items():
+            generic_object_type = DETAILED_OBJECT_TYPE_MAPPER.get(object_type,object_type).upper()
+            if object_type == 'role':
+                continue
+            elif object_type == 'account':
+                self.account_grants = frozenset(
+                    grant for grant in gen_acct_level_grants(object_privs) if (grant[0],grant[1]) not in UNSUPPORTED_PRIVS
+                )
+                continue
+            target_future = f"FUTURE {pluralize(DETAILED_OBJECT_TYPE_MAPPER.get(object_type,object_type)).upper()} IN {'DATABASE' if object_type.lower() == 'schema' else 'SCHEMA'}"
+            for priv,objects in object_privs.items():
+                atomic_privs = [atomic_priv.upper() for atomic_priv in ATOMIC_GROUPS[object_type][priv]]
+                self.entries.append((
+                    object_type,
+                    generic_object_type,
+                    tuple(obj + '$' for obj in objects),
+                    tuple(obj[:-2].rstrip('[.]') + '$' for obj in objects if obj.endswith('.*')), # don't use strip() bc multiple
+                    tuple(p for p in atomic_privs if (p,generic_object_type) not in UNSUPPORTED_PRIVS),
+                    target_future,
+                    tuple(p for p in atomic_privs if (p,target_future) not in UNSUPPORTED_PRIVS)
+                ))
+
+# (profile name, frozen parameters, object cache version) -> expanded grants / profile_digest, reset by every plan()
+_EXPANDED_PROFILES = {}
+_PROFILE_DIGESTS = {}
+_EXPANDED_PROFILES_LOCK = threading.Lock()
+
+def freeze(value):
+    """
+        Hashable version of profile parameters (nested dicts/lists from YAML)
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k,v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def objects_version(objects) -> object:
+    return getattr(objects, 'version', id(objects))
+
+def clear_expanded_profiles() -> None:
+    with _EXPANDED_PROFILES_LOCK:
+        _EXPANDED_PROFILES.clear()
+        _PROFILE_DIGESTS.clear()
+
+def expand_profile(state:ControlState, all_objects:dict, profile:CompiledProfile, requires:dict) -> np.ndarray:
+    """
+        Memoized profile_to_grants for a compiled profile: roles sharing a profile with identical 
+        parameters only expand it once per object cache. 
+        Returns the grants as a sorted array of keys (see grant_store.py), shared read-only between roles
+    """
+    key = (profile.name, freeze(requires), objects_version(all_objects))
+    with _EXPANDED_PROFILES_LOCK:
+        if key in _EXPANDED_PROFILES:
+            return _EXPANDED_PROFILES[key]
+    param_string = [f'{k}={repr(v)}' for k,v in requires.items()]
+    state.print(f"Beginning conversion of profile {profile.name}({','.join(param_string)})", verbosity_level=5)
+    grants = [GRANTS.encode(profile.account_grants)]
+    for object_type, generic_object_type, patterns, future_patterns, atomic_privs, target_future, future_privs in profile.entries:
+        if atomic_privs:
+            matched_objects = get_matching(all_objects,object_type,[p.format(**requires).upper() for p in patterns])
+            grants.append(GRANTS.product(atomic_privs, generic_object_type, [matched_object.upper() for matched_object in matched_objects]))
+        if future_privs and future_patterns:
+            futures = get_futures(all_objects,object_type,[p.format(**requires).upper() for p in future_patterns])
+            grants.append(GRANTS.product(future_privs, target_future, [f.upper() for f in futures]))
+    grants = union(grants)
+    grants.flags.writeable = False
+    with _EXPANDED_PROFILES_LOCK:
+        return _EXPANDED_PROFILES.setdefault(key, grants)
+
+# Part of every fingerprint: bump it when planning changes how deltas are computed from the same inputs
+FINGERPRINT_VERSION = 2
+
+def role_fingerprint(state:ControlState, objects, profiles:dict, role:str, role_config:dict, grant_cache:GrantSnapshotCache) -> str:
+    """
+        Hash of everything {role}'s deltas are computed from: its config, its profiles' definitions and the objects they match,
+        what plan ignores (ignored objects, shared databases, unsupported privileges) and the grants in the role's snapshot
+        (not when it was taken: a role re-fetched after apply changed its grants gets a new fingerprint, an unchanged one doesn't).
+        None when the role has no fresh snapshot, its current grants can't be known without fetching them
+    """
+    grants_digest = grant_cache.digest(role) if grant_cache else None
+    if grants_digest is None:
+        return None
+    digest = hashlib.sha256(repr((
+        FINGERPRINT_VERSION,
+        json.dumps(role_config, sort_keys = True, default = str),
+        grants_digest,
+        sorted(state.ignore_objects or []),
+        sorted(objects['shared database']['name']),
+        sorted(UNSUPPORTED_PRIVS),
+    )).encode())
+    for assoc_prof in role_config['profiles']:
+        for profile_name, profile_parameters in assoc_prof.items():
+            digest.update(profile_digest(objects, profiles[profile_name], profile_parameters or {}).encode())
+    return digest.hexdigest()
+
+def profile_digest(all_objects, profile:CompiledProfile, requires:dict) -> str:
+    """
+        Hash of a compiled profile and the objects (and future containers) its patterns match with {requires}.
+        Memoized like expand_profile
+    """
+    key = (profile.name, freeze(requires), objects_version(all_objects))
+    with _EXPANDED_PROFILES_LOCK:
+        if key in _PROFILE_DIGESTS:
+            return _PROFILE_DIGESTS[key]
+    digest = hashlib.sha256(repr((profile.name, sorted(profile.account_grants), profile.entries, key[1])).encode())
+    for object_type, _, patterns, future_patterns, atomic_privs, _, future_privs in profile.entries:
+        if atomic_privs:
+            matched_objects = get_matching(all_objects,object_type,[p.format(**requires).upper() for p in patterns])
+            digest.update(('\n'.join(sorted(matched_objects)) + '\0').encode())
+        if future_privs and future_patterns:
+            futures = get_futures(all_objects,object_type,[p.format(**requires).upper() for p in future_patterns])
+            digest.update(('\n'.join(sorted(futures)) + '\0').encode())
+    with _EXPANDED_PROFILES_LOCK:
+        return _PROFILE_DIGESTS.setdefault(key, digest.hexdigest())
+
+def reuse_unchanged_roles(state:ControlState, previous, writer, role_configs:dict, fingerprints:dict) -> dict:
+    """
+        Write the {previous} deltas of every role whose fingerprint is unchanged, returns the role configs left to plan
+    """
+    stored = previous.fingerprints()
+    unchanged = {
+        role for role in role_configs
+        if fingerprints.get(role) and role in stored and stored[role][0] == fingerprints[role]
+    }
+    for role in unchanged:
+        writer.write('ROLES', {role: previous.plan_at(stored[role][1])}, fingerprints)
+    state.print(f'{len(unchanged)} of {len(role_configs)} roles unchanged since the last plan, reusing their deltas')
+    return {role: config for role, config in role_configs.items() if role not in unchanged}
+
 def profile_to_grants(state:ControlState,all_objects:dict,profile_name:str, profile:dict, **requires) -> set: 
     """
         This function converts a role profile (
             a collection of atomic groups on objects matching regex patterns
         ) to a list of atomic privileges
     """
-    param_string = [f'{k}={repr(v)}' for k,v in requires.items()]
-    state.print(f"Beginning conversion of profile {profile_name}({','.join(param_string)})", verbosity_level=5)
-    grants = []
-    future_grants = []
-    for object_type, object_privs in profile['privileges'].items():
-        generic_object_type = DETAILED_OBJECT_TYPE_MAPPER.get(object_type,object_type)
-        if object_type == 'role':
-            continue
-        elif object_type == 'account':
-            grants += gen_acct_level_grants(object_privs)
-            continue
-        for priv,objects in object_privs.items():
-            formatted = [obj.format(**requires).upper() + '$' for obj in objects]
-            matched_objects = get_matching(all_objects,object_type,formatted)
-            futures = get_futures(
-                all_objects,
-                object_type,
-                [
-                    obj[:-2].rstrip('[.]').format(**requires).upper() + '$' # don't use strip() bc multiple
-                    for obj in objects if obj.endswith('.*')
-                ]
-            )
-
-            grants += [
-                (atomic_priv.upper(),generic_object_type.upper(),matched_object.upper())
-                for atomic_priv in ATOMIC_GROUPS[object_type][priv]
-                for matched_object in matched_objects
-            ]
-            target_future = f"FUTURE {pluralize(generic_object_type).upper()} IN {'DATABASE' if object_type.lower() == 'schema' else 'SCHEMA'}"
-            future_grants += [
-                (atomic_priv.upper(),target_future,f.upper())
-                for atomic_priv in ATOMIC_GROUPS[object_type][priv]
-                for f in futures
-            ]
-    return {grant for grant in set(grants) | set(future_grants) if (grant[0],grant[1]) not in UNSUPPORTED_PRIVS}
+    return set(decode_grants(expand_profile(state, all_objects, CompiledProfile(profile_name, profile), requires)))
 
 def gen_acct_level_grants(account_privilege_profile:dict) -> str: 
     '''
@@ -164,74 +411,80 @@ def gen_acct_level_grants(account_privilege_profile:dict) -> str:
         for atomic_priv in ATOMIC_GROUPS['account'][atomic_group]
     ]
 
-def get_current_grants_to_role(state,role):
-    cur = state.connection.cursor()
-    state.print(f'Executing show query on role {role}', verbosity_level = 4)
-    cur.execute(f'show grants to role {role}')
-    qid = cur.sfqid
-    
-    state.print(f'Retrieving current grants to role {role}', verbosity_level = 3)
-    results = set(list(cur.execute(
-        CURRENT_GRANTS_TO_ROLE.format(qid = qid)
-    )))
-    return {
-        (
-            priv,
-            DETAILED_OBJECT_TYPE_MAPPER.get(typ.lower(),typ).upper(),
-            process_name(name,typ.upper())
-        )
-        for priv,typ,name in results
-        # Necessary to avoid running into errors with new SF preview objects
-        if typ.lower() in ALL_OBJECT_TYPES
-    }
-
-def get_future_grants_to_role(state,role):
-    cur = state.connection.cursor()
-    state.print(f'Executing show future query on role {role}', verbosity_level = 4)
-    cur.execute(f'show future grants to role {role}')
-    qid = cur.sfqid
+def get_grants_to_role(state:ControlState, role:str, grant_cache:GrantSnapshotCache = None, grant_source:ShowGrantSource = None) -> set:
+    """
+        Current + future grants to {role}, served from {grant_cache} when it holds a fresh snapshot of the role
+        and read through {grant_source} (default SHOW GRANTS) otherwise
+    """
+    snapshot = grant_cache.get(role) if grant_cache else None
+    if snapshot:
+        state.print(f'Using cached grant snapshot for role {role}', verbosity_level = 4)
+        current, future = snapshot
+    else:
+        current, future = (grant_source or ShowGrantSource(state)).grants_to_role(role)
+        if grant_cache:
+            grant_cache.put(role,current,future)
+    return current | future
 
-    state.print(f'Retrieving future grants to role {role}', verbosity_level = 3)
-    results = set(list(cur.execute(
-        FUTURE_GRANTS_TO_ROLE.format(qid = qid)
-    )))
-    return {
-        (
-            priv,
-            f"FUTURE {pluralize(DETAILED_OBJECT_TYPE_MAPPER.get(typ.lower(),typ).upper())} IN {'DATABASE' if typ.lower() == 'schema' else 'SCHEMA'}",
-            process_name(name,'schema')
-        )
-        for priv,typ,name in results
-        # Necessary to avoid running into errors with new SF preview objects
-        if typ.lower() in ALL_OBJECT_TYPES
-    }
+@time_func
+def refresh_grant_cache(state:ControlState, account:str, method = 'conc', grant_source = 'show') -> None:
+    """
+        Re-capture the current and future grants of every role in the account's roles.yaml into the grant snapshot cache
+    """
+    role_configs, _ = load_role_configuarations(account)
+    grant_cache = GrantSnapshotCache(account, ttl = state.grant_cache_ttl)
+    source = get_grant_source(state, grant_source)
+    source.prefetch(role_configs)
+    capture = lambda role: grant_cache.put(role, *source.grants_to_role(role))
+    if method == 'seq':
+        for role in role_configs:
+            capture(role)
+    else:
+        list(state.executor.map(capture, role_configs))
+    grant_cache.save()
+    state.print(f'Captured grants for {len(role_configs)} roles')
 
 def venn(set1:set, set2:set) -> Tuple[set,set,set]:
     """
         Creates a venn diagram between two sets: 
         (   Set 1     (  I  )    Set 2   )
+        Sorted grant key arrays (see grant_store.py) are compared with binary searches instead
     """
+    if isinstance(set1, np.ndarray):
+        return sorted_venn(set1, set2)
     return set1-set2, set1.intersection(set2), set2-set1
 
 
 
 def get_current_users_roles(state:ControlState,user:str)-> set:
-    cur = state.connection.cursor()
-    state.print(f'Executing show query on user {user}', verbosity_level = 4)
-    query = GRANTS_TO_USER_QUERY.format(user=user)
-    cur.execute(query)
-    qid = cur.sfqid
-    state.print(f'Retrieving current grants to user {user}', verbosity_level = 3)
-    roles_granted = set(x for x, in cur.execute(RETRIEVE_GRANTS_TO_USER_QUERY.format(qid =qid)).fetchall())
+    with state.checkout() as conn:
+        cur = conn.cursor()
+        state.print(f'Executing show query on user {user}', verbosity_level = 4)
+        query = GRANTS_TO_USER_QUERY.format(user=user)
+        traced_execute(cur, query, f'show grants {user}', cat = 'user')
+        qid = cur.sfqid
+        state.print(f'Retrieving current grants to user {user}', verbosity_level = 3)
+        if state.fetch_mode == 'local':
+            return set(x for x, in user_role_rows(cur))
+        roles_granted = set(x for x, in traced_execute(cur, RETRIEVE_GRANTS_TO_USER_QUERY.format(qid =qid), f'result_scan grants {user}', cat = 'user').fetchall())
     return roles_granted
 
     
+def get_users_roles_async(state:ControlState, users:Iterable[str]) -> dict[str,set]:
+    """
+        get_current_users_roles for every user at once, through the async query pipeline
+    """
+    local = state.fetch_mode == 'local'
+    with state.checkout() as conn:
+        results = run_pipeline(conn, {
+            user: (
+                GRANTS_TO_USER_QUERY.format(user=user),
+                None if local else lambda qid: RETRIEVE_GRANTS_TO_USER_QUERY.format(qid = qid),
+                user_role_rows if local else fetch_rows
+            )
+            for user in users
+        })
+    return {user: set(x for x, in rows) for user, rows in results.items()}
+
 def log_snowplan(state,account):
     pass
-
-def print_account_plan(state:ControlState) -> None:
-    plan = get_plan_from_cache(account = state.account)
-    role_plan = plan['ROLES']
-    user_plan = plan['USERS']
-    state.print_formatted_plan(role_plan,grants_to = 'ROLE')
-    state.print_formatted_plan(user_plan,grants_to = 'USER')
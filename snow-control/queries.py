@@ -3,11 +3,20 @@ SHOW_QUERY = "show {}s in account"
 
 INTEGRATION_SHOW_QUERY = "show {}s"
 
-NAME_QUERY = """select *, concat_ws('.',{key}) as full_name
+NAME_QUERY = """select {columns}, concat_ws('.',{key}) as full_name
 from table(result_scan('{qid}'))
 where "name" not like '%SNOWFLAKE_KAFKA_CONNECTOR%'
 and "name" != 'INFORMATION_SCHEMA' """
 
+KEY_QUERY = """select {columns}, concat_ws('.',{key}) as full_name,
+"created_on" >= '{since}'::timestamp_tz as is_changed
+from table(result_scan('{qid}'))
+where "name" not like '%SNOWFLAKE_KAFKA_CONNECTOR%'
+and "name" != 'INFORMATION_SCHEMA' """
+
+DELTA_NAME_QUERY = NAME_QUERY + """
+and concat_ws('.',{key}) in ({names}) """
+
 
 GRANTS_TO_USER_QUERY = """
     show grants to user "{user}"
@@ -40,4 +49,24 @@ FUTURE_GRANTS_TO_ROLE = """
     and "privilege" not in ('OWNERSHIP')
     and "grant_on" != 'ROLE'
     and "name" not like 'SNOWFLAKE%'
-"""
\ No newline at end of file
+"""
+
+ACCOUNT_GRANTS_TO_ROLES_QUERY = """
+    select grantee_name, privilege, replace(granted_on,'_',' '), table_catalog, table_schema, name
+    from (
+        select *,
+        case
+            when granted_on = 'SCHEMA' then concat_ws('.', table_catalog, name)
+            when table_schema is not null then concat_ws('.', table_catalog, table_schema, name)
+            else name
+        end as full_name
+        from snowflake.account_usage.grants_to_roles
+        where deleted_on is null
+        and granted_to = 'ROLE'
+    )
+    where full_name not like '%SNOWFLAKE_KAFKA_CONNECTOR%'
+    and name != 'INFORMATION_SCHEMA'
+    and privilege not in ('OWNERSHIP')
+    and granted_on != 'ROLE'
+    and full_name not like 'SNOWFLAKE%'
+"""
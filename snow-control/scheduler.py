@@ -0,0 +1,128 @@
+from control_state import ControlState
+from styling import print_execution
+from tracing import traced_execute
+from collections import defaultdict
+from concurrent.futures import as_completed, wait
+from typing import Tuple
+import snowflake.connector.errors as snow_errors
+import random
+import time
+import threading
+
+# Errors worth another attempt: the statement itself was fine, Snowflake (or the network) wasn't
+RETRYABLE_ERRORS = (
+    snow_errors.OperationalError,
+    snow_errors.ServiceUnavailableError,
+    snow_errors.GatewayTimeoutError,
+    snow_errors.BadGatewayError,
+    snow_errors.InternalServerError,
+    snow_errors.RequestTimeoutError,
+    snow_errors.OtherHTTPRetryableError,
+)
+# ProgrammingError errnos that are transient: 604 SQL execution canceled, 630 statement timeout
+RETRYABLE_ERRNOS = {604, 630}
+MAX_RETRIES = 5
+BASE_BACKOFF = 0.5  # seconds
+MAX_BACKOFF = 30    # seconds
+
+
+def backoff(attempt:int) -> float:
+    """
+        Full jitter exponential backoff: uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2^attempt))
+    """
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+def execute_with_retry(state:ControlState, executable_query:str, max_retries:int = MAX_RETRIES) -> Tuple[str,int]:
+    """
+        Execute a single statement, retrying transient failures with jittered exponential backoff.
+        Returns (qid, errno) of the last attempt, errno is 0 on success
+    """
+    for attempt in range(max_retries + 1):
+        with state.checkout() as conn:
+            cursor = conn.cursor()
+            try:
+                traced_execute(cursor, executable_query, 'apply', cat = 'statement', statement = executable_query, attempt = attempt)
+                return cursor.sfqid, 0
+            except snow_errors.ProgrammingError as pe:
+                if pe.errno not in RETRYABLE_ERRNOS or attempt == max_retries:
+                    return cursor.sfqid, pe.errno
+                error = pe
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    return cursor.sfqid, e.errno or -1
+                error = e
+        delay = backoff(attempt)
+        state.print(f'Retrying ({attempt + 1}/{max_retries}) in {delay:.1f}s after {type(error).__name__} {error.errno}: {executable_query}', verbosity_level = 3)
+        time.sleep(delay)
+
+def is_user_grant(query:tuple) -> bool:
+    return query[-2] in ('TO USER','FROM USER')
+
+def build_apply_dag(queries:list[tuple]) -> Tuple[dict,dict]:
+    """
+        Split the output of gen_queries into chains of (position in {queries}, statement) that are safe to run concurrently:
+
+        role chains:    {(ROLE, object type, object name): [statements]}
+                        every privilege statement on the same object for the same role, revokes first,
+                        so a revoke never races a grant on the same object
+        user chains:    {ROLE: [statements]}
+                        granting/revoking a role to/from users, which only runs once every role chain
+                        of that role has finished (the role is fully set up before anyone gets it)
+    """
+    role_chains, user_chains = defaultdict(list), defaultdict(list)
+    for position, query in enumerate(queries):
+        if is_user_grant(query):
+            user_chains[query[2].upper()].append((position, query))
+        else:
+            role_chains[(query[-1].upper(), query[3], query[4])].append((position, query))
+    for chain in role_chains.values():
+        chain.sort(key = lambda statement: statement[1][0] != 'REVOKE')
+    return role_chains, user_chains
+
+def run_apply_schedule(state:ControlState, queries:list[tuple]) -> dict:
+    """
+        Run the statements of a plan concurrently on the executor, following build_apply_dag():
+        statements within a chain run in order, independent chains run in parallel and user chains
+        are only submitted once the role they grant has no role chains left.
+        Returns {position in queries: {qid, text, result}} like apply(method='seq'). A statement that failed with an
+        error execute_with_retry doesn't expect (a connection that can't be opened, ...) is recorded with its errno, -1 without one
+    """
+    role_chains, user_chains = build_apply_dag(queries)
+    grant_results = {}
+    results_lock = threading.Lock()
+
+    def run_chain(chain:list[tuple]) -> None:
+        for position, query in chain:
+            executable = ' '.join(query)
+            try:
+                qid, errno = execute_with_retry(state, executable)
+            except Exception as e:
+                state.print(f'{type(e).__name__} {e}: {executable}', verbosity_level = 1)
+                qid, errno = None, getattr(e, 'errno', None) or -1
+            print_execution(executable, success = '-' if errno else '+')
+            with results_lock:
+                grant_results[position] = {
+                    'qid':qid,
+                    'text':executable,
+                    'result':errno
+                }
+
+    remaining = defaultdict(int)
+    chain_futures = {}
+    for (role, _, _), chain in role_chains.items():
+        remaining[role] += 1
+        chain_futures[state.executor.submit(run_chain, chain)] = role
+
+    user_futures = [
+        state.executor.submit(run_chain, chain)
+        for role, chain in user_chains.items() if not remaining[role]
+    ]
+    for future in as_completed(chain_futures):
+        future.result()
+        role = chain_futures[future]
+        remaining[role] -= 1
+        if not remaining[role] and role in user_chains:
+            user_futures.append(state.executor.submit(run_chain, user_chains[role]))
+    for future in wait(user_futures).done:
+        future.result()
+    return grant_results
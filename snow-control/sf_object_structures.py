@@ -1,6 +1,9 @@
 import re 
+import numpy as np
 import pandas as pd 
+from functools import lru_cache
 from typing import Iterable
+from catalog_index import catalog_index
 
 
 
@@ -26,8 +29,35 @@ FNC_FULL_NAME = ['catalog_name','schema_name','arguments']
 
 GET_FULL_NAME = {alo:ALO_FULL_NAME for alo in ALOs} | {'schema':['database_name','name']} | {nlo:NLO_FULL_NAME for nlo in NLOs} | {fnc:FNC_FULL_NAME for fnc in FNCs}
 
+# Besides the FULL_NAME key, the only SHOW columns read after a scan are the flags filter_objects splits types on
+# (and is_builtin, to drop builtin routines). Nothing else is fetched or kept in memory.
+# Container names and flags repeat across thousands of rows, so they are held as categoricals
+TYPE_FLAG_COLUMNS = {'database':['kind'], 'stage':['type'], 'view':['is_materialized'], 'table':['is_external']} | {fnc:['is_builtin'] for fnc in FNCs}
+CATEGORICAL_COLUMNS = ['database_name','catalog_name','schema_name','kind','type','is_materialized','is_external','is_builtin']
+
+def projected_columns(obj_type:str) -> list[str]:
+    """
+        The SHOW columns of {obj_type} kept in the registry of objects
+    """
+    return list(dict.fromkeys(['name'] + GET_FULL_NAME.get(obj_type, ALO_FULL_NAME) + TYPE_FLAG_COLUMNS.get(obj_type, [])))
+
+def as_categoricals(dataframe:pd.DataFrame) -> pd.DataFrame:
+    """
+        {dataframe} with its CATEGORICAL_COLUMNS as category dtypes (other columns are shared, not copied)
+    """
+    columns = [column for column in CATEGORICAL_COLUMNS if column in dataframe.columns and not isinstance(dataframe[column].dtype, pd.CategoricalDtype)]
+    return dataframe.astype({column: 'category' for column in columns}) if columns else dataframe
+
 
 
+# Routine names are normalized for every SHOW FUNCTIONS/PROCEDURES row and again for every grant on a routine,
+# of every role. The same few thousand signatures come back over and over, so normalized names are kept in a
+# bounded LRU shared by the scan (process_names) and the grant fetch (process_name)
+ROUTINE_NAME_CACHE_SIZE = 1 << 16
+ROUTINE_TYPES = ('FUNCTION','PROCEDURE')
+LOCAL_NAME_PATTERN = re.compile(r'.*[.].*[.](.*[(].*[)][:].*)')
+ARG_PATTERN = re.compile(r'.*[(](.*)[)]')
+
 def process_name(name:str, obj_type:str) -> str:
     """
         Snowflake has an extremely irregular way of standardizing the fully qualified name for functions (esp external functions)
@@ -42,15 +72,17 @@ def process_name(name:str, obj_type:str) -> str:
         db_name.schema."function_name(arg_name arg_type, ...)"
         db_name.schema."function_name(arg_name arg_type, ...):return_type"
     """
-    if obj_type not in ('FUNCTION','PROCEDURE'):
+    if obj_type not in ROUTINE_TYPES:
         return name
-    local_name_pattern = r'.*[.].*[.](.*[(].*[)][:].*)'
-    reg_match = re.match(local_name_pattern,name)
+    return normalize_routine_name(name)
+
+@lru_cache(maxsize = ROUTINE_NAME_CACHE_SIZE)
+def normalize_routine_name(name:str) -> str:
+    reg_match = LOCAL_NAME_PATTERN.match(name)
 
     assert reg_match
     main_name = reg_match.groups(1)[0].split(':')[0].replace('"','')
-    arg_pattern = r'.*[(](.*)[)]'
-    arg_match = re.match(arg_pattern, main_name)
+    arg_match = ARG_PATTERN.match(main_name)
     assert arg_match
     signature = arg_match.groups(1)[0]
     if signature: 
@@ -58,6 +90,84 @@ def process_name(name:str, obj_type:str) -> str:
         main_name = main_name.replace(signature, f"{','.join(args)}")
     return name.replace(reg_match.groups(1)[0],main_name)
 
+def process_names(names:pd.Series, obj_type:str) -> pd.Series:
+    """
+        process_name over a whole column: each distinct name is normalized once (through the shared cache)
+        and mapped back onto the column
+    """
+    if obj_type not in ROUTINE_TYPES or names.empty:
+        return names
+    codes, uniques = pd.factorize(names, use_na_sentinel = False)
+    normalized = np.array([normalize_routine_name(name) for name in uniques], dtype = object)
+    return pd.Series(normalized[codes], index = names.index, name = names.name)
+
+class PatternMatcher:
+    """
+        A set of regex patterns compiled once into a single alternation:
+
+        (?:{pattern_1})|(?:{pattern_2})|...|(?:{pattern_n})
+
+        Matching semantics are the same as calling re.match for every pattern and taking any(), 
+        but every name is only scanned by a single compiled regex. Patterns that can't be safely
+        joined (backreferences, inline global flags, group names used by more than one pattern) fall back
+        to a list of individually compiled patterns.
+        Use get_pattern_matcher() to build one, so that identical pattern sets share a compiled matcher
+    """
+    __slots__ = 'patterns','flags','regexes'
+    UNJOINABLE = re.compile(r'[\\][1-9]|[(][?]P=|[(][?][aiLmsux]+[)]')
+
+    def __init__(self, patterns:tuple, flags:int = 0):
+        self.patterns = patterns
+        self.flags = flags
+        if not patterns:
+            self.regexes = []
+        elif any(self.UNJOINABLE.search(pattern) for pattern in patterns):
+            self.regexes = [re.compile(pattern, flags) for pattern in patterns]
+        else:
+            try:
+                self.regexes = [re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)]
+            except re.error:
+                # e.g. (?P<db>A).* and (?P<db>B).*: fine one at a time, a redefined group name joined
+                self.regexes = [re.compile(pattern, flags) for pattern in patterns]
+
+    def match(self, name:str) -> bool:
+        return any(regex.match(name) for regex in self.regexes)
+
+    def mask(self, names:pd.Series) -> pd.Series:
+        """
+            Boolean mask over a whole column of names (True where any pattern matches, False for nulls)
+        """
+        return match_column(names, self.regexes)
+
+INLINE_FLAGS = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's', re.VERBOSE: 'x'}
+
+def inline_flags(regex:re.Pattern) -> str:
+    # Series.str.match rejects compiled patterns with flags other than IGNORECASE on pandas 3, so their flags are
+    # scoped into the pattern itself (which arrow backed strings can still match without a per-row loop)
+    letters = ''.join(letter for flag, letter in INLINE_FLAGS.items() if regex.flags & flag)
+    return f'(?{letters}:{regex.pattern})' if letters else regex.pattern
+
+def match_column(names:pd.Series, regexes:list) -> pd.Series:
+    """
+        True where any of {regexes} matches the start of the name, False for nulls
+    """
+    mask = pd.Series(False, index = names.index)
+    if names.empty or names.isna().all():
+        return mask
+    for regex in regexes:
+        mask |= names.str.match(inline_flags(regex), na = False)
+    return mask.astype(bool)
+
+@lru_cache(maxsize = None)
+def _compile_patterns(patterns:tuple, flags:int) -> PatternMatcher:
+    return PatternMatcher(patterns, flags)
+
+def get_pattern_matcher(patterns:Iterable[str], ignore_case:bool = False) -> PatternMatcher:
+    """
+        Memoized PatternMatcher for a set of patterns (keyed by the pattern tuple + flags)
+    """
+    return _compile_patterns(tuple(patterns), re.IGNORECASE if ignore_case else 0)
+
 def get_matching(objects:dict[str,pd.DataFrame], object_type:str, patterns:Iterable[str])-> set: 
     """
         Find all objects of type {object_type} in the Snowflake account matching {patterns} 
@@ -65,47 +175,43 @@ def get_matching(objects:dict[str,pd.DataFrame], object_type:str, patterns:Itera
     """
     # Snowflake object names are not unique unless they are fully qualified
     # unfortunately... that query is a little different for each object type
-
-    matches = set()
-
-    # Snowflake only recognizes "Stages" as an object type....
-    # but internal stages have different privileges than external stages
-    generalized_object_type = 'stage' if object_type.endswith('stage') else object_type
-    generalized_object_type = 'integration' if object_type.endswith('integration') else generalized_object_type
-
-    dataframe = objects[object_type].copy()
-    # Construct the filter clause for the regex match: the constructed full name
-    # must match one of the patterns in the atomic group. As such: 
-    #
-    # re.match('{pattern_1}', ful_name)
-    # or
-    # re.match('{pattern_2}',full_name)
-    # or
-    # .
-    # .
-    # .
-    # re.match('{pattern_n}', full_name)
-    regexp_match = lambda name: object_matches_any(name,patterns)
-    dataframe = dataframe[dataframe['FULL_NAME'].apply(regexp_match)]
+    # Only the databases/schemas the patterns' literal prefixes allow are visited (see catalog_index.py)
+    dataframe = candidate_rows(objects[object_type], object_type, patterns)
+    # The constructed full name must match one of the patterns in the atomic group. 
+    # All patterns are compiled into one alternation and matched against the whole column at once
+    matcher = get_pattern_matcher(patterns, ignore_case = True)
+    mask = matcher.mask(dataframe['FULL_NAME'])
     if object_type == 'view': 
-        dataframe = dataframe[dataframe['schema_name']!= 'INFORMATION_SCHEMA']
-    if len(dataframe): 
-        matches |= set(dataframe['FULL_NAME'])
-    return matches
+        mask &= dataframe['schema_name'] != 'INFORMATION_SCHEMA'
+    return set(dataframe.loc[mask, 'FULL_NAME'])
+
+def container_columns(object_type:str, dataframe:pd.DataFrame) -> list[str]:
+    """
+        The columns naming the database (and schema) an object of {object_type} is in: every part of its FULL_NAME but the last
+    """
+    key = GET_FULL_NAME.get(object_type) or GET_FULL_NAME.get(DETAILED_OBJECT_TYPE_MAPPER.get(object_type), ALO_FULL_NAME)
+    containers = key[:-1]
+    return containers if all(column in dataframe.columns for column in containers) else []
+
+def candidate_rows(dataframe:pd.DataFrame, object_type:str, patterns:Iterable[str]) -> pd.DataFrame:
+    """
+        The rows of {dataframe} in the databases/schemas {patterns} can match (all of them when that can't be narrowed down)
+    """
+    rows = catalog_index(dataframe, container_columns(object_type, dataframe)).rows(patterns)
+    return dataframe if rows is None else dataframe.iloc[rows]
 
 def object_matches_any(name:str,patterns:list):
-    return any([re.match(pattern,name, re.IGNORECASE) for pattern in patterns]) 
+    return get_pattern_matcher(patterns, ignore_case = True).match(name)
 
 def get_futures(objects:dict[str,pd.DataFrame],object_type:str,patterns:Iterable[str]):
-    regexp_match = lambda name: any([re.match(pattern,name) for pattern in patterns])
     if object_type.lower() != 'schema':
-        dataframe = objects['schema'].copy()
-        dataframe = dataframe[dataframe['name']!='INFORMATION_SCHEMA']
+        dataframe = candidate_rows(objects['schema'], 'schema', patterns)
+        mask = dataframe['name']!='INFORMATION_SCHEMA'
     else:
-        dataframe = objects['database'].copy()
-        dataframe = dataframe[dataframe['name']!='SNOWFLAKE']
-    dataframe = dataframe[dataframe['FULL_NAME'].apply(regexp_match)]
-    return set(dataframe['FULL_NAME'])
+        dataframe = objects['database']
+        mask = dataframe['name']!='SNOWFLAKE'
+    mask &= get_pattern_matcher(patterns).mask(dataframe['FULL_NAME'])
+    return set(dataframe.loc[mask, 'FULL_NAME'])
 
 def pluralize(word:str):
     if word: 
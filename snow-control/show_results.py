@@ -0,0 +1,84 @@
+import re
+import pandas as pd
+from sf_object_structures import match_column
+
+# Client side equivalents of the result_scan follow ups in queries.py, applied straight to the SHOW
+# results so every metadata lookup is a single round trip (ControlState.fetch_mode = 'local').
+# They have to stay in line with the SQL versions, including its quirks:
+#   - LIKE is case sensitive and '_' matches any single character
+#   - a NULL in any filtered column drops the row
+#   - concat_ws returns NULL if any of its arguments is NULL
+
+KAFKA_CONNECTOR = re.compile(r'.*SNOWFLAKE.KAFKA.CONNECTOR', re.DOTALL) # like '%SNOWFLAKE_KAFKA_CONNECTOR%'
+SNOWFLAKE_PREFIX = re.compile(r'SNOWFLAKE', re.DOTALL)                  # like 'SNOWFLAKE%'
+FUTURE_PLACEHOLDER = re.compile(r'[.][<].*[>]$')
+
+
+def show_frame(cur) -> pd.DataFrame:
+    """
+        The results of the SHOW query last executed on {cur}, with SHOW's (lower case) column names
+    """
+    return pd.DataFrame(cur.fetchall(), columns = [column[0] for column in cur.description], dtype = object)
+
+def not_null(df:pd.DataFrame, *columns) -> pd.Series:
+    return df[list(columns)].notna().all(axis = 1)
+
+def column_matches(column:pd.Series, regex:re.Pattern) -> pd.Series:
+    return match_column(column, [regex])
+
+def common_name_filter(df:pd.DataFrame) -> pd.Series:
+    return (
+        not_null(df, 'name')
+        & ~column_matches(df['name'], KAFKA_CONNECTOR)
+        & (df['name'] != 'INFORMATION_SCHEMA')
+    )
+
+def name_frame(df:pd.DataFrame, key:list[str]) -> pd.DataFrame:
+    """
+        NAME_QUERY: every SHOW column plus FULL_NAME = concat_ws('.', key)
+    """
+    df = df[common_name_filter(df)]
+    parts = [df[column].astype('string') for column in key]
+    # str.cat without na_rep is NULL if any part is NULL, like concat_ws
+    full_name = parts[0].str.cat(parts[1:], sep = '.') if len(parts) > 1 else parts[0]
+    return df.assign(FULL_NAME = full_name.astype(object).where(full_name.notna(), None)).reset_index(drop = True)
+
+def grant_rows(df:pd.DataFrame, granted_on:str) -> pd.DataFrame:
+    """
+        Shared filters of CURRENT_GRANTS_TO_ROLE / FUTURE_GRANTS_TO_ROLE
+    """
+    if df.empty:
+        return df
+    mask = (
+        common_name_filter(df)
+        & not_null(df, 'privilege', granted_on)
+        & (df['privilege'] != 'OWNERSHIP')
+        & (df[granted_on] != 'ROLE')
+        & ~column_matches(df['name'], SNOWFLAKE_PREFIX)
+    )
+    return df[mask]
+
+def current_grant_rows(cur) -> list[tuple]:
+    """
+        CURRENT_GRANTS_TO_ROLE: (privilege, granted_on, name)
+    """
+    df = grant_rows(show_frame(cur), 'granted_on')
+    if df.empty:
+        return []
+    return list(zip(df['privilege'], df['granted_on'].str.replace('_',' ', regex = False), df['name']))
+
+def future_grant_rows(cur) -> list[tuple]:
+    """
+        FUTURE_GRANTS_TO_ROLE: (privilege, grant_on, container the future grant is on)
+    """
+    df = grant_rows(show_frame(cur), 'grant_on')
+    if df.empty:
+        return []
+    return list(zip(df['privilege'], df['grant_on'].str.replace('_',' ', regex = False), [FUTURE_PLACEHOLDER.sub('', name) for name in df['name']]))
+
+def user_role_rows(cur) -> list[tuple]:
+    """
+        RETRIEVE_GRANTS_TO_USER_QUERY: (role,)
+    """
+    df = show_frame(cur)
+    return [(role,) for role in df['role']] if not df.empty else []
@@ -0,0 +1,232 @@
+import os
+import json
+import threading
+import numpy as np
+from grant_store import decode_grants
+from typing import Iterable, Iterator, Tuple
+
+# .snowplan is newline delimited JSON:
+#   {"format": "ndjson", "plan_id": ..., "roles": [...], "plan_users": ...}     header
+#   {"ROLES": "<role>", "plan": {"to_revoke": [...], "ok": [...], "to_grant": [...]}}
+#   {"USERS": "<user>", "plan": {...}}
+#   a role record can also carry the "fingerprint" of everything its plan was computed from (see plan.role_fingerprint)
+#   {"complete": true}                                                          footer, once every record is written
+# Records are appended (and flushed) as each role/user is planned, so the file can be read back lazily
+# one record at a time, and a plan run that died half way can pick up from the last record written.
+# A plan written before this format (one indented JSON document) is still readable
+STREAMING_FORMAT = 'ndjson'
+SECTIONS = ('ROLES','USERS')
+# Bytes read at a time when looking for the end of the last complete record of an unfinished plan
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def json_line(record:dict) -> str:
+    return json.dumps(record, separators = (',',':')) + '\n'
+
+def serialize_plan(plan:dict) -> dict:
+    # Role plans hold grant keys (see grant_store.py), which are only turned back into strings here
+    return {delta_type: decode_grants(delta) if isinstance(delta, np.ndarray) else list(delta) for delta_type, delta in plan.items()}
+
+
+class PlanSection:
+    """
+        The ROLES or USERS of a Snowplan. Behaves like the dict of the old format as far as
+        reading goes ({recipient: plan}.items()), but reads the file again on every pass instead of holding it
+    """
+    def __init__(self, snowplan:'Snowplan', section:str, recipients:Iterable[str] = None):
+        self.snowplan = snowplan
+        self.section = section
+        self.recipients = {recipient.upper() for recipient in recipients} if recipients is not None else None
+
+    def only(self, recipients:Iterable[str]) -> 'PlanSection':
+        return PlanSection(self.snowplan, self.section, recipients)
+
+    def items(self) -> Iterator[Tuple[str,dict]]:
+        for section, recipient, plan in self.snowplan.records():
+            if section == self.section and (self.recipients is None or recipient.upper() in self.recipients):
+                yield recipient, plan
+
+    def keys(self) -> Iterator[str]:
+        return (recipient for recipient, _ in self.items())
+
+    __iter__ = keys
+
+
+class Snowplan:
+    """
+        Lazy reader of a .snowplan file. snowplan['plan_id'], snowplan['ROLES'] and snowplan['USERS']
+        work like they did on the parsed JSON document, but only the header is read up front
+    """
+    def __init__(self, path:str):
+        self.path = path
+        with open(path,'r') as f:
+            first_line = f.readline()
+            try:
+                header = json.loads(first_line)
+            except json.JSONDecodeError:
+                header = None
+            if header and header.get('format') == STREAMING_FORMAT:
+                self.header, self.legacy = header, None
+            else:
+                f.seek(0)
+                self.legacy = json.loads(f.read())
+                self.header = {'plan_id': self.legacy['plan_id']}
+
+    @property
+    def plan_id(self) -> int:
+        return self.header['plan_id']
+
+    def __getitem__(self, key:str):
+        if key == 'plan_id':
+            return self.plan_id
+        if key in SECTIONS:
+            return PlanSection(self, key)
+        raise KeyError(key)
+
+    def records(self) -> Iterator[Tuple[str,str,dict]]:
+        """
+            (section, recipient, plan) for every role/user in the plan, in the order they were written.
+            A partly written (crashed) last line is skipped
+        """
+        if self.legacy is not None:
+            for section in SECTIONS:
+                for recipient, plan in self.legacy[section].items():
+                    yield section, recipient, plan
+            return
+        with open(self.path,'r') as f:
+            f.readline()
+            for line in f:
+                if not line.endswith('\n'):
+                    return
+                record = json.loads(line)
+                for section in SECTIONS:
+                    if section in record:
+                        yield section, record[section], record['plan']
+
+    def fingerprints(self, section:str = 'ROLES') -> dict[str,Tuple[str,int]]:
+        """
+            {recipient: (fingerprint, offset of its record)} for the records of {section} written with a fingerprint
+        """
+        found = {}
+        if self.legacy is not None:
+            return found
+        with open(self.path,'rb') as f:
+            offset = len(f.readline())
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                record = json.loads(line)
+                if section in record and 'fingerprint' in record:
+                    found[record[section]] = (record['fingerprint'], offset)
+                offset += len(line)
+        return found
+
+    def plan_at(self, offset:int) -> dict:
+        """
+            The plan of the record starting at {offset} (see fingerprints)
+        """
+        with open(self.path,'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['plan']
+
+    def completed(self) -> dict[str,set]:
+        """
+            {section: recipients with a record in the file}
+        """
+        done = {section: set() for section in SECTIONS}
+        for section, recipient, _ in self.records():
+            done[section].add(recipient)
+        return done
+
+    def is_complete(self) -> bool:
+        if self.legacy is not None:
+            return True
+        with open(self.path,'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 64))
+            return f.read().rstrip(b'\n').endswith(json_line({'complete': True}).strip().encode())
+
+
+class SnowplanWriter:
+    """
+        Appends role/user records to a .snowplan as they are planned (thread safe, flushed per record).
+
+        With {resume}, an unfinished plan in {path} for the same roles is continued instead of replaced:
+        its plan_id is kept, a partly written last record is cut off and writer.done holds the roles and users
+        that don't need to be planned again
+    """
+    def __init__(self, path:str, plan_id:int, roles:Iterable[str], plan_users:bool, resume:bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        header = {'format': STREAMING_FORMAT, 'plan_id': plan_id, 'roles': sorted(roles), 'plan_users': plan_users}
+        self.done = {section: set() for section in SECTIONS}
+        previous = self.resumable(header) if resume else None
+        if previous:
+            self.header = previous.header
+            self.done = previous.completed()
+            self.truncate_partial_record()
+            self.file = open(path,'a')
+        else:
+            self.header = header
+            self.file = open(path,'w')
+            self.file.write(json_line(header))
+            self.file.flush()
+
+    @property
+    def plan_id(self) -> int:
+        return self.header['plan_id']
+
+    def resumable(self, header:dict) -> Snowplan:
+        """
+            The plan in {path}, if it is an unfinished streaming plan of the same roles
+        """
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return None
+        try:
+            previous = Snowplan(self.path)
+        except (json.JSONDecodeError, KeyError):
+            return None
+        same_plan = all(previous.header.get(key) == header[key] for key in ('format','roles','plan_users'))
+        return previous if same_plan and not previous.is_complete() else None
+
+    def truncate_partial_record(self) -> None:
+        # Only what follows the last newline can be partial: look for it from the end, a block at a time
+        with open(self.path,'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - TAIL_BLOCK_SIZE)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                end = start
+            f.truncate(0)
+
+    def write(self, section:str, plans:dict, fingerprints:dict = None) -> None:
+        """
+            Append {recipient: plan} (the output of plan_single_role / plan_single_user) to {section},
+            with the recipient's fingerprint if {fingerprints} has one
+        """
+        fingerprints = fingerprints or {}
+        lines = ''.join(
+            json_line({section: recipient, 'plan': serialize_plan(plan)} | ({'fingerprint': fingerprints[recipient]} if fingerprints.get(recipient) else {}))
+            for recipient, plan in plans.items()
+        )
+        with self._lock:
+            self.file.write(lines)
+            self.file.flush()
+            self.done[section].update(plans)
+
+    def close(self, complete:bool = True) -> None:
+        with self._lock:
+            if complete:
+                self.file.write(json_line({'complete': True}))
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed run leaves the file without a footer, so it can be resumed
+        self.close(complete = exc_type is None)
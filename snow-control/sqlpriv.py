@@ -1,8 +1,20 @@
-from load import get_plan_from_cache, write_out_sql_snowplan
+from load import get_plan_from_cache, write_out_sql_snowplan, load_role_configuarations
 
-def gen_queries(account:str, snowplan:dict) -> list:
+def gen_queries(account:str, snowplan:dict, objects = None) -> list:
+    """
+        GRANT/REVOKE statements of the plan, as tuples of words. With the cached registry of {objects},
+        each role's grants are first coalesced into fewer statements (see coalesce.py)
+    """
     queries = []
+    coverage = None
+    if objects is not None:
+        # Only coalescing needs pandas (and the role configs)
+        from coalesce import SchemaCoverage, coalesce_plan, schema_wide_grants
+        coverage = SchemaCoverage(objects)
+        role_configs, role_profiles = load_role_configuarations(account)
     for role,config in snowplan['ROLES'].items():
+        if coverage is not None:
+            config = coalesce_plan(config, coverage, schema_wide_grants(objects, role_configs.get(role), role_profiles))
         role_queries = [
             gen_grant_to_role(*priv,delta='-',grant_target=role) for priv in config['to_revoke']
         ]+[
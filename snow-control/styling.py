@@ -1,13 +1,31 @@
 from colorama import Fore, Style
 from typing import Callable
+from functools import wraps
+from tracing import span
 import time 
 import os
+import sys
 from getpass import getpass
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
 
 CHECKMARK = '\u2714'
 GREEN_CHECKMARK = Fore.GREEN + Style.BRIGHT + CHECKMARK  + Style.RESET_ALL
 RED_X = Fore.RED + Style.BRIGHT+' X ' + Style.RESET_ALL
-STYLING = {
+class Styling(dict):
+    """
+        Placeholders for the interactive text files (txt.format_map(STYLING)).
+        ORGANIZATION is only looked up in the environment when a text actually uses it
+    """
+    def __missing__(self, key:str) -> str:
+        if key == 'ORGANIZATION':
+            return os.environ['SNOWFLAKE_ORGANIZATION']
+        raise KeyError(key)
+
+STYLING = Styling({
     'bright': Style.BRIGHT, 
     'dim':Style.DIM,
     'normal': Style.NORMAL, 
@@ -16,17 +34,33 @@ STYLING = {
     'yellow':Fore.YELLOW,
     'green':Fore.GREEN,
     'red':Fore.RED,
-    'ORGANIZATION':os.environ['SNOWFLAKE_ORGANIZATION']
-}
+})
 
 def time_func(func: Callable) -> Callable: 
+    """
+        Run {func} as a stage span of the current trace (see tracing.py) and print how long it took
+    """
+    @wraps(func)
     def inner(*args, **kwargs): 
-        start = time.time()
-        return_val = func(*args, **kwargs)
-        print(f'\n{Style.BRIGHT}Function {func.__name__} took {Fore.YELLOW}{time.time()-start:.2f} {Style.RESET_ALL + Style.BRIGHT} seconds')
+        with span(func.__name__, cat = 'stage') as stage:
+            return_val = func(*args, **kwargs)
+            peak = peak_memory_mb()
+            stage.set(peak_rss_mb = peak)
+        memory = f', peak memory {Fore.YELLOW}{peak:.0f} {Style.RESET_ALL + Style.BRIGHT}MB' if peak is not None else ''
+        print(f'\n{Style.BRIGHT}Function {func.__name__} took {Fore.YELLOW}{stage.seconds:.2f} {Style.RESET_ALL + Style.BRIGHT} seconds{memory}')
         return return_val
     return inner
 
+def peak_memory_mb() -> float:
+    """
+        Peak resident memory of the process so far, in MB (None where the platform doesn't report it)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
 def cli_input(input_text):
     # Make input text clearly distinct
     PASSWORD_KEYWORD = '[password]'
@@ -0,0 +1,70 @@
+"""
+    ShowGrantSource and AccountUsageGrantSource have to agree on the grants of every role: plan compares
+    them with the same target grants whichever source read them. Run from snow-control/:
+
+        python -m pytest tests
+"""
+import os
+import pytest
+from benchmark.synthetic import SyntheticAccount
+
+# (SHOW GRANTS granted_on, SHOW GRANTS name, ACCOUNT_USAGE (table_catalog, table_schema, name)) of grants whose
+# names SHOW quotes and ACCOUNT_USAGE doesn't
+QUOTED_GRANTS = [
+    ('DATABASE', '"lower_db"', (None, None, 'lower_db')),
+    ('SCHEMA', 'DB_000."Mixed Case"', ('DB_000', None, 'Mixed Case')),
+    ('TABLE', 'DB_000.SCH_000."lower tbl"', ('DB_000', 'SCH_000', 'lower tbl')),
+    ('TABLE', 'DB_000.SCH_000."say ""hi"""', ('DB_000', 'SCH_000', 'say "hi"')),
+    ('VIEW', 'DB_000.SCH_000.VW$1', ('DB_000', 'SCH_000', 'VW$1')),
+    ('FUNCTION', 'DB_000.SCH_000."ADD_ONE(X NUMBER):NUMBER(38,0)"', ('DB_000', 'SCH_000', 'ADD_ONE(X NUMBER):NUMBER(38,0)')),
+    ('PROCEDURE', 'DB_000.SCH_000."LOAD(SRC VARCHAR, N FLOAT):TABLE (ID NUMBER)"', ('DB_000', 'SCH_000', 'LOAD(SRC VARCHAR, N FLOAT):TABLE (ID NUMBER)')),
+    ('WAREHOUSE', 'WH_0', (None, None, 'WH_0')),
+]
+
+
+@pytest.fixture(scope = 'module')
+def account(tmp_path_factory):
+    account = SyntheticAccount(databases = 2, schemas = 2, tables = 5, views = 2, functions = 5, procedures = 2, roles = 4, users = 2)
+    role = sorted(account.grants)[0]
+    for granted_on, name, parts in QUOTED_GRANTS:
+        account.grants[role].append(account.grant_row(role, 'USAGE', granted_on, name, parts))
+    config_dir = str(tmp_path_factory.mktemp('config'))
+    account.write_config(config_dir)
+    # load.py reads CONTROL_CONFIG_DIR when it is first imported
+    os.environ['CONTROL_CONFIG_DIR'] = config_dir
+    return account
+
+def grant_sources(account, fetch_mode:str):
+    from benchmark.fake_connector import FakeSnowflake
+    from control_state import ControlState
+    from grant_sources import ShowGrantSource, AccountUsageGrantSource
+    server = FakeSnowflake(account)
+    state = ControlState(verbosity = 0, max_workers = 4)
+    state.account = account.name
+    state.connection = server.connect()
+    state.fetch_mode = fetch_mode
+    account_usage = AccountUsageGrantSource(state)
+    account_usage.prefetch(list(account.grants))
+    return ShowGrantSource(state), account_usage
+
+@pytest.mark.parametrize('fetch_mode', ['result_scan','local'])
+def test_show_and_account_usage_grants_match(account, fetch_mode):
+    show, account_usage = grant_sources(account, fetch_mode)
+    for role in account.grants:
+        assert account_usage.grants_to_role(role) == show.grants_to_role(role)
+
+def test_quoted_names_and_signatures(account):
+    show, account_usage = grant_sources(account, 'result_scan')
+    role = sorted(account.grants)[0]
+    current, _ = account_usage.grants_to_role(role)
+    assert current == show.grants_to_role(role)[0]
+    assert {
+        ('USAGE','DATABASE','"lower_db"'),
+        ('USAGE','SCHEMA','DB_000."Mixed Case"'),
+        ('USAGE','TABLE','DB_000.SCH_000."lower tbl"'),
+        ('USAGE','TABLE','DB_000.SCH_000."say ""hi"""'),
+        ('USAGE','VIEW','DB_000.SCH_000.VW$1'),
+        ('USAGE','FUNCTION','DB_000.SCH_000.ADD_ONE(NUMBER)'),
+        ('USAGE','PROCEDURE','DB_000.SCH_000.LOAD(VARCHAR,FLOAT)'),
+        ('USAGE','WAREHOUSE','WH_0'),
+    } <= current
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Every statement control issues is tagged CONTROL (see initialize_connection). While a trace is recording,
+# each statement is tagged CONTROL:{run id}:{operation} instead, so the run's rows in QUERY_HISTORY
+# can be joined back to its trace on query_tag (and query_id)
+QUERY_TAG_PREFIX = 'CONTROL'
+MAX_QUERY_TAG_LENGTH = 2000
+
+
+class Span:
+    """
+        A timed operation: a stage (get, plan, ...), an object type's SHOW, a role's grant fetch, an apply statement, ...
+        {args} carries whatever is known about it (query id, rows returned, role, error)
+    """
+    __slots__ = 'name','cat','args','start','end','tid'
+
+    def __init__(self, name:str, cat:str, args:dict, tid:int):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.tid = tid
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+    @property
+    def seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Tracer:
+    """
+        Records spans for the duration of a run (start() ... export()). When no run is recording,
+        spans are still timed (time_func reports from them) but aren't kept
+    """
+    def __init__(self):
+        self.enabled = False
+        self.run_id = None
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._lanes = itertools.count(1000)
+
+    def start(self, run_name:str) -> str:
+        with self._lock:
+            self.run_id = f'{int(time.time())}-{run_name}'
+            self.spans = []
+            self.origin = time.perf_counter()
+            self.enabled = True
+        return self.run_id
+
+    def stop(self) -> list[Span]:
+        with self._lock:
+            self.enabled = False
+            spans, self.spans = self.spans, []
+        return spans
+
+    def thread_id(self) -> int:
+        ident = threading.get_ident()
+        if ident not in self._threads:
+            with self._lock:
+                self._threads.setdefault(ident, len(self._threads) + 1)
+        return self._threads[ident]
+
+    def lane(self) -> int:
+        """
+            A track of its own, for spans that overlap others on the same thread (coroutines)
+        """
+        return next(self._lanes)
+
+    @contextmanager
+    def span(self, name:str, cat:str = 'control', lane:int = None, **args):
+        current = Span(name, cat, args, lane if lane is not None else self.thread_id())
+        try:
+            yield current
+        except BaseException as e:
+            current.set(error = type(e).__name__, errno = getattr(e, 'errno', None))
+            raise
+        finally:
+            current.end = time.perf_counter()
+            if self.enabled:
+                with self._lock:
+                    self.spans.append(current)
+
+    def query_tag(self, operation:str) -> str:
+        return f'{QUERY_TAG_PREFIX}:{self.run_id}:{operation}'[:MAX_QUERY_TAG_LENGTH]
+
+    def statement_params(self, operation:str) -> dict:
+        """
+            Extra keyword arguments for cursor.execute/execute_async, tagging the statement with its operation while recording
+        """
+        return {'_statement_params': {'QUERY_TAG': self.query_tag(operation)}} if self.enabled else {}
+
+    def tag_span(self, current:Span, statement_params:dict) -> None:
+        if statement_params:
+            current.set(query_tag = statement_params['_statement_params']['QUERY_TAG'])
+
+    def chrome_trace(self, spans:list[Span]) -> dict:
+        """
+            Chrome trace event format (chrome://tracing, ui.perfetto.dev): one complete event per span, in microseconds
+        """
+        return {
+            'traceEvents': [
+                {
+                    'name': span.name,
+                    'cat': span.cat,
+                    'ph': 'X',
+                    'ts': round((span.start - self.origin) * 1e6, 1),
+                    'dur': round((span.end - span.start) * 1e6, 1),
+                    'pid': os.getpid(),
+                    'tid': span.tid,
+                    'args': span.args,
+                }
+                for span in sorted(spans, key = lambda span: span.start)
+            ],
+            'displayTimeUnit': 'ms',
+            'otherData': {'run_id': self.run_id},
+        }
+
+    def export(self, path:str) -> str:
+        """
+            Stop recording and write the run's spans to {path} as a Chrome trace
+        """
+        trace = self.chrome_trace(self.stop())
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump(trace, f, default = str)
+        return path
+
+
+TRACER = Tracer()
+span = TRACER.span
+
+def traced_execute(cur, query:str, operation:str, cat:str = 'query', **args):
+    """
+        cur.execute(query) inside a span named {operation}, tagged with the operation and carrying the query id,
+        rows returned and latency. Returns the cursor like execute does
+    """
+    with span(operation, cat = cat, **args) as current:
+        statement_params = TRACER.statement_params(operation)
+        TRACER.tag_span(current, statement_params)
+        try:
+            cur.execute(query, **statement_params)
+        finally:
+            current.set(qid = cur.sfqid, rows = getattr(cur, 'rowcount', None))
+    return cur